@@ -3,21 +3,11 @@
 # Activate environment
 source activate sonyc-ust
 
-# Extract embeddings
+# Extract embeddings, then train and evaluate fine-level and coarse-level
+# models. Stages whose inputs have not changed since the last run are
+# skipped, and the two levels run concurrently.
 pushd urban-sound-tagging-baseline
-python extract_embedding.py $SONYC_UST_PATH/data/annotations.csv $SONYC_UST_PATH/data $SONYC_UST_PATH/features $SONYC_UST_PATH/vggish
-
-# Train fine-level model and produce predictions
-python classify.py $SONYC_UST_PATH/data/annotations.csv $SONYC_UST_PATH/data/dcase-ust-taxonomy.yaml $SONYC_UST_PATH/features/vggish $SONYC_UST_PATH/output baseline_fine --label_mode fine
-
-# Evaluate model based on AUPRC metric
-python evaluate_predictions.py $SONYC_UST_PATH/output/baseline_fine/*/output_mean.csv $SONYC_UST_PATH/data/annotations.csv $SONYC_UST_PATH/data/dcase-ust-taxonomy.yaml
-
-# Train coarse-level model and produce predictions
-python classify.py $SONYC_UST_PATH/data/annotations.csv $SONYC_UST_PATH/data/dcase-ust-taxonomy.yaml $SONYC_UST_PATH/features/vggish $SONYC_UST_PATH/output baseline_coarse --label_mode coarse
-
-# Evaluate model based on AUPRC metrics
-python evaluate_predictions.py $SONYC_UST_PATH/output/baseline_coarse/*/output_mean.csv $SONYC_UST_PATH/data/annotations.csv $SONYC_UST_PATH/data/dcase-ust-taxonomy.yaml
+python run_pipeline.py $SONYC_UST_PATH/data/annotations.csv $SONYC_UST_PATH/data/dcase-ust-taxonomy.yaml $SONYC_UST_PATH/data $SONYC_UST_PATH/vggish $SONYC_UST_PATH/features $SONYC_UST_PATH/output
 
 # Return to the base directory
 popd
@@ -0,0 +1,464 @@
+import argparse
+import os
+import time
+import tracemalloc
+import numpy as np
+import oyaml as yaml
+import pandas as pd
+
+from metrics import evaluate, evaluate_df, micro_averaged_auprc, \
+                    micro_averaged_counts, _micro_averaged_counts_loop, \
+                    macro_averaged_auprc, threshold_counts_fine, \
+                    threshold_counts_coarse, load_taxonomy, \
+                    parse_ground_truth, parse_fine_prediction, \
+                    parse_coarse_prediction
+from taxonomy import compile_taxonomy
+
+
+# Ways of counting TP, FP, and FN in `metrics.evaluate_df`. "loop" is the
+# reference implementation.
+METHODS = ('loop', 'sort', 'binned')
+
+
+## SYNTHETIC DATA
+
+def make_taxonomy(n_coarse, n_fine):
+    """
+    Make a taxonomy with the given number of coarse categories and of
+    complete fine tags per category, each with an incomplete fine tag.
+
+    Parameters
+    ----------
+    n_coarse
+    n_fine
+
+    Returns
+    -------
+    yaml_dict
+
+    """
+    fine_dict = {}
+    coarse_dict = {}
+    for coarse_id in range(1, n_coarse + 1):
+        coarse_dict[coarse_id] = "coarse-{}".format(coarse_id)
+        fine_dict[coarse_id] = {
+            fine_id: "fine-{}-{}".format(coarse_id, fine_id)
+            for fine_id in range(1, n_fine + 1)}
+        fine_dict[coarse_id]['X'] = "fine-{}-unknown".format(coarse_id)
+    return {'fine': fine_dict, 'coarse': coarse_dict}
+
+
+def make_annotations(yaml_dict, n_files, frac_incomplete=0.1, prevalence=0.2,
+                     seed=0):
+    """
+    Make the ground truth annotations of synthetic files, with the layout
+    of the annotation file of the dataset.
+
+    Parameters
+    ----------
+    yaml_dict
+    n_files
+    frac_incomplete
+        Probability that the incomplete tag of a coarse category is present.
+    prevalence
+        Probability that a complete fine tag is present.
+    seed
+
+    Returns
+    -------
+    annotation_df
+
+    """
+    taxonomy = compile_taxonomy(yaml_dict)
+    rng = np.random.RandomState(seed)
+
+    p = np.where(taxonomy.is_incomplete, frac_incomplete, prevalence)
+    is_fine_present = rng.rand(len(p), n_files) < p[:, np.newaxis]
+    # A coarse category is present if any of its fine tags is
+    is_present = np.logical_or.reduceat(
+        is_fine_present, taxonomy.fine_segment_bounds[:-1], axis=0)
+
+    columns = {
+        'audio_filename': ["{:08d}.wav".format(idx) for idx in range(n_files)],
+        'annotator_id': np.zeros(n_files, dtype=int),
+        'split': np.full(n_files, 'validate'),
+    }
+    columns.update(zip(taxonomy.full_fine_presence_columns,
+                       is_fine_present.astype(int)))
+    columns.update(zip(taxonomy.coarse_presence_columns,
+                       is_present.astype(int)))
+    return pd.DataFrame(columns)
+
+
+def make_predictions(yaml_dict, annotation_df, decimals=3, seed=0):
+    """
+    Make noisy predictions of synthetic annotations, with the layout of the
+    output files of `classify.py`. Rounding the predictions creates ties
+    between them.
+
+    Parameters
+    ----------
+    yaml_dict
+    annotation_df
+    decimals
+    seed
+
+    Returns
+    -------
+    pred_df
+
+    """
+    taxonomy = compile_taxonomy(yaml_dict)
+    rng = np.random.RandomState(seed + 1)
+    n_files = len(annotation_df)
+    columns = {'audio_filename': annotation_df['audio_filename'].values}
+
+    for label in taxonomy.full_fine_labels + taxonomy.coarse_labels:
+        y_true = annotation_df[label + "_presence"].values
+        y_pred = 0.6 * rng.rand(n_files) + 0.4 * y_true \
+            + 0.1 * rng.randn(n_files)
+        y_pred = np.clip(y_pred, 0, 1)
+        if decimals is not None:
+            y_pred = np.round(y_pred, decimals)
+        columns[label] = y_pred
+    return pd.DataFrame(columns)
+
+
+def write_synthetic_dataset(output_dir, n_files, n_coarse=8, n_fine=4,
+                            frac_incomplete=0.1, decimals=3, seed=0):
+    """
+    Write a synthetic taxonomy, annotation file, and prediction file.
+
+    Parameters
+    ----------
+    output_dir
+    n_files
+    n_coarse
+    n_fine
+    frac_incomplete
+    decimals
+    seed
+
+    Returns
+    -------
+    yaml_path
+    annotation_path
+    prediction_path
+
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    yaml_path = os.path.join(output_dir, "taxonomy.yaml")
+    annotation_path = os.path.join(output_dir, "annotations.csv")
+    prediction_path = os.path.join(output_dir, "predictions.csv")
+
+    yaml_dict = make_taxonomy(n_coarse, n_fine)
+    annotation_df = make_annotations(yaml_dict, n_files,
+                                     frac_incomplete=frac_incomplete, seed=seed)
+    pred_df = make_predictions(yaml_dict, annotation_df, decimals=decimals,
+                               seed=seed)
+
+    with open(yaml_path, 'w') as f:
+        yaml.dump(yaml_dict, f)
+    annotation_df.to_csv(annotation_path, index=False)
+    pred_df.to_csv(prediction_path, index=False)
+
+    return yaml_path, annotation_path, prediction_path
+
+
+## EQUIVALENCE
+
+def check_equivalence(prediction_path, annotation_path, yaml_path, mode,
+                      n_bins=1000):
+    """
+    Check that the optimized evaluation gives exactly the same curves of
+    TP, FP, and FN, and the same AUPRC, as the reference implementation,
+    and that binned counts are exact at the thresholds of their grid.
+    Raises an AssertionError otherwise.
+
+    Parameters
+    ----------
+    prediction_path
+    annotation_path
+    yaml_path
+    mode
+    n_bins
+
+    Returns
+    -------
+
+    """
+    yaml_dict = load_taxonomy(yaml_path)
+    taxonomy = compile_taxonomy(yaml_dict)
+    gt_df = parse_ground_truth(annotation_path, yaml_dict)
+    audio_filenames = gt_df['audio_filename'].values
+    if mode == "fine":
+        pred_df = parse_fine_prediction(prediction_path, yaml_dict,
+                                        audio_filenames)
+    else:
+        pred_df = parse_coarse_prediction(prediction_path, yaml_dict,
+                                          audio_filenames)
+
+    reference = evaluate_df(pred_df, gt_df, yaml_dict, mode, method="loop")
+    optimized = evaluate_df(pred_df, gt_df, yaml_dict, mode, method="sort")
+    for coarse_id in reference:
+        pd.testing.assert_frame_equal(optimized[coarse_id],
+                                      reference[coarse_id],
+                                      check_dtype=False, check_exact=True)
+
+    for counts, reference_counts in zip(
+            micro_averaged_counts(optimized),
+            _micro_averaged_counts_loop(reference)):
+        np.testing.assert_array_equal(counts, reference_counts)
+
+    assert micro_averaged_auprc(optimized) \
+        == micro_averaged_auprc(reference, method="loop")
+    assert macro_averaged_auprc(optimized) == macro_averaged_auprc(reference)
+
+    binned = evaluate_df(pred_df, gt_df, yaml_dict, mode, method="binned",
+                         n_bins=n_bins)
+    for coarse_id, eval_df in binned.items():
+        columns = taxonomy.get_category_columns(coarse_id, mode)
+        thresholds = eval_df["threshold"].values
+        if mode == "fine":
+            incomplete_tag = str(coarse_id) + "-X"
+            counts = threshold_counts_fine(
+                gt_df[columns].values, pred_df[columns].values,
+                gt_df[incomplete_tag].values, pred_df[incomplete_tag].values,
+                thresholds)
+        else:
+            counts = threshold_counts_coarse(
+                gt_df[columns].values, pred_df[columns].values, thresholds)
+        for name, values in zip(("TP", "FP", "FN"), counts):
+            np.testing.assert_array_equal(eval_df[name].values, values)
+
+
+## BENCHMARK
+
+def measure(func, *args, **kwargs):
+    """
+    Call a function, measuring its run time and the peak of the memory
+    allocated during the call.
+
+    Parameters
+    ----------
+    func
+    args
+    kwargs
+
+    Returns
+    -------
+    result
+    run_time
+    peak_memory
+
+    """
+    tracemalloc.start()
+    start_time = time.time()
+    result = func(*args, **kwargs)
+    run_time = time.time() - start_time
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, run_time, peak_memory
+
+
+def run_benchmark(output_dir, n_files_list, n_coarse=8, n_fine=4,
+                  frac_incomplete=0.1, decimals=3, methods=METHODS,
+                  n_bins=1000, max_reference_files=2000, check=True, seed=0):
+    """
+    Time the evaluation of synthetic datasets of increasing size with each
+    method, after checking that the methods agree.
+
+    Parameters
+    ----------
+    output_dir
+    n_files_list
+    n_coarse
+    n_fine
+    frac_incomplete
+    decimals
+    methods
+    n_bins
+    max_reference_files
+        Largest number of files evaluated with the slow reference method.
+    check
+    seed
+
+    Returns
+    -------
+    benchmark_df
+        DataFrame with the run time and peak memory of evaluating
+        (`evaluate`) and micro-averaging (`micro_averaged_auprc`) each
+        dataset at each level with each method.
+
+    """
+    rows = []
+    for n_files in n_files_list:
+        data_dir = os.path.join(output_dir, "{}_files".format(n_files))
+        paths = write_synthetic_dataset(data_dir, n_files, n_coarse=n_coarse,
+                                        n_fine=n_fine,
+                                        frac_incomplete=frac_incomplete,
+                                        decimals=decimals, seed=seed)
+        prediction_path = paths[2]
+
+        for mode in ("fine", "coarse"):
+            if check and n_files <= max_reference_files:
+                check_equivalence(prediction_path, paths[1], paths[0], mode,
+                                  n_bins=n_bins)
+
+            for method in methods:
+                if method == "loop" and n_files > max_reference_files:
+                    continue
+
+                df_dict, eval_time, eval_memory = measure(
+                    evaluate, prediction_path, paths[1], paths[0], mode,
+                    method=method, n_bins=n_bins)
+                micro_method = "loop" if method == "loop" else "sort"
+                micro_auprc, micro_time, micro_memory = measure(
+                    micro_averaged_auprc, df_dict, method=micro_method)
+
+                rows.append({
+                    'n_files': n_files,
+                    'mode': mode,
+                    'method': method,
+                    'n_thresholds': sum(len(eval_df)
+                                        for eval_df in df_dict.values()),
+                    'evaluate_time': eval_time,
+                    'evaluate_peak_memory': eval_memory,
+                    'micro_time': micro_time,
+                    'micro_peak_memory': micro_memory,
+                    'micro_auprc': micro_auprc,
+                    'macro_auprc': macro_averaged_auprc(df_dict),
+                })
+                print("* {} files, {} level, {}: evaluate {:.3f}s, "
+                      "micro-averaging {:.3f}s".format(
+                          n_files, mode, method, eval_time, micro_time))
+
+    return pd.DataFrame(rows)
+
+
+
+def run_micro_benchmark(output_dir, n_files_list, n_coarse=8, n_fine=4,
+                        frac_incomplete=0.1, decimals=3,
+                        max_reference_files=10000, seed=0):
+    """
+    Time the micro-averaging of the class-wise curves of synthetic
+    datasets of increasing size, with `micro_averaged_counts` and with its
+    reference implementation, after checking that they give the same
+    counts.
+
+    Parameters
+    ----------
+    output_dir
+    n_files_list
+    n_coarse
+    n_fine
+    frac_incomplete
+    decimals
+    max_reference_files
+        Largest number of files micro-averaged with the slow reference
+        implementation.
+    seed
+
+    Returns
+    -------
+    micro_df
+        DataFrame with the number of thresholds and the run time of each
+        implementation, for each dataset at each level.
+
+    """
+    rows = []
+    for n_files in n_files_list:
+        data_dir = os.path.join(output_dir, "{}_files".format(n_files))
+        paths = write_synthetic_dataset(data_dir, n_files, n_coarse=n_coarse,
+                                        n_fine=n_fine,
+                                        frac_incomplete=frac_incomplete,
+                                        decimals=decimals, seed=seed)
+
+        for mode in ("fine", "coarse"):
+            df_dict = evaluate(paths[2], paths[1], paths[0], mode,
+                               method="sort")
+            counts, sort_time, _ = measure(micro_averaged_counts, df_dict)
+
+            row = {
+                'n_files': n_files,
+                'mode': mode,
+                'n_thresholds': len(counts[0]),
+                'sort_time': sort_time,
+                'loop_time': np.nan,
+                'speedup': np.nan,
+            }
+            if n_files <= max_reference_files:
+                reference_counts, loop_time, _ = measure(
+                    _micro_averaged_counts_loop, df_dict)
+                for values, reference_values in zip(counts, reference_counts):
+                    np.testing.assert_array_equal(values, reference_values)
+                row['loop_time'] = loop_time
+                row['speedup'] = loop_time / max(sort_time, 1e-9)
+
+            rows.append(row)
+            print("* {} files, {} level, micro-averaging over {} thresholds: "
+                  "sort {:.4f}s, loop {:.4f}s".format(
+                      n_files, mode, row['n_thresholds'], sort_time,
+                      row['loop_time']))
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="""
+        Check the optimized evaluation against the reference implementation
+        on synthetic data, and record how the run time and memory of each
+        method scale with the number of files.
+        """)
+    parser.add_argument("output_dir", type=str)
+    parser.add_argument("--n_files", type=int, nargs='+',
+                        default=[100, 300, 1000, 3000, 10000, 30000])
+    parser.add_argument("--n_coarse", type=int, default=8)
+    parser.add_argument("--n_fine", type=int, default=4)
+    parser.add_argument("--frac_incomplete", type=float, default=0.1)
+    parser.add_argument("--decimals", type=int, default=3,
+                        help="Round the predictions to this many decimals. "
+                             "Negative values disable rounding.")
+    parser.add_argument("--methods", type=str, nargs='+', choices=METHODS,
+                        default=list(METHODS))
+    parser.add_argument("--n_bins", type=int, default=1000)
+    parser.add_argument("--max_reference_files", type=int, default=2000)
+    parser.add_argument("--max_micro_reference_files", type=int, default=10000,
+                        help="Largest number of files micro-averaged with the "
+                             "reference implementation.")
+    parser.add_argument("--no_check", action='store_true')
+    parser.add_argument("--no_micro", action='store_true',
+                        help="Skip the benchmark of the micro-averaging.")
+    parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+
+    benchmark_df = run_benchmark(
+        args.output_dir, args.n_files,
+        n_coarse=args.n_coarse,
+        n_fine=args.n_fine,
+        frac_incomplete=args.frac_incomplete,
+        decimals=args.decimals if args.decimals >= 0 else None,
+        methods=args.methods,
+        n_bins=args.n_bins,
+        max_reference_files=args.max_reference_files,
+        check=(not args.no_check),
+        seed=args.seed)
+
+    benchmark_df.to_csv(os.path.join(args.output_dir, "benchmark.csv"),
+                        index=False)
+    print(benchmark_df.to_string(index=False))
+
+    if not args.no_micro:
+        micro_df = run_micro_benchmark(
+            args.output_dir, args.n_files,
+            n_coarse=args.n_coarse,
+            n_fine=args.n_fine,
+            frac_incomplete=args.frac_incomplete,
+            decimals=args.decimals if args.decimals >= 0 else None,
+            max_reference_files=args.max_micro_reference_files,
+            seed=args.seed)
+
+        micro_df.to_csv(os.path.join(args.output_dir, "micro_benchmark.csv"),
+                        index=False)
+        print(micro_df.to_string(index=False))
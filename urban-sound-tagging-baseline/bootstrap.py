@@ -0,0 +1,297 @@
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+
+from metrics import get_thresholds, threshold_counts_fine, \
+                    threshold_counts_coarse, auprc_from_counts
+from taxonomy import compile_taxonomy
+
+
+# Process-local state of each bootstrap worker, set up by `init_worker`
+_worker_state = {}
+
+
+## DATA
+
+def get_category_arrays(pred_df, gt_df, yaml_dict, mode):
+    """
+    Extract the ground truth and predictions of each coarse category as
+    arrays, so that they can be rescored without going through DataFrames.
+
+    Parameters
+    ----------
+    pred_df
+        Predictions, as returned by `parse_fine_prediction` or
+        `parse_coarse_prediction`.
+    gt_df
+        Ground truth, as returned by `parse_ground_truth`.
+    yaml_dict
+    mode
+
+    Returns
+    -------
+    category_arrays
+        List of (coarse_id, arrays) pairs, where arrays holds the
+        ground truth, the predictions, and for the fine level, the ground
+        truth and prediction of the incomplete tag.
+
+    """
+    if list(pred_df['audio_filename']) != list(gt_df['audio_filename']):
+        raise ValueError("File mismatch between ground truth and prediction "
+                         "table.")
+
+    taxonomy = compile_taxonomy(yaml_dict)
+    category_arrays = []
+    for coarse_id in taxonomy.coarse_ids:
+        columns = taxonomy.get_category_columns(coarse_id, mode)
+        arrays = {
+            'y_true': gt_df[columns].values.astype(bool),
+            'y_score': pred_df[columns].values.astype(np.float64),
+        }
+        if mode == "fine":
+            incomplete_tag = str(coarse_id) + "-X"
+            arrays['is_true_incomplete'] = \
+                gt_df[incomplete_tag].values.astype(bool)
+            arrays['y_score_incomplete'] = \
+                pred_df[incomplete_tag].values.astype(np.float64)
+        category_arrays.append((coarse_id, arrays))
+
+    return category_arrays
+
+
+## REPLICATES
+
+def get_replicate_weights(n_files, seed, replicate_idx):
+    """
+    Draw the number of times each file appears in a bootstrap replicate.
+    The weights only depend on the seed and the index of the replicate, so
+    they do not depend on how replicates are split across processes.
+
+    Parameters
+    ----------
+    n_files
+    seed
+    replicate_idx
+
+    Returns
+    -------
+    weights
+
+    """
+    rng = np.random.RandomState([seed, replicate_idx])
+    return rng.multinomial(n_files, np.full(n_files, 1.0 / n_files))
+
+
+def score_replicate(category_arrays, mode, weights, min_threshold=0.01):
+    """
+    Compute the micro-averaged, macro-averaged, and class-wise AUPRC of
+    predictions with files weighted by the number of times they are drawn.
+    With all weights equal to one, the scores are those of
+    `micro_averaged_auprc` and `macro_averaged_auprc`.
+
+    Parameters
+    ----------
+    category_arrays
+        As returned by `get_category_arrays`.
+    mode
+    weights
+    min_threshold
+
+    Returns
+    -------
+    scores
+        Micro-averaged AUPRC, macro-averaged AUPRC, and the AUPRC of each
+        coarse category.
+
+    """
+    is_drawn = weights > 0
+    class_counts = []
+    class_auprcs = []
+
+    for _, arrays in category_arrays:
+        # Thresholds are the values predicted for the drawn files only
+        thresholds = get_thresholds(arrays['y_score'][is_drawn], min_threshold)
+
+        if mode == "fine":
+            counts = threshold_counts_fine(
+                arrays['y_true'], arrays['y_score'],
+                arrays['is_true_incomplete'], arrays['y_score_incomplete'],
+                thresholds, sample_weight=weights)
+        else:
+            counts = threshold_counts_coarse(
+                arrays['y_true'], arrays['y_score'], thresholds,
+                sample_weight=weights)
+
+        class_counts.append((thresholds, counts))
+        class_auprcs.append(auprc_from_counts(*counts))
+
+    # Sum the counts of each category at its lowest threshold above or
+    # equal to each threshold of any category, as in `micro_averaged_counts`
+    all_thresholds = np.unique(
+        np.hstack([thresholds for thresholds, _ in class_counts]))
+    micro_counts = np.zeros((3, len(all_thresholds)), dtype=weights.dtype)
+    for thresholds, counts in class_counts:
+        positions = np.searchsorted(thresholds[::-1], all_thresholds,
+                                    side='left')
+        rows = len(thresholds) - 1 - positions
+        micro_counts += np.asarray(counts)[:, rows]
+
+    micro_auprc = auprc_from_counts(*micro_counts)
+    return np.array([micro_auprc, np.mean(class_auprcs)] + class_auprcs)
+
+
+## WORKERS
+
+def init_worker(category_arrays_list, mode):
+    """
+    Set up a bootstrap worker process with the arrays to score.
+
+    Parameters
+    ----------
+    category_arrays_list
+    mode
+
+    Returns
+    -------
+
+    """
+    _worker_state.update(category_arrays_list=category_arrays_list, mode=mode)
+
+
+def run_replicates(job):
+    """
+    Score a chunk of bootstrap replicates of each prediction table, with the
+    same resampled files for all tables.
+
+    Parameters
+    ----------
+    job
+
+    Returns
+    -------
+    scores
+
+    """
+    seed, replicate_idxs = job
+    category_arrays_list = _worker_state['category_arrays_list']
+    mode = _worker_state['mode']
+    n_files = len(category_arrays_list[0][0][1]['y_true'])
+
+    scores = np.zeros((len(category_arrays_list), len(replicate_idxs),
+                       len(category_arrays_list[0]) + 2))
+    for row, replicate_idx in enumerate(replicate_idxs):
+        weights = get_replicate_weights(n_files, seed, replicate_idx)
+        for table_idx, category_arrays in enumerate(category_arrays_list):
+            scores[table_idx, row] = score_replicate(category_arrays, mode,
+                                                     weights)
+
+    return scores
+
+
+## BOOTSTRAP
+
+def bootstrap_auprc(pred_dfs, gt_df, yaml_dict, mode, n_replicates=1000,
+                    seed=0, n_jobs=1):
+    """
+    Compute the micro-averaged, macro-averaged, and class-wise AUPRC of
+    bootstrap replicates of the evaluated files. When several prediction
+    tables are given, the same files are drawn for all of them, so that
+    their scores can be compared replicate by replicate.
+
+    Parameters
+    ----------
+    pred_dfs
+        List of prediction tables, as returned by `parse_fine_prediction`
+        or `parse_coarse_prediction`.
+    gt_df
+    yaml_dict
+    mode
+    n_replicates
+    seed
+    n_jobs
+
+    Returns
+    -------
+    replicate_dfs
+        For each prediction table, a DataFrame with the scores of each
+        replicate, with columns 'micro_auprc', 'macro_auprc', and the
+        coarse IDs.
+
+    """
+    category_arrays_list = [get_category_arrays(pred_df, gt_df, yaml_dict, mode)
+                            for pred_df in pred_dfs]
+    columns = ['micro_auprc', 'macro_auprc'] \
+        + [coarse_id for coarse_id, _ in category_arrays_list[0]]
+
+    n_jobs = max(1, min(n_jobs, n_replicates))
+    jobs = [(seed, replicate_idxs) for replicate_idxs
+            in np.array_split(np.arange(n_replicates), n_jobs * 4)
+            if len(replicate_idxs) > 0]
+
+    if n_jobs == 1:
+        init_worker(category_arrays_list, mode)
+        chunks = [run_replicates(job) for job in jobs]
+    else:
+        ctx = mp.get_context('spawn')
+        with ctx.Pool(n_jobs, initializer=init_worker,
+                      initargs=(category_arrays_list, mode)) as pool:
+            chunks = pool.map(run_replicates, jobs)
+
+    scores = np.concatenate(chunks, axis=1)
+    return [pd.DataFrame(table_scores, columns=columns)
+            for table_scores in scores]
+
+
+def confidence_intervals(replicate_df, confidence=0.95):
+    """
+    Compute percentile confidence intervals from bootstrap replicates.
+
+    Parameters
+    ----------
+    replicate_df
+        As returned by `bootstrap_auprc`.
+    confidence
+
+    Returns
+    -------
+    interval_df
+        DataFrame with the mean, standard deviation, and lower and upper
+        bounds of the interval of each score.
+
+    """
+    if not 0 < confidence < 1:
+        raise ValueError("Invalid confidence level: {}".format(confidence))
+
+    alpha = (1 - confidence) / 2
+    return pd.DataFrame({
+        'mean': replicate_df.mean(),
+        'std': replicate_df.std(),
+        'lower': replicate_df.quantile(alpha),
+        'upper': replicate_df.quantile(1 - alpha),
+    })
+
+
+def paired_comparison(replicate_df, other_replicate_df, confidence=0.95):
+    """
+    Compare two sets of predictions from bootstrap replicates drawn with the
+    same files.
+
+    Parameters
+    ----------
+    replicate_df
+    other_replicate_df
+    confidence
+
+    Returns
+    -------
+    comparison_df
+        DataFrame with the confidence interval of the difference of each
+        score, and the fraction of replicates in which the first predictions
+        do not score higher than the others, which serves as a one-sided
+        p-value.
+
+    """
+    diff_df = replicate_df - other_replicate_df
+    comparison_df = confidence_intervals(diff_df, confidence)
+    comparison_df['p_value'] = (diff_df <= 0).mean()
+    return comparison_df
@@ -1,24 +1,84 @@
 import argparse
-import csv
+import contextlib
 import datetime
 import json
 import gzip
+import importlib.util
 import os
+import platform
+import resource
+import time
 import numpy as np
 import pandas as pd
-import oyaml as yaml
 
+import tensorflow as tf
 import keras
 from keras.layers import Input, Dense
 from keras.models import Model
 from keras import regularizers
 from keras.optimizers import Adam
 import keras.backend as K
+from scipy.optimize import minimize
+from scipy.special import expit
 from sklearn.preprocessing import StandardScaler
 
+from inference import MLPPredictor, fold_scaler, pack_embeddings, \
+                      pool_embeddings, POOLING_TYPES, \
+                      aggregate_frame_predictions
+from results_io import save_results
+from taxonomy import compile_taxonomy
+from dataset_cache import get_cache_key, load_prepared_dataset, \
+                          save_prepared_dataset, make_scaler
+from metrics import evaluate, micro_averaged_auprc, macro_averaged_auprc, \
+                    fast_micro_averaged_auprc
+
+
+# Batch size for which the given learning rate is used as is when scaling
+# the learning rate with the batch size
+REFERENCE_BATCH_SIZE = 64
+
 
 ## HELPERS
 
+@contextlib.contextmanager
+def timed(timings, name):
+    """
+    Context manager accumulating the wall time spent in a block under the
+    given name.
+
+    Parameters
+    ----------
+    timings
+    name
+
+    Returns
+    -------
+
+    """
+    start_time = time.time()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + time.time() - start_time
+
+
+def get_peak_rss_mb():
+    """
+    Get the peak resident set size of the current process in megabytes.
+
+    Returns
+    -------
+    peak_rss_mb
+
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    if platform.system() == 'Darwin':
+        return peak_rss / (1024.0 ** 2)
+    return peak_rss / 1024.0
+
+
 def load_embeddings(file_list, emb_dir):
     """
     Load saved embeddings from an embedding directory
@@ -72,6 +132,32 @@ def get_subset_split(annotation_data):
     return np.array(train_idxs), np.array(valid_idxs)
 
 
+def get_file_digests(annotation_data):
+    """
+    Compute a digest of the annotations of each file, which changes whenever
+    any annotation row of the file is added, removed or modified.
+
+    Parameters
+    ----------
+    annotation_data
+
+    Returns
+    -------
+    file_list
+    file_digests
+
+    """
+    annotation_data = annotation_data.sort_values('audio_filename')
+    filenames = annotation_data['audio_filename'].values
+    file_list, starts = np.unique(filenames, return_index=True)
+
+    # The sum of row hashes doesn't depend on the order of the rows of a file
+    row_hashes = pd.util.hash_pandas_object(annotation_data, index=False).values
+    digests = np.add.reduceat(row_hashes, starts) if len(starts) else row_hashes
+
+    return file_list.tolist(), ["{:016x}".format(d) for d in digests]
+
+
 def get_file_targets(annotation_data, labels):
     """
     Get file target annotation vector for the given set of labels
@@ -114,60 +200,40 @@ def get_file_targets(annotation_data, labels):
     return np.array(target_list)
 
 
-def softmax(X, theta=1.0, axis=None):
+def get_target_labels(taxonomy):
     """
-    Compute the softmax of each element along an axis of X.
-
-    Courtesy of https://stackoverflow.com/a/42797620
+    Get the names of the fine labels, including and excluding incomplete
+    ("X") labels, and of the coarse labels of the taxonomy.
 
     Parameters
     ----------
-    X: ND-Array. Probably should be floats.
-    theta (optional): float parameter, used as a multiplier
-        prior to exponentiation. Default = 1.0
-    axis (optional): axis to compute values along. Default is the
-        first non-singleton axis.
-
-    Returns an array the same size as X. The result will sum to 1
-    along the specified axis.
-    """
-
-    # make X at least 2d
-    y = np.atleast_2d(X)
-
-    # find axis
-    if axis is None:
-        axis = next(j[0] for j in enumerate(y.shape) if j[1] > 1)
-
-    # multiply y against the theta parameter,
-    y = y * float(theta)
-
-    # subtract the max for numerical stability
-    y = y - np.expand_dims(np.max(y, axis = axis), axis)
-
-    # exponentiate y
-    y = np.exp(y)
-
-    # take the sum along the specified axis
-    ax_sum = np.expand_dims(np.sum(y, axis = axis), axis)
-
-    # finally: divide elementwise
-    p = y / ax_sum
+    taxonomy
 
-    # flatten if X was 1D
-    if len(X.shape) == 1: p = p.flatten()
+    Returns
+    -------
+    full_fine_target_labels
+    fine_target_labels
+    coarse_target_labels
 
-    return p
+    """
+    taxonomy = compile_taxonomy(taxonomy)
+    return list(taxonomy.full_fine_labels), list(taxonomy.fine_labels), \
+        list(taxonomy.coarse_labels)
 
 
 ## MODEL CONSTRUCTION
 
 
 def construct_mlp_framewise(emb_size, num_classes, hidden_layer_size=128,
-                            num_hidden_layers=0, l2_reg=1e-5):
+                            num_hidden_layers=0, l2_reg=1e-5,
+                            num_coarse_classes=None):
     """
     Construct a 2-hidden-layer MLP model for framewise processing
 
+    If `num_coarse_classes` is given, the hidden layers are shared by two
+    output layers, `fine_output` with `num_classes` outputs and
+    `coarse_output` with `num_coarse_classes` outputs.
+
     Parameters
     ----------
     emb_size
@@ -175,6 +241,7 @@ def construct_mlp_framewise(emb_size, num_classes, hidden_layer_size=128,
     hidden_layer_size
     num_hidden_layers
     l2_reg
+    num_coarse_classes
 
     Returns
     -------
@@ -192,22 +259,118 @@ def construct_mlp_framewise(emb_size, num_classes, hidden_layer_size=128,
                   name='dense{}'.format(idx+1))(y)
 
     # Output layer
-    y = Dense(num_classes, activation='sigmoid',
-              kernel_regularizer=regularizers.l2(l2_reg), name='output')(y)
+    if num_coarse_classes is None:
+        outputs = Dense(num_classes, activation='sigmoid',
+                        kernel_regularizer=regularizers.l2(l2_reg),
+                        name='output')(y)
+    else:
+        outputs = [
+            Dense(num_classes, activation='sigmoid',
+                  kernel_regularizer=regularizers.l2(l2_reg),
+                  name='fine_output')(y),
+            Dense(num_coarse_classes, activation='sigmoid',
+                  kernel_regularizer=regularizers.l2(l2_reg),
+                  name='coarse_output')(y)
+        ]
 
-    m = Model(inputs=inp, outputs=y)
+    m = Model(inputs=inp, outputs=outputs)
     m.name = 'urban_sound_classifier'
 
     return m
 
 
+## LOSS FUNCTIONS
+
+def get_masked_loss_matrices(taxonomy):
+    """
+    Build the matrices used by the masked fine-level loss from the taxonomy.
+
+    The selection matrix picks the complete fine labels out of the full fine
+    target vector (which includes the incomplete "X" labels), in the order of
+    the model outputs. The mask matrix maps each incomplete label onto the
+    complete fine labels of the same coarse category.
+
+    Parameters
+    ----------
+    taxonomy
+
+    Returns
+    -------
+    selection_matrix
+    mask_matrix
+
+    """
+    taxonomy = compile_taxonomy(taxonomy)
+    num_full_labels = len(taxonomy.full_fine_labels)
+    num_labels = len(taxonomy.complete_idxs)
+
+    selection_matrix = np.zeros((num_full_labels, num_labels), dtype=np.float32)
+    selection_matrix[taxonomy.complete_idxs, np.arange(num_labels)] = 1.0
+
+    # Coarse-to-fine mask: mask_matrix[i, k] is 1 if i is the incomplete
+    # label of the coarse category that complete label k belongs to
+    mask_matrix = np.zeros((num_full_labels, num_labels), dtype=np.float32)
+    mask_matrix[taxonomy.incomplete_idxs] = \
+        taxonomy.incomplete_coarse_idxs[:, np.newaxis] \
+        == taxonomy.complete_coarse_idxs[np.newaxis, :]
+
+    return selection_matrix, mask_matrix
+
+
+def make_masked_fine_loss(taxonomy, reduction="sum"):
+    """
+    Create a loss function that only adds loss for fine labels for which we
+    don't have any incomplete labels.
+
+    Parameters
+    ----------
+    taxonomy
+    reduction
+        "sum" to sum the loss over the labels and frames of a batch, or
+        "mean" to average it over the labels of each frame, like Keras'
+        `binary_crossentropy`.
+
+    Returns
+    -------
+    masked_loss
+
+    """
+    if reduction not in ("sum", "mean"):
+        raise ValueError("Invalid reduction: {}".format(reduction))
+
+    selection_matrix, mask_matrix = get_masked_loss_matrices(taxonomy)
+    selection_matrix = K.constant(selection_matrix)
+    mask_matrix = K.constant(mask_matrix)
+
+    def masked_loss(y_true, y_pred):
+        # 1 if not incomplete, 0 if incomplete
+        mask = 1 - K.dot(y_true, mask_matrix)
+
+        # Mask the target and predictions. If the mask is 0,
+        # all entries will be 0 and the BCE will be 0.
+        # This has the effect of masking the BCE for each fine
+        # label within a coarse label if an incomplete label exists
+        sub_true = K.dot(y_true, selection_matrix) * mask
+        sub_pred = y_pred * mask
+
+        if reduction == "mean":
+            return K.mean(K.binary_crossentropy(sub_true, sub_pred), axis=-1)
+        return K.sum(K.binary_crossentropy(sub_true, sub_pred))
+
+    return masked_loss
+
+
 ## DATA PREPARATION
 
 def prepare_framewise_data(train_file_idxs, test_file_idxs, embeddings,
-                           target_list, standardize=True):
+                           target_list, standardize=True, scaler=None,
+                           pooling=None, timings=None):
     """
     Prepare inputs and targets for framewise training using training and evaluation indices.
 
+    If `pooling` is given, the frames of each file are pooled into a single
+    embedding, so that there is one training example per file.
+
     Parameters
     ----------
     train_file_idxs
@@ -215,6 +378,9 @@ def prepare_framewise_data(train_file_idxs, test_file_idxs, embeddings,
     embeddings
     target_list
     standardize
+    scaler
+    pooling
+    timings
 
     Returns
     -------
@@ -225,41 +391,114 @@ def prepare_framewise_data(train_file_idxs, test_file_idxs, embeddings,
     scaler
 
     """
+    with timed(timings, 'pack'):
+        if pooling is not None:
+            pooled = pool_embeddings(embeddings, np.arange(len(embeddings)),
+                                     pooling)
+            embeddings = list(pooled[:, np.newaxis, :])
+
+        X_train = []
+        y_train = []
+        for idx in train_file_idxs:
+            X_ = list(embeddings[idx])
+            X_train += X_
+            for _ in range(len(X_)):
+                y_train.append(target_list[idx])
+
+        train_idxs = np.random.permutation(len(X_train))
+
+        X_train = np.array(X_train)[train_idxs]
+        y_train = np.array(y_train)[train_idxs]
+
+        X_valid = []
+        y_valid = []
+        for idx in test_file_idxs:
+            X_ = list(embeddings[idx])
+            X_valid += X_
+            for _ in range(len(X_)):
+                y_valid.append(target_list[idx])
+
+        test_idxs = np.random.permutation(len(X_valid))
+        X_valid = np.array(X_valid)[test_idxs]
+        y_valid = np.array(y_valid)[test_idxs]
+
+    # standardize
+    with timed(timings, 'scale'):
+        if standardize:
+            # Reuse the given scaler if already fitted
+            if scaler is None:
+                scaler = StandardScaler()
+                X_train = scaler.fit_transform(X_train)
+            else:
+                X_train = scaler.transform(X_train)
+            X_valid = scaler.transform(X_valid)
+        else:
+            scaler = None
 
-    X_train = []
-    y_train = []
-    for idx in train_file_idxs:
-        X_ = list(embeddings[idx])
-        X_train += X_
-        for _ in range(len(X_)):
-            y_train.append(target_list[idx])
+    return X_train, y_train, X_valid, y_valid, scaler
 
-    train_idxs = np.random.permutation(len(X_train))
 
-    X_train = np.array(X_train)[train_idxs]
-    y_train = np.array(y_train)[train_idxs]
+def pack_framewise_inputs(embeddings, file_idxs, scaler=None, pooling=None):
+    """
+    Prepare the model inputs of the given files for prediction, keeping
+    track of the rows belonging to each file.
 
-    X_valid = []
-    y_valid = []
-    for idx in test_file_idxs:
-        X_ = list(embeddings[idx])
-        X_valid += X_
-        for _ in range(len(X_)):
-            y_valid.append(target_list[idx])
+    Parameters
+    ----------
+    embeddings
+    file_idxs
+    scaler
+    pooling
 
-    test_idxs = np.random.permutation(len(X_valid))
-    X_valid = np.array(X_valid)[test_idxs]
-    y_valid = np.array(y_valid)[test_idxs]
+    Returns
+    -------
+    X
+    offsets
 
-    # standardize
-    if standardize:
-        scaler = StandardScaler()
-        X_train = scaler.fit_transform(X_train)
-        X_valid = scaler.transform(X_valid)
+    """
+    if pooling is not None:
+        X = pool_embeddings(embeddings, file_idxs, pooling)
+        offsets = np.arange(len(X) + 1)
     else:
-        scaler = None
+        X, offsets = pack_embeddings(embeddings, file_idxs)
 
-    return X_train, y_train, X_valid, y_valid, scaler
+    if scaler is not None and len(X) > 0:
+        X = scaler.transform(X)
+
+    return X, offsets
+
+
+def get_file_level_ground_truth(targets, taxonomy, label_mode):
+    """
+    Convert file targets into the ground truth arrays used by
+    `metrics.fast_micro_averaged_auprc`.
+
+    Parameters
+    ----------
+    targets
+    taxonomy
+    label_mode
+
+    Returns
+    -------
+    Y_true
+    coarse_idxs
+    is_true_incomplete
+
+    """
+    targets = np.asarray(targets) > 0
+    if label_mode == "coarse":
+        return targets, None, None
+
+    # Full fine targets include the incomplete labels
+    taxonomy = compile_taxonomy(taxonomy)
+    is_true_incomplete = np.zeros((len(targets), len(taxonomy.coarse_ids)),
+                                  dtype=bool)
+    is_true_incomplete[:, taxonomy.incomplete_coarse_idxs] = \
+        targets[:, taxonomy.incomplete_idxs]
+
+    return targets[:, taxonomy.complete_idxs], taxonomy.complete_coarse_idxs, \
+        is_true_incomplete
 
 
 ## GENERIC MODEL TRAINING
@@ -267,7 +506,8 @@ def prepare_framewise_data(train_file_idxs, test_file_idxs, embeddings,
 
 def train_model(model, X_train, y_train, X_valid, y_valid, output_dir,
                 loss=None, batch_size=64, num_epochs=100, patience=20,
-                learning_rate=1e-4):
+                learning_rate=1e-4, callbacks=None, warmup_epochs=0,
+                data_generator=False, max_queue_size=10, monitor='val_loss'):
     """
     Train a model with the given data.
 
@@ -281,6 +521,18 @@ def train_model(model, X_train, y_train, X_valid, y_valid, output_dir,
     num_epochs
     patience
     learning_rate
+    callbacks
+    warmup_epochs
+        Number of epochs over which the learning rate is linearly increased
+        to `learning_rate`.
+    data_generator
+        If True, batches are gathered by a `FrameSequence` and prefetched
+        in a background thread while the model trains.
+    max_queue_size
+        Number of batches to prefetch when using a data generator.
+    monitor
+        Quantity used for checkpointing and early stopping. Quantities
+        ending in "auprc" are maximized, others are minimized.
 
     Returns
     -------
@@ -296,18 +548,27 @@ def train_model(model, X_train, y_train, X_valid, y_valid, output_dir,
 
     os.makedirs(output_dir, exist_ok=True)
 
-    # Set up callbacks
-    cb = []
+    # Set up callbacks. Additional callbacks run first, so that any values
+    # they add to the logs are available to the ones below.
+    cb = list(callbacks or [])
+    # learning rate warmup
+    if warmup_epochs > 0:
+        steps_per_epoch = int(np.ceil(len(X_train) / batch_size))
+        cb.append(LearningRateWarmup(learning_rate,
+                                     warmup_epochs * steps_per_epoch))
+    monitor_mode = 'max' if monitor.endswith('auprc') else 'min'
     # checkpoint
     model_weight_file = os.path.join(output_dir, 'model_best.h5')
 
     cb.append(keras.callbacks.ModelCheckpoint(model_weight_file,
                                               save_weights_only=True,
                                               save_best_only=True,
-                                              monitor='val_loss'))
+                                              monitor=monitor,
+                                              mode=monitor_mode))
     # early stopping
-    cb.append(keras.callbacks.EarlyStopping(monitor='val_loss',
-                                            patience=patience))
+    cb.append(keras.callbacks.EarlyStopping(monitor=monitor,
+                                            patience=patience,
+                                            mode=monitor_mode))
 
     # monitor losses
     history_csv_file = os.path.join(output_dir, 'history.csv')
@@ -316,299 +577,1439 @@ def train_model(model, X_train, y_train, X_valid, y_valid, output_dir,
 
     # Fit model
     model.compile(Adam(lr=learning_rate), loss=loss, metrics=metrics)
-    history = model.fit(
-        x=X_train, y=y_train, batch_size=batch_size, epochs=num_epochs,
-        validation_data=(X_valid, y_valid), callbacks=cb, verbose=2)
+    if data_generator:
+        history = model.fit_generator(
+            FrameSequence(X_train, y_train, batch_size), epochs=num_epochs,
+            validation_data=(X_valid, y_valid), callbacks=cb, verbose=2,
+            max_queue_size=max_queue_size, workers=1,
+            use_multiprocessing=False, shuffle=False)
+    else:
+        history = model.fit(
+            x=X_train, y=y_train, batch_size=batch_size, epochs=num_epochs,
+            validation_data=(X_valid, y_valid), callbacks=cb, verbose=2)
 
     return history
 
 
-## MODEL TRAINING
-
-def train_framewise(annotation_path, taxonomy_path, emb_dir, output_dir, exp_id,
-                    label_mode="fine", batch_size=64, num_epochs=100,
-                    patience=20, learning_rate=1e-4, hidden_layer_size=128,
-                    num_hidden_layers=0, l2_reg=1e-5, standardize=True,
-                    timestamp=None):
+def scale_learning_rate(learning_rate, batch_size, lr_scaling=None):
     """
-    Train and evaluate a framewise MLP model.
+    Scale a learning rate tuned for `REFERENCE_BATCH_SIZE` to the given
+    batch size, either linearly or with the square root of the ratio of
+    batch sizes.
 
     Parameters
     ----------
-    dataset_dir
-    emb_dir
-    output_dir
-    exp_id
-    label_mode
+    learning_rate
     batch_size
-    test_ratio
-    num_epochs
-    patience
+    lr_scaling
+
+    Returns
+    -------
     learning_rate
-    hidden_layer_size
-    l2_reg
-    standardize
-    timestamp
+
+    """
+    ratio = batch_size / REFERENCE_BATCH_SIZE
+    if lr_scaling is None:
+        return learning_rate
+    elif lr_scaling == "linear":
+        return learning_rate * ratio
+    elif lr_scaling == "sqrt":
+        return learning_rate * np.sqrt(ratio)
+    else:
+        raise ValueError("Invalid learning rate scaling: {}".format(lr_scaling))
+
+
+def configure_session(intra_op_threads=0, inter_op_threads=0):
+    """
+    Reset the Keras session, setting the number of threads used by TF within
+    and across operations. 0 lets TF choose.
+
+    Parameters
+    ----------
+    intra_op_threads
+    inter_op_threads
 
     Returns
     -------
 
     """
+    K.clear_session()
+    config = tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                            inter_op_parallelism_threads=inter_op_threads)
+    K.set_session(tf.Session(config=config))
 
-    # Load annotations and taxonomy
-    print("* Loading dataset.")
-    annotation_data = pd.read_csv(annotation_path).sort_values('audio_filename')
-    with open(taxonomy_path, 'r') as f:
-        taxonomy = yaml.load(f, Loader=yaml.Loader)
 
-    file_list = annotation_data['audio_filename'].unique().tolist()
+class FrameSequence(keras.utils.Sequence):
+    """
+    Keras sequence of training batches, gathered by index from the training
+    data and reshuffled after each epoch, without copying the whole data.
+    """
+    def __init__(self, X, y, batch_size):
+        self.X = X
+        self.y = y
+        self.batch_size = batch_size
+        self.idxs = np.random.permutation(len(X))
 
-    full_fine_target_labels = ["{}-{}_{}".format(coarse_id, fine_id, fine_label)
-                               for coarse_id, fine_dict in taxonomy['fine'].items()
-                               for fine_id, fine_label in fine_dict.items()]
-    fine_target_labels = [x for x in full_fine_target_labels
-                            if x.split('_')[0].split('-')[1] != 'X']
-    coarse_target_labels = ["_".join([str(k), v])
-                            for k,v in taxonomy['coarse'].items()]
+    def __len__(self):
+        return int(np.ceil(len(self.X) / self.batch_size))
 
-    print("* Preparing training data.")
+    def __getitem__(self, batch_idx):
+        # Sorted indices make reads from memory-mapped data sequential
+        idxs = np.sort(self.idxs[batch_idx*self.batch_size:
+                                 (batch_idx+1)*self.batch_size])
+        if isinstance(self.y, list):
+            return self.X[idxs], [y[idxs] for y in self.y]
+        return self.X[idxs], self.y[idxs]
 
-    # For fine, we include incomplete labels in targets for computing the loss
-    fine_target_list = get_file_targets(annotation_data, full_fine_target_labels)
-    coarse_target_list = get_file_targets(annotation_data, coarse_target_labels)
-    train_file_idxs, test_file_idxs = get_subset_split(annotation_data)
+    def on_epoch_end(self):
+        np.random.shuffle(self.idxs)
 
-    if label_mode == "fine":
-        target_list = fine_target_list
-        labels = fine_target_labels
-    elif label_mode == "coarse":
-        target_list = coarse_target_list
-        labels = coarse_target_labels
-    else:
-        raise ValueError("Invalid label mode: {}".format(label_mode))
 
-    num_classes = len(labels)
+class LearningRateWarmup(keras.callbacks.Callback):
+    """
+    Keras callback linearly increasing the learning rate up to the given
+    value over the first training steps.
+    """
+    def __init__(self, learning_rate, warmup_steps):
+        super(LearningRateWarmup, self).__init__()
+        self.learning_rate = learning_rate
+        self.warmup_steps = warmup_steps
+        self.step = 0
 
-    embeddings = load_embeddings(file_list, emb_dir)
+    def on_batch_begin(self, batch, logs=None):
+        if self.step < self.warmup_steps:
+            K.set_value(self.model.optimizer.lr,
+                        self.learning_rate * (self.step + 1) / self.warmup_steps)
+        self.step += 1
 
-    X_train, y_train, X_valid, y_valid, scaler \
-        = prepare_framewise_data(train_file_idxs, test_file_idxs, embeddings,
-                                 target_list, standardize=standardize)
 
-    _, emb_size = X_train.shape
+class ValidationAUPRC(keras.callbacks.Callback):
+    """
+    Keras callback computing the micro-averaged AUPRC of the file-level
+    predictions for the validation files at the end of each epoch, and
+    adding it to the logs as `val_auprc`.
 
-    model = construct_mlp_framewise(emb_size, num_classes,
-                                    hidden_layer_size=hidden_layer_size,
-                                    num_hidden_layers=num_hidden_layers,
-                                    l2_reg=l2_reg)
+    For a model with fine and coarse outputs, the AUPRC of each output is
+    added as `val_fine_auprc` and `val_coarse_auprc`, and `val_auprc` is
+    their mean.
+    """
+    def __init__(self, X, offsets, targets, label_modes, taxonomy,
+                 aggregation_type="mean", batch_size=4096):
+        super(ValidationAUPRC, self).__init__()
+        self.X = X
+        self.offsets = offsets
+        self.label_modes = label_modes
+        self.aggregation_type = aggregation_type
+        self.batch_size = batch_size
+        self.ground_truth = [get_file_level_ground_truth(y, taxonomy, label_mode)
+                             for y, label_mode in zip(targets, label_modes)]
+
+    def on_epoch_end(self, epoch, logs=None):
+        pred_frames = self.model.predict(self.X, batch_size=self.batch_size)
+        if not isinstance(pred_frames, list):
+            pred_frames = [pred_frames]
+
+        auprcs = []
+        for pred, (Y_true, coarse_idxs, is_true_incomplete) \
+                in zip(pred_frames, self.ground_truth):
+            y_pred = aggregate_frame_predictions(pred, self.offsets)
+            auprcs.append(fast_micro_averaged_auprc(
+                Y_true, y_pred[self.aggregation_type], coarse_idxs=coarse_idxs,
+                is_true_incomplete=is_true_incomplete))
+
+        if logs is not None:
+            if len(auprcs) > 1:
+                for label_mode, auprc in zip(self.label_modes, auprcs):
+                    logs['val_{}_auprc'.format(label_mode)] = auprc
+            logs['val_auprc'] = float(np.mean(auprcs))
+
+
+class TrainingProfiler(keras.callbacks.Callback):
+    """
+    Keras callback recording per-epoch wall time, training throughput,
+    time spent in validation and peak memory usage.
+    """
+    def __init__(self, num_samples):
+        super(TrainingProfiler, self).__init__()
+        self.num_samples = num_samples
+        self.epochs = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start_time = time.time()
+        self.last_batch_end_time = self.epoch_start_time
+
+    def on_batch_end(self, batch, logs=None):
+        self.last_batch_end_time = time.time()
+
+    def on_epoch_end(self, epoch, logs=None):
+        epoch_end_time = time.time()
+        train_time = self.last_batch_end_time - self.epoch_start_time
+
+        # Validation runs after the last training batch and before the end
+        # of the epoch is signalled
+        self.epochs.append({
+            'epoch': epoch,
+            'epoch_time': epoch_end_time - self.epoch_start_time,
+            'train_time': train_time,
+            'validation_time': epoch_end_time - self.last_batch_end_time,
+            'samples_per_sec': self.num_samples / max(train_time, 1e-12),
+            'peak_rss_mb': get_peak_rss_mb(),
+        })
+
+
+def get_thread_config():
+    """
+    Get the thread configuration of the current process.
 
-    if not timestamp:
-        timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    Returns
+    -------
+    thread_config
 
-    results_dir = os.path.join(output_dir, exp_id, timestamp)
+    """
+    thread_config = {
+        'cpu_count': os.cpu_count(),
+        'environment': {var: os.environ.get(var)
+                        for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS',
+                                    'OPENBLAS_NUM_THREADS')},
+    }
 
-    if label_mode == "fine":
-        full_coarse_to_fine_terminal_idxs = np.cumsum(
-            [len(fine_dict) for fine_dict in taxonomy['fine'].values()])
-        incomplete_fine_subidxs = [len(fine_dict) - 1 if 'X' in fine_dict else None
-                                   for fine_dict in taxonomy['fine'].values()]
-        coarse_to_fine_end_idxs = np.cumsum([len(fine_dict) - 1 if 'X' in fine_dict else len(fine_dict)
-                                             for fine_dict in taxonomy['fine'].values()])
-
-        # Create loss function that only adds loss for fine labels for which
-        # the we don't have any incomplete labels
-        def masked_loss(y_true, y_pred):
-            loss = None
-            for coarse_idx in range(len(full_coarse_to_fine_terminal_idxs)):
-                true_terminal_idx = full_coarse_to_fine_terminal_idxs[coarse_idx]
-                true_incomplete_subidx = incomplete_fine_subidxs[coarse_idx]
-                pred_end_idx = coarse_to_fine_end_idxs[coarse_idx]
-
-                if coarse_idx != 0:
-                    true_start_idx = full_coarse_to_fine_terminal_idxs[coarse_idx-1]
-                    pred_start_idx = coarse_to_fine_end_idxs[coarse_idx-1]
-                else:
-                    true_start_idx = 0
-                    pred_start_idx = 0
+    session_config = getattr(K.get_session(), '_config', None)
+    if session_config is not None:
+        thread_config['intra_op_parallelism_threads'] = \
+            session_config.intra_op_parallelism_threads
+        thread_config['inter_op_parallelism_threads'] = \
+            session_config.inter_op_parallelism_threads
 
-                if true_incomplete_subidx is None:
-                    true_end_idx = true_terminal_idx
+    return thread_config
 
-                    sub_true = y_true[:, true_start_idx:true_end_idx]
-                    sub_pred = y_pred[:, pred_start_idx:pred_end_idx]
 
-                else:
-                    # Don't include incomplete label
-                    true_end_idx = true_terminal_idx - 1
-                    true_incomplete_idx = true_incomplete_subidx + true_start_idx
-                    assert true_end_idx - true_start_idx == pred_end_idx - pred_start_idx
-                    assert true_incomplete_idx == true_end_idx
-
-                    # 1 if not incomplete, 0 if incomplete
-                    mask = K.expand_dims(1 - y_true[:, true_incomplete_idx])
-
-                    # Mask the target and predictions. If the mask is 0,
-                    # all entries will be 0 and the BCE will be 0.
-                    # This has the effect of masking the BCE for each fine
-                    # label within a coarse label if an incomplete label exists
-                    sub_true = y_true[:, true_start_idx:true_end_idx] * mask
-                    sub_pred = y_pred[:, pred_start_idx:pred_end_idx] * mask
-
-                if loss is not None:
-                    loss += K.sum(K.binary_crossentropy(sub_true, sub_pred))
-                else:
-                    loss = K.sum(K.binary_crossentropy(sub_true, sub_pred))
+def write_training_profile(output_dir, timings, epochs=None, config=None):
+    """
+    Write data preparation and training timings and resource usage as JSON
+    next to the model checkpoint.
 
-            return loss
-        loss_func = masked_loss
-    else:
-        loss_func = None
+    Parameters
+    ----------
+    output_dir
+    timings
+    epochs
+    config
 
-    print("* Training model.")
-    history = train_model(model, X_train, y_train, X_valid, y_valid,
-                          results_dir, loss=loss_func, batch_size=batch_size,
-                          num_epochs=num_epochs, patience=patience,
-                          learning_rate=learning_rate)
+    Returns
+    -------
 
-    print("* Saving model predictions.")
-    results = {}
-    results['train'] = predict_framewise(embeddings, train_file_idxs, model,
-                                         scaler=scaler)
-    results['test'] = predict_framewise(embeddings, test_file_idxs, model,
-                                        scaler=scaler)
-    results['train_history'] = history.history
+    """
+    profile = {
+        'config': config or {},
+        'phases': timings,
+        'epochs': epochs or [],
+        'peak_rss_mb': get_peak_rss_mb(),
+    }
 
-    results_path = os.path.join(results_dir, "results.json")
-    with open(results_path, "w") as f:
-        json.dump(results, f, indent=2)
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'training_profile.json'), 'w') as f:
+        json.dump(profile, f, indent=2)
 
-    for aggregation_type, y_pred in results['test'].items():
-        generate_output_file(y_pred, test_file_idxs, results_dir, file_list,
-                             aggregation_type, label_mode, taxonomy)
 
+## FULL-BATCH LINEAR MODEL TRAINING
 
-## MODEL EVALUATION
+class EarlyStoppingLBFGS(Exception):
+    """
+    Raised from the callback of L-BFGS to stop it when the validation loss
+    has not improved for a number of iterations.
+    """
 
-def predict_framewise(embeddings, test_file_idxs, model, scaler=None):
+def make_linear_objective(X, y, label_mode, taxonomy, l2_reg=1e-5,
+                          batch_size=64):
     """
-    Evaluate the output of a framewise classification model.
+    Create the full-batch objective and gradient of a multi-label logistic
+    regression model over the given frames.
+
+    The data term is the mean framewise binary cross-entropy. In fine mode,
+    labels are masked the same way as in `make_masked_fine_loss`, and since
+    that loss is summed (rather than averaged) over each mini-batch, the data
+    term is scaled by `batch_size` so that its balance against the L2 penalty
+    matches Keras training.
 
     Parameters
     ----------
-    embeddings
-    test_file_idxs
-    model
-    scaler
+    X
+    y
+    label_mode
+    taxonomy
+    l2_reg
+    batch_size
 
     Returns
     -------
-    results
+    objective
+    num_classes
+
     """
-    y_pred_max = []
-    y_pred_mean = []
-    y_pred_softmax = []
+    num_frames, emb_size = X.shape
 
-    for idx in test_file_idxs:
-        if scaler is None:
-            X_ = np.array(embeddings[idx])
-        else:
-            X_ = np.array(scaler.transform(embeddings[idx]))
-        pred_frame = model.predict(X_)
+    if label_mode == "fine":
+        selection_matrix, mask_matrix = get_masked_loss_matrices(taxonomy)
+        loss_weights = 1 - y.dot(mask_matrix)
+        y = y.dot(selection_matrix) * loss_weights
+        scale = float(batch_size) / num_frames
+    else:
+        loss_weights = np.ones(y.shape, dtype=np.float32)
+        scale = 1.0 / (num_frames * y.shape[1])
 
-        y_pred_max.append(pred_frame.max(axis=0).tolist())
-        y_pred_mean.append(pred_frame.mean(axis=0).tolist())
-        y_pred_softmax.append(((softmax(pred_frame, axis=0) * pred_frame).sum(axis=0)).tolist())
+    num_classes = y.shape[1]
 
+    def objective(params):
+        weights = params[:emb_size*num_classes].reshape(emb_size, num_classes)
+        bias = params[emb_size*num_classes:]
 
-    results = {
-        'max': y_pred_max,
-        'mean': y_pred_mean,
-        'softmax': y_pred_softmax
-    }
+        z = X.dot(weights) + bias
+        y_pred = expit(z)
 
-    return results
+        # BCE written in terms of the logits: log(1 + exp(z)) - y*z
+        loss = scale * np.sum(loss_weights * (np.logaddexp(0, z) - y * z)) \
+            + l2_reg * np.sum(weights ** 2)
 
+        grad_z = scale * loss_weights * (y_pred - y)
+        grad_weights = X.T.dot(grad_z) + 2 * l2_reg * weights
+        grad_bias = grad_z.sum(axis=0)
 
-def generate_output_file(y_pred, test_file_idxs, results_dir, file_list,
-                         aggregation_type, label_mode, taxonomy):
+        return loss, np.concatenate([grad_weights.ravel(), grad_bias])
+
+    return objective, num_classes
+
+
+def train_linear_model(X_train, y_train, X_valid, y_valid, output_dir,
+                       label_mode, taxonomy, l2_reg=1e-5, batch_size=64,
+                       max_iter=100, patience=20):
     """
-    Write the output file containing model predictions
+    Train a multi-label logistic regression model with full-batch L-BFGS.
+
+    Like the early stopping of Keras training, with iterations instead of
+    epochs, L-BFGS stops after `max_iter` iterations or once the validation
+    loss has not improved for `patience` iterations, and the parameters
+    with the lowest validation loss are kept.
 
     Parameters
     ----------
-    y_pred
-    test_file_idxs
-    results_dir
-    file_list
-    aggregation_type
+    X_train
+    y_train
+    X_valid
+    y_valid
+    output_dir
     label_mode
     taxonomy
+    l2_reg
+    batch_size
+    max_iter
+    patience
 
     Returns
     -------
+    model
+    history
 
     """
-    output_path = os.path.join(results_dir, "output_{}.csv".format(aggregation_type))
-    test_file_list = [file_list[idx] for idx in test_file_idxs]
+    os.makedirs(output_dir, exist_ok=True)
 
-    coarse_fine_labels = [["{}-{}_{}".format(coarse_id, fine_id, fine_label)
-                             for fine_id, fine_label in fine_dict.items()]
-                           for coarse_id, fine_dict in taxonomy['fine'].items()]
-
-    full_fine_target_labels = [fine_label for fine_list in coarse_fine_labels
-                                          for fine_label in fine_list]
-    coarse_target_labels = ["_".join([str(k), v])
-                            for k,v in taxonomy['coarse'].items()]
-
-
-    with open(output_path, 'w') as f:
-        csvwriter = csv.writer(f)
-
-        # Write fields
-        fields = ["audio_filename"] + full_fine_target_labels + coarse_target_labels
-        csvwriter.writerow(fields)
-
-        # Write results for each file to CSV
-        for filename, y, in zip(test_file_list, y_pred):
-            row = [filename]
-
-            if label_mode == "fine":
-                fine_values = []
-                coarse_values = [0 for _ in range(len(coarse_target_labels))]
-                coarse_idx = 0
-                fine_idx = 0
-                for coarse_label, fine_label_list in zip(coarse_target_labels,
-                                                         coarse_fine_labels):
-                    for fine_label in fine_label_list:
-                        if 'X' in fine_label.split('_')[0].split('-')[1]:
-                            # Put a 0 for other, since the baseline doesn't
-                            # account for it
-                            fine_values.append(0.0)
-                            continue
-
-                        # Append the next fine prediction
-                        fine_values.append(y[fine_idx])
-
-                        # Add coarse level labels corresponding to fine level
-                        # predictions. Obtain by taking the maximum from the
-                        # fine level labels
-                        coarse_values[coarse_idx] = max(coarse_values[coarse_idx],
-                                                        y[fine_idx])
-                        fine_idx += 1
-                    coarse_idx += 1
-
-                row += fine_values + coarse_values
+    X_train = np.asarray(X_train, dtype=np.float64)
+    X_valid = np.asarray(X_valid, dtype=np.float64)
+    emb_size = X_train.shape[1]
+
+    train_objective, num_classes = make_linear_objective(
+        X_train, y_train, label_mode, taxonomy, l2_reg=l2_reg,
+        batch_size=batch_size)
+    valid_objective, _ = make_linear_objective(
+        X_valid, y_valid, label_mode, taxonomy, l2_reg=l2_reg,
+        batch_size=batch_size)
+
+    history = {'loss': [], 'val_loss': []}
+    params = np.zeros(emb_size * num_classes + num_classes)
+    best = {'params': params, 'val_loss': np.inf, 'iteration': 0}
+
+    def record(params):
+        history['loss'].append(float(train_objective(params)[0]))
+        history['val_loss'].append(float(valid_objective(params)[0]))
+
+        iteration = len(history['val_loss'])
+        if history['val_loss'][-1] < best['val_loss']:
+            best.update(params=params.copy(), val_loss=history['val_loss'][-1],
+                        iteration=iteration)
+        elif iteration - best['iteration'] >= patience:
+            raise EarlyStoppingLBFGS()
+
+    try:
+        res = minimize(train_objective, params, jac=True, method='L-BFGS-B',
+                       callback=record, options={'maxiter': max_iter})
+        print("L-BFGS finished after {} iterations: {}".format(res.nit,
+                                                               res.message))
+        if not history['val_loss']:
+            best['params'] = res.x
+    except EarlyStoppingLBFGS:
+        print("L-BFGS stopped after {} iterations: no improvement of the "
+              "validation loss in {} iterations.".format(len(history['loss']),
+                                                         patience))
+    print("Keeping the parameters of iteration {}, with a validation loss "
+          "of {:.4f}.".format(best['iteration'], best['val_loss']))
+
+    weights = best['params'][:emb_size*num_classes].reshape(emb_size, num_classes)
+    bias = best['params'][emb_size*num_classes:]
+    model = MLPPredictor([weights], [bias])
+
+    return model, history
+
+
+## MODEL EXPORT
+
+def export_model(model, scaler, labels, label_mode, output_path,
+                 output_layer=None, pooling=None):
+    """
+    Export a trained model as a compact .npz file that can be used for
+    inference with `inference.MLPPredictor`, without Keras or TF. The
+    standardization is folded into the weights of the first layer.
 
-            else:
-                # Add placeholder values for fine level
-                row += [0.0 for _ in range(len(full_fine_target_labels))]
-                # Add coarse level labels
-                row += list(y)
+    For a model with several output layers, `output_layer` is the name of
+    the one to export along with the hidden layers.
 
-            csvwriter.writerow(row)
+    Parameters
+    ----------
+    model
+    scaler
+    labels
+    label_mode
+    output_path
+    output_layer
+    pooling
 
+    Returns
+    -------
+    predictor
 
-if __name__ == '__main__':
+    """
+    if isinstance(model, MLPPredictor):
+        weights = list(model.weights)
+        biases = list(model.biases)
+    else:
+        dense_layers = [layer for layer in model.layers if layer.get_weights()]
+        if output_layer is not None:
+            dense_layers = [layer for layer in dense_layers
+                            if layer.name.startswith('dense')
+                            or layer.name == output_layer]
+        weights = [layer.get_weights()[0] for layer in dense_layers]
+        biases = [layer.get_weights()[1] for layer in dense_layers]
+
+    if scaler is not None:
+        scaler_mean = scaler.mean_
+        scaler_scale = scaler.scale_
+        weights[0], biases[0] = fold_scaler(weights[0], biases[0],
+                                            scaler_mean, scaler_scale)
+    else:
+        scaler_mean = None
+        scaler_scale = None
+
+    predictor = MLPPredictor(weights, biases, labels=labels,
+                             label_mode=label_mode, scaler_mean=scaler_mean,
+                             scaler_scale=scaler_scale, pooling=pooling)
+    predictor.save(output_path)
+
+    return predictor
+
+
+## MODEL TRAINING
+
+def load_framewise_dataset(annotation_path, taxonomy_path, emb_dir,
+                           label_mode="fine", timings=None):
+    """
+    Load annotations, taxonomy, targets, splits and embeddings.
+
+    Parameters
+    ----------
+    annotation_path
+    taxonomy_path
+    emb_dir
+    label_mode
+    timings
+
+    Returns
+    -------
+    dataset
+
+    """
+    # Load annotations and taxonomy
+    print("* Loading dataset.")
+    with timed(timings, 'load_annotations'):
+        annotation_data = pd.read_csv(annotation_path).sort_values('audio_filename')
+        taxonomy = compile_taxonomy(taxonomy_path).yaml_dict
+
+    return build_framewise_dataset(annotation_data, taxonomy, emb_dir,
+                                   label_mode=label_mode, timings=timings)
+
+
+def build_framewise_dataset(annotation_data, taxonomy, emb_dir,
+                            label_mode="fine", timings=None):
+    """
+    Compute targets and splits and load embeddings for the annotated files.
+
+    Parameters
+    ----------
+    annotation_data
+    taxonomy
+    emb_dir
+    label_mode
+    timings
+
+    Returns
+    -------
+    dataset
+
+    """
+    annotation_data = annotation_data.sort_values('audio_filename')
+    file_list, file_digests = get_file_digests(annotation_data)
+
+    full_fine_target_labels, fine_target_labels, coarse_target_labels \
+        = get_target_labels(taxonomy)
+
+    print("* Preparing training data.")
+
+    # For fine, we include incomplete labels in targets for computing the loss
+    with timed(timings, 'targets'):
+        train_file_idxs, test_file_idxs = get_subset_split(annotation_data)
+
+        if label_mode == "fine":
+            target_list = get_file_targets(annotation_data, full_fine_target_labels)
+            labels = fine_target_labels
+        elif label_mode == "coarse":
+            target_list = get_file_targets(annotation_data, coarse_target_labels)
+            labels = coarse_target_labels
+        elif label_mode == "both":
+            # Fine and coarse targets side by side, split again for the
+            # two heads of the model at training time
+            target_list = np.concatenate(
+                [get_file_targets(annotation_data, full_fine_target_labels),
+                 get_file_targets(annotation_data, coarse_target_labels)],
+                axis=1)
+            labels = fine_target_labels + coarse_target_labels
+        else:
+            raise ValueError("Invalid label mode: {}".format(label_mode))
+
+    with timed(timings, 'load_embeddings'):
+        embeddings = load_embeddings(file_list, emb_dir)
+
+    dataset = {
+        'taxonomy': taxonomy,
+        'file_list': file_list,
+        'labels': labels,
+        'target_list': target_list,
+        'train_file_idxs': train_file_idxs,
+        'test_file_idxs': test_file_idxs,
+        'embeddings': embeddings,
+        'file_digests': file_digests
+    }
+
+    return dataset
+
+
+def load_prepared_framewise_data(annotation_path, taxonomy_path, emb_dir,
+                                 label_mode="fine", standardize=True,
+                                 pooling=None, cache_dir=None, timings=None):
+    """
+    Load the dataset and prepare framewise inputs and targets. If a cache
+    directory is given, the prepared data is reused from there when the
+    annotations, taxonomy, embeddings and settings are unchanged.
+
+    Parameters
+    ----------
+    annotation_path
+    taxonomy_path
+    emb_dir
+    label_mode
+    standardize
+    pooling
+    cache_dir
+    timings
+
+    Returns
+    -------
+    dataset
+    X_train
+    y_train
+    X_valid
+    y_valid
+    scaler
+
+    """
+    cache_path = None
+    if cache_dir:
+        cache_key = get_cache_key(annotation_path, taxonomy_path, emb_dir,
+                                  label_mode, standardize, pooling=pooling)
+        cache_path = os.path.join(cache_dir, cache_key)
+
+        if os.path.isdir(cache_path):
+            print("* Loading prepared dataset from cache.")
+            with timed(timings, 'load_cache'):
+                taxonomy = compile_taxonomy(taxonomy_path,
+                                            cache_dir=cache_dir).yaml_dict
+                return load_prepared_dataset(cache_path, taxonomy)
+
+    dataset = load_framewise_dataset(annotation_path, taxonomy_path, emb_dir,
+                                     label_mode=label_mode, timings=timings)
+
+    X_train, y_train, X_valid, y_valid, scaler \
+        = prepare_framewise_data(dataset['train_file_idxs'],
+                                 dataset['test_file_idxs'],
+                                 dataset['embeddings'], dataset['target_list'],
+                                 standardize=standardize, pooling=pooling,
+                                 timings=timings)
+
+    if cache_path:
+        print("* Saving prepared dataset to cache.")
+        with timed(timings, 'save_cache'):
+            os.makedirs(cache_dir, exist_ok=True)
+            save_prepared_dataset(cache_path, dataset, X_train, y_train,
+                                  X_valid, y_valid, scaler)
+
+    return dataset, X_train, y_train, X_valid, y_valid, scaler
+
+
+def fit_framewise(dataset, X_train, y_train, X_valid, y_valid, scaler,
+                  results_dir, label_mode="fine", batch_size=64,
+                  num_epochs=100, patience=20, learning_rate=1e-4,
+                  hidden_layer_size=128, num_hidden_layers=0, l2_reg=1e-5,
+                  solver="adam", sidecar_format=None,
+                  save_train_predictions=False, initial_weights=None,
+                  pooling=None, lr_scaling=None, warmup_epochs=0,
+                  data_generator=False, monitor="val_loss", timings=None):
+    """
+    Train a framewise model on prepared data and save its predictions.
+
+    With the "both" label mode, a single model with fine and coarse output
+    layers is trained, and the model and predictions of each level are
+    written to the `fine` and `coarse` subdirectories of `results_dir`.
+
+    Parameters
+    ----------
+    dataset
+    X_train
+    y_train
+    X_valid
+    y_valid
+    scaler
+    results_dir
+    label_mode
+    batch_size
+    num_epochs
+    patience
+    learning_rate
+    hidden_layer_size
+    num_hidden_layers
+    l2_reg
+    solver
+    sidecar_format
+    save_train_predictions
+    initial_weights
+    pooling
+    lr_scaling
+    warmup_epochs
+    data_generator
+    monitor
+    timings
+
+    Returns
+    -------
+    results
+
+    """
+    if solver not in ("adam", "lbfgs"):
+        raise ValueError("Invalid solver: {}".format(solver))
+    if solver == "lbfgs" and num_hidden_layers != 0:
+        raise ValueError("The lbfgs solver only supports models without "
+                         "hidden layers.")
+    if solver == "lbfgs" and initial_weights is not None:
+        raise ValueError("The lbfgs solver does not support warm starts.")
+    if solver == "lbfgs" and label_mode == "both":
+        raise ValueError("The lbfgs solver does not support training fine "
+                         "and coarse labels jointly.")
+    if solver == "lbfgs" and monitor != "val_loss":
+        raise ValueError("The lbfgs solver only supports monitoring the "
+                         "validation loss.")
+
+    taxonomy = dataset['taxonomy']
+    file_list = dataset['file_list']
+    embeddings = dataset['embeddings']
+    train_file_idxs = dataset['train_file_idxs']
+    test_file_idxs = dataset['test_file_idxs']
+
+    if timings is None:
+        timings = {}
+
+    num_classes = len(dataset['labels'])
+    _, emb_size = X_train.shape
+
+    # Each output of the model: (label mode, output layer, labels)
+    if label_mode == "both":
+        full_fine_target_labels, fine_target_labels, coarse_target_labels \
+            = get_target_labels(taxonomy)
+        heads = [("fine", 'fine_output', fine_target_labels),
+                 ("coarse", 'coarse_output', coarse_target_labels)]
+
+        # Split the targets for the fine and coarse outputs
+        num_fine_targets = len(full_fine_target_labels)
+        y_train = [y_train[:, :num_fine_targets], y_train[:, num_fine_targets:]]
+        y_valid = [y_valid[:, :num_fine_targets], y_valid[:, num_fine_targets:]]
+    else:
+        heads = [(label_mode, None, dataset['labels'])]
+
+    profile_config = {
+        'solver': solver,
+        'pooling': pooling,
+        'batch_size': batch_size,
+        'num_train_frames': len(X_train),
+        'num_valid_frames': len(X_valid),
+    }
+    profile_epochs = None
+
+    print("* Training model.")
+    if solver == "lbfgs":
+        with timed(timings, 'train'):
+            model, history = train_linear_model(X_train, y_train, X_valid,
+                                                y_valid, results_dir,
+                                                label_mode, taxonomy,
+                                                l2_reg=l2_reg,
+                                                batch_size=batch_size,
+                                                max_iter=num_epochs,
+                                                patience=patience)
+    else:
+        if label_mode == "both":
+            model = construct_mlp_framewise(emb_size, len(heads[0][2]),
+                                            hidden_layer_size=hidden_layer_size,
+                                            num_hidden_layers=num_hidden_layers,
+                                            l2_reg=l2_reg,
+                                            num_coarse_classes=len(heads[1][2]))
+        else:
+            model = construct_mlp_framewise(emb_size, num_classes,
+                                            hidden_layer_size=hidden_layer_size,
+                                            num_hidden_layers=num_hidden_layers,
+                                            l2_reg=l2_reg)
+        if initial_weights is not None:
+            model.set_weights(initial_weights)
+
+        if label_mode == "fine":
+            loss_func = make_masked_fine_loss(taxonomy)
+        elif label_mode == "both":
+            # The total loss, used for checkpointing and early stopping, is
+            # the sum of the losses of both outputs. The fine loss is
+            # averaged over labels like the coarse one, since a summed fine
+            # loss would be orders of magnitude larger and drown it out.
+            loss_func = [make_masked_fine_loss(taxonomy, reduction="mean"),
+                         'binary_crossentropy']
+        else:
+            loss_func = None
+
+        learning_rate = scale_learning_rate(learning_rate, batch_size,
+                                            lr_scaling=lr_scaling)
+        profile_config.update(learning_rate=learning_rate,
+                              warmup_epochs=warmup_epochs,
+                              data_generator=data_generator)
+
+        callbacks = []
+        if monitor.endswith("auprc"):
+            # File-level validation predictions, computed at the end of
+            # each epoch from the validation files rather than the
+            # shuffled validation frames
+            X_valid_files, valid_offsets = pack_framewise_inputs(
+                embeddings, test_file_idxs, scaler=scaler, pooling=pooling)
+            valid_targets = dataset['target_list'][test_file_idxs]
+            if label_mode == "both":
+                valid_targets = [valid_targets[:, :num_fine_targets],
+                                 valid_targets[:, num_fine_targets:]]
+            else:
+                valid_targets = [valid_targets]
+            callbacks.append(ValidationAUPRC(
+                X_valid_files, valid_offsets, valid_targets,
+                [head[0] for head in heads], taxonomy))
+
+        profiler = TrainingProfiler(len(X_train))
+        callbacks.append(profiler)
+        with timed(timings, 'train'):
+            history = train_model(model, X_train, y_train, X_valid, y_valid,
+                                  results_dir, loss=loss_func,
+                                  batch_size=batch_size, num_epochs=num_epochs,
+                                  patience=patience, learning_rate=learning_rate,
+                                  callbacks=callbacks,
+                                  warmup_epochs=warmup_epochs,
+                                  data_generator=data_generator,
+                                  monitor=monitor).history
+        profile_epochs = profiler.epochs
+        profile_config.update(get_thread_config())
+
+    def get_head_dir(head_label_mode):
+        if label_mode == "both":
+            return os.path.join(results_dir, head_label_mode)
+        return results_dir
+
+    with timed(timings, 'export'):
+        for head_label_mode, output_layer, labels in heads:
+            os.makedirs(get_head_dir(head_label_mode), exist_ok=True)
+            export_model(model, scaler, labels, head_label_mode,
+                         os.path.join(get_head_dir(head_label_mode), 'model.npz'),
+                         output_layer=output_layer, pooling=pooling)
+
+    print("* Saving model predictions.")
+    split_preds = {}
+    with timed(timings, 'predict'):
+        # Predictions on the training split are only computed if requested
+        if save_train_predictions:
+            split_preds['train'] = predict_framewise(embeddings, train_file_idxs,
+                                                     model, scaler=scaler,
+                                                     pooling=pooling)
+        split_preds['test'] = predict_framewise(embeddings, test_file_idxs,
+                                                model, scaler=scaler,
+                                                pooling=pooling)
+    if label_mode != "both":
+        split_preds = {split: [preds] for split, preds in split_preds.items()}
+
+    head_results = {}
+    with timed(timings, 'write_outputs'):
+        for head_idx, (head_label_mode, _, labels) in enumerate(heads):
+            head_dir = get_head_dir(head_label_mode)
+            results = {split: preds[head_idx]
+                       for split, preds in split_preds.items()}
+            results['train_history'] = history
+
+            save_results(head_dir, results, file_list,
+                         {'train': train_file_idxs, 'test': test_file_idxs},
+                         labels=labels)
+
+            layout = get_output_layout(taxonomy, head_label_mode)
+            for aggregation_type, y_pred in results['test'].items():
+                generate_output_file(y_pred, test_file_idxs, head_dir, file_list,
+                                     aggregation_type, head_label_mode, taxonomy,
+                                     layout=layout, sidecar_format=sidecar_format)
+
+            head_results[head_label_mode] = results
+
+    write_training_profile(results_dir, timings, epochs=profile_epochs,
+                           config=profile_config)
+
+    if label_mode == "both":
+        return head_results
+    return head_results[label_mode]
+
+
+def train_framewise(annotation_path, taxonomy_path, emb_dir, output_dir, exp_id,
+                    label_mode="fine", batch_size=64, num_epochs=100,
+                    patience=20, learning_rate=1e-4, hidden_layer_size=128,
+                    num_hidden_layers=0, l2_reg=1e-5, standardize=True,
+                    solver="adam", sidecar_format=None,
+                    save_train_predictions=False, pooling=None,
+                    lr_scaling=None, warmup_epochs=0, data_generator=False,
+                    monitor="val_loss", cache_dir=None, timestamp=None):
+    """
+    Train and evaluate a framewise MLP model.
+
+    Parameters
+    ----------
+    dataset_dir
+    emb_dir
+    output_dir
+    exp_id
+    label_mode
+    batch_size
+    test_ratio
+    num_epochs
+    patience
+    learning_rate
+    hidden_layer_size
+    l2_reg
+    standardize
+    solver
+    sidecar_format
+    save_train_predictions
+    pooling
+    lr_scaling
+    warmup_epochs
+    data_generator
+    monitor
+    cache_dir
+    timestamp
+
+    Returns
+    -------
+    results
+
+    """
+    timings = {}
+    dataset, X_train, y_train, X_valid, y_valid, scaler \
+        = load_prepared_framewise_data(annotation_path, taxonomy_path, emb_dir,
+                                       label_mode=label_mode,
+                                       standardize=standardize,
+                                       pooling=pooling, cache_dir=cache_dir,
+                                       timings=timings)
+
+    if not timestamp:
+        timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+
+    results_dir = os.path.join(output_dir, exp_id, timestamp)
+    write_manifest(results_dir, dataset['file_list'], dataset['file_digests'])
+    write_hyper_params(results_dir, {
+        'annotation_path': annotation_path,
+        'taxonomy_path': taxonomy_path,
+        'emb_dir': emb_dir,
+        'label_mode': label_mode,
+        'batch_size': batch_size,
+        'num_epochs': num_epochs,
+        'patience': patience,
+        'learning_rate': learning_rate,
+        'hidden_layer_size': hidden_layer_size,
+        'num_hidden_layers': num_hidden_layers,
+        'l2_reg': l2_reg,
+        'standardize': standardize,
+        'solver': solver,
+        'pooling': pooling,
+        'lr_scaling': lr_scaling,
+        'warmup_epochs': warmup_epochs,
+        'monitor': monitor,
+    })
+
+    return fit_framewise(dataset, X_train, y_train, X_valid, y_valid, scaler,
+                         results_dir, label_mode=label_mode,
+                         batch_size=batch_size, num_epochs=num_epochs,
+                         patience=patience, learning_rate=learning_rate,
+                         hidden_layer_size=hidden_layer_size,
+                         num_hidden_layers=num_hidden_layers, l2_reg=l2_reg,
+                         solver=solver, sidecar_format=sidecar_format,
+                         save_train_predictions=save_train_predictions,
+                         pooling=pooling, lr_scaling=lr_scaling,
+                         warmup_epochs=warmup_epochs,
+                         data_generator=data_generator, monitor=monitor,
+                         timings=timings)
+
+
+def compare_pooling(annotation_path, taxonomy_path, emb_dir, output_dir,
+                    exp_id, poolings=POOLING_TYPES, timestamp=None,
+                    **train_kwargs):
+    """
+    Train a framewise model and models on pooled file embeddings with each of
+    the given types of pooling, and compare their training time and
+    validation AUPRC.
+
+    Parameters
+    ----------
+    annotation_path
+    taxonomy_path
+    emb_dir
+    output_dir
+    exp_id
+    poolings
+    timestamp
+    train_kwargs
+        Additional arguments to `train_framewise`.
+
+    Returns
+    -------
+    comparison_df
+
+    """
+    if not timestamp:
+        timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+
+    comparison_dir = os.path.join(output_dir, exp_id, timestamp)
+    label_mode = train_kwargs.get('label_mode', "fine")
+    levels = ["fine", "coarse"] if label_mode == "both" else [label_mode]
+
+    rows = []
+    for pooling in [None] + list(poolings):
+        mode = pooling or "framewise"
+        print("* Training {} model.".format(mode))
+
+        start_time = time.time()
+        train_framewise(annotation_path, taxonomy_path, emb_dir,
+                        comparison_dir, mode, pooling=pooling,
+                        timestamp=timestamp, **train_kwargs)
+        total_time = time.time() - start_time
+
+        results_dir = os.path.join(comparison_dir, mode, timestamp)
+        with open(os.path.join(results_dir, 'training_profile.json'), 'r') as f:
+            profile = json.load(f)
+
+        row = {
+            'mode': mode,
+            'num_train_examples': profile['config']['num_train_frames'],
+            'train_time': profile['phases'].get('train'),
+            'total_time': total_time,
+        }
+        for level in levels:
+            if label_mode == "both":
+                level_dir = os.path.join(results_dir, level)
+                prefix = level + "_"
+            else:
+                level_dir = results_dir
+                prefix = ""
+            row[prefix + 'micro_auprc'], row[prefix + 'macro_auprc'] \
+                = get_validation_auprc(level_dir, annotation_path,
+                                       taxonomy_path, level)
+        rows.append(row)
+
+    comparison_df = pd.DataFrame(rows)
+    comparison_df.to_csv(os.path.join(comparison_dir, 'pooling_comparison.csv'),
+                         index=False)
+
+    return comparison_df
+
+
+## INCREMENTAL TRAINING
+
+def write_manifest(results_dir, file_list, file_digests):
+    """
+    Write the digests of the annotations of the files used for a run, so
+    that later runs can identify new or changed files.
+
+    Parameters
+    ----------
+    results_dir
+    file_list
+    file_digests
+
+    Returns
+    -------
+
+    """
+    os.makedirs(results_dir, exist_ok=True)
+    with open(os.path.join(results_dir, 'manifest.json'), 'w') as f:
+        json.dump({'files': dict(zip(file_list, file_digests))}, f)
+
+
+def write_hyper_params(results_dir, params):
+    """
+    Record the parameters of a run, so that it can be used as a warm start.
+    Parameters already recorded in the run directory, e.g. by the command
+    line, are kept unless they are given again.
+
+    Parameters
+    ----------
+    results_dir
+    params
+
+    Returns
+    -------
+
+    """
+    params_path = os.path.join(results_dir, 'hyper_params.json')
+    all_params = {}
+    if os.path.exists(params_path):
+        with open(params_path, 'r') as f:
+            all_params = json.load(f)
+    all_params.update(params)
+
+    os.makedirs(results_dir, exist_ok=True)
+    with open(params_path, 'w') as f:
+        json.dump(all_params, f, indent=2)
+
+
+def load_warm_start_weights(warm_start_dir, emb_size, num_classes,
+                            hidden_layer_size=128, num_hidden_layers=0,
+                            l2_reg=1e-5):
+    """
+    Load the weights of a previous run, from its best checkpoint if
+    available, or otherwise from its exported model.
+
+    Parameters
+    ----------
+    warm_start_dir
+    emb_size
+    num_classes
+    hidden_layer_size
+    num_hidden_layers
+    l2_reg
+
+    Returns
+    -------
+    weights
+
+    """
+    model = construct_mlp_framewise(emb_size, num_classes,
+                                    hidden_layer_size=hidden_layer_size,
+                                    num_hidden_layers=num_hidden_layers,
+                                    l2_reg=l2_reg)
+
+    checkpoint_path = os.path.join(warm_start_dir, 'model_best.h5')
+    if os.path.exists(checkpoint_path):
+        model.load_weights(checkpoint_path)
+        return model.get_weights()
+
+    # Undo the folding of the standardization into the first layer
+    predictor = MLPPredictor.load(os.path.join(warm_start_dir, 'model.npz'))
+    weights = list(predictor.weights)
+    biases = list(predictor.biases)
+    if predictor.scaler_mean is not None:
+        weights[0] = weights[0] * predictor.scaler_scale[:, np.newaxis]
+        biases[0] = biases[0] + (predictor.scaler_mean
+                                 / predictor.scaler_scale).dot(weights[0])
+
+    return [arr for layer in zip(weights, biases) for arr in layer]
+
+
+def get_validation_auprc(results_dir, annotation_path, taxonomy_path,
+                         label_mode, aggregation_type="mean"):
+    """
+    Compute the micro and macro AUPRC of the output file of a run.
+
+    Parameters
+    ----------
+    results_dir
+    annotation_path
+    taxonomy_path
+    label_mode
+    aggregation_type
+
+    Returns
+    -------
+    micro_auprc
+    macro_auprc
+
+    """
+    prediction_path = os.path.join(results_dir,
+                                   "output_{}.csv".format(aggregation_type))
+    df_dict = evaluate(prediction_path, annotation_path, taxonomy_path,
+                       label_mode)
+    return micro_averaged_auprc(df_dict), macro_averaged_auprc(df_dict)
+
+
+def train_incremental(annotation_path, taxonomy_path, emb_dir, output_dir,
+                      exp_id, warm_start_dir, batch_size=64, num_epochs=10,
+                      patience=3, learning_rate=1e-4,
+                      compare_full_retrain=False, timestamp=None):
+    """
+    Fine-tune the model of a previous run on the training files whose
+    annotations are new or changed since that run.
+
+    The architecture, label mode and standardization statistics are taken
+    from the previous run. Validation uses the whole validation split.
+
+    Parameters
+    ----------
+    annotation_path
+    taxonomy_path
+    emb_dir
+    output_dir
+    exp_id
+    warm_start_dir
+    batch_size
+    num_epochs
+    patience
+    learning_rate
+    compare_full_retrain
+    timestamp
+
+    Returns
+    -------
+    summary
+
+    """
+    start_time = time.time()
+    timings = {}
+
+    with open(os.path.join(warm_start_dir, 'hyper_params.json'), 'r') as f:
+        prev_params = json.load(f)
+    with open(os.path.join(warm_start_dir, 'manifest.json'), 'r') as f:
+        prev_files = json.load(f)['files']
+
+    label_mode = prev_params['label_mode']
+    if label_mode == "both":
+        raise ValueError("Incremental training is not supported for models "
+                         "trained with both fine and coarse labels.")
+    pooling = prev_params.get('pooling')
+    # Parameters that were not recorded, e.g. not swept over by `sweep.py`,
+    # had their default value
+    model_params = {name: prev_params[name]
+                    for name in ('hidden_layer_size', 'num_hidden_layers',
+                                 'l2_reg')
+                    if name in prev_params}
+
+    print("* Loading dataset.")
+    with timed(timings, 'load_annotations'):
+        annotation_data = pd.read_csv(annotation_path).sort_values('audio_filename')
+        taxonomy = compile_taxonomy(taxonomy_path).yaml_dict
+
+    file_list, file_digests = get_file_digests(annotation_data)
+    file_splits = annotation_data.drop_duplicates('audio_filename') \
+        .set_index('audio_filename')['split']
+
+    changed_files = [filename for filename, digest in zip(file_list, file_digests)
+                     if prev_files.get(filename) != digest]
+    changed_train_files = [filename for filename in changed_files
+                           if file_splits[filename] == 'train']
+    valid_files = [filename for filename in file_list
+                   if file_splits[filename] != 'train']
+
+    print("* {} of {} files are new or changed, {} of them in the training "
+          "split.".format(len(changed_files), len(file_list),
+                          len(changed_train_files)))
+    if not changed_train_files:
+        print("* No new or changed training files, nothing to do.")
+        return None
+
+    # Only targets and embeddings of the new or changed training files and
+    # of the validation files are processed
+    subset_files = set(changed_train_files) | set(valid_files)
+    subset_data = annotation_data[annotation_data['audio_filename'].isin(subset_files)]
+    dataset = build_framewise_dataset(subset_data, taxonomy, emb_dir,
+                                      label_mode=label_mode, timings=timings)
+
+    predictor = MLPPredictor.load(os.path.join(warm_start_dir, 'model.npz'))
+    if predictor.scaler_mean is not None:
+        scaler = make_scaler(predictor.scaler_mean, predictor.scaler_scale)
+    else:
+        scaler = None
+
+    X_train, y_train, X_valid, y_valid, scaler \
+        = prepare_framewise_data(dataset['train_file_idxs'],
+                                 dataset['test_file_idxs'],
+                                 dataset['embeddings'], dataset['target_list'],
+                                 standardize=(scaler is not None),
+                                 scaler=scaler, pooling=pooling,
+                                 timings=timings)
+
+    initial_weights = load_warm_start_weights(warm_start_dir, X_train.shape[1],
+                                              len(dataset['labels']),
+                                              **model_params)
+
+    if not timestamp:
+        timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+
+    results_dir = os.path.join(output_dir, exp_id, timestamp)
+    write_manifest(results_dir, file_list, file_digests)
+
+    # Record the effective parameters, so that this run can itself be used
+    # as a warm start
+    params = dict(prev_params)
+    params.update(batch_size=batch_size, num_epochs=num_epochs,
+                  patience=patience, learning_rate=learning_rate,
+                  solver="adam", warm_start_dir=warm_start_dir)
+    write_hyper_params(results_dir, params)
+
+    fit_framewise(dataset, X_train, y_train, X_valid, y_valid, scaler,
+                  results_dir, label_mode=label_mode, batch_size=batch_size,
+                  num_epochs=num_epochs, patience=patience,
+                  learning_rate=learning_rate, solver="adam",
+                  initial_weights=initial_weights, pooling=pooling,
+                  timings=timings, **model_params)
+
+    summary = {
+        'warm_start_dir': warm_start_dir,
+        'num_files': len(file_list),
+        'num_changed_files': len(changed_files),
+        'num_changed_train_files': len(changed_train_files),
+        'num_removed_files': len(set(prev_files) - set(file_list)),
+        'num_train_frames': len(X_train),
+        'incremental': {'time': time.time() - start_time},
+    }
+    summary['incremental']['micro_auprc'], summary['incremental']['macro_auprc'] \
+        = get_validation_auprc(results_dir, annotation_path, taxonomy_path,
+                               label_mode)
+
+    if compare_full_retrain:
+        print("* Retraining from scratch for comparison.")
+        full_start_time = time.time()
+        full_exp_id = 'full_retrain'
+        train_framewise(annotation_path, taxonomy_path, emb_dir, results_dir,
+                        full_exp_id, label_mode=label_mode,
+                        batch_size=prev_params.get('batch_size', batch_size),
+                        num_epochs=prev_params.get('num_epochs', 100),
+                        patience=prev_params.get('patience', 20),
+                        learning_rate=prev_params.get('learning_rate', learning_rate),
+                        standardize=(scaler is not None), pooling=pooling,
+                        timestamp=timestamp, **model_params)
+        full_results_dir = os.path.join(results_dir, full_exp_id, timestamp)
+
+        summary['full_retrain'] = {'time': time.time() - full_start_time}
+        summary['full_retrain']['micro_auprc'], summary['full_retrain']['macro_auprc'] \
+            = get_validation_auprc(full_results_dir, annotation_path,
+                                   taxonomy_path, label_mode)
+
+    with open(os.path.join(results_dir, 'incremental_summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    return summary
+
+
+## MODEL EVALUATION
+
+def predict_framewise(embeddings, test_file_idxs, model, scaler=None,
+                      batch_size=4096, pooling=None):
+    """
+    Evaluate the output of a framewise classification model.
+
+    All frames of the given files are run through the model in large
+    batches and pooled per file afterwards. For a model with several
+    outputs, a list with the results of each output is returned.
+
+    For models trained on pooled file embeddings, `pooling` must be the
+    same pooling, and the frames of each file are pooled before prediction.
+
+    Parameters
+    ----------
+    embeddings
+    test_file_idxs
+    model
+    scaler
+    batch_size
+    pooling
+
+    Returns
+    -------
+    results
+    """
+    X, offsets = pack_framewise_inputs(embeddings, test_file_idxs,
+                                       scaler=scaler, pooling=pooling)
+
+    multi_output = isinstance(model.output_shape, list)
+    output_shapes = model.output_shape if multi_output else [model.output_shape]
+
+    if len(X) == 0:
+        pred_frames = [np.zeros((0, shape[-1]), dtype=np.float32)
+                       for shape in output_shapes]
+    else:
+        pred_frames = model.predict(X, batch_size=batch_size)
+        if not multi_output:
+            pred_frames = [pred_frames]
+
+    results = [aggregate_frame_predictions(pred, offsets) for pred in pred_frames]
+
+    return results if multi_output else results[0]
+
+
+def get_output_layout(taxonomy, label_mode):
+    """
+    Precompute the layout of the output file for the given taxonomy: the
+    output fields and how model outputs map onto them.
+
+    Parameters
+    ----------
+    taxonomy
+    label_mode
+
+    Returns
+    -------
+    layout
+
+    """
+    taxonomy = compile_taxonomy(taxonomy)
+    num_fine_fields = len(taxonomy.full_fine_labels)
+
+    # Fine predictions are grouped by coarse category, so the coarse-level
+    # prediction of each category is a max over a contiguous segment
+    segment_bounds = taxonomy.complete_segment_bounds
+    coarse_idxs_with_fine = np.flatnonzero(segment_bounds[1:]
+                                           > segment_bounds[:-1])
+
+    # The baseline doesn't account for incomplete labels, so their output
+    # column stays 0
+    layout = {
+        'label_mode': label_mode,
+        'fields': list(taxonomy.output_fields),
+        'fine_output_cols': taxonomy.complete_idxs,
+        'coarse_output_cols': num_fine_fields + np.arange(len(taxonomy.coarse_ids)),
+        'coarse_segment_starts': segment_bounds[coarse_idxs_with_fine],
+        'coarse_segment_cols': num_fine_fields + coarse_idxs_with_fine,
+    }
+
+    return layout
+
+
+def get_output_matrix(y_pred, layout):
+    """
+    Map model predictions onto the columns of the output file.
+
+    Parameters
+    ----------
+    y_pred
+    layout
+
+    Returns
+    -------
+    output
+
+    """
+    y_pred = np.asarray(y_pred)
+    num_files = y_pred.shape[0]
+    dtype = y_pred.dtype if y_pred.dtype.kind == 'f' else np.float64
+    output = np.zeros((num_files, len(layout['fields']) - 1), dtype=dtype)
+
+    if num_files == 0:
+        return output
+
+    if layout['label_mode'] == "fine":
+        output[:, layout['fine_output_cols']] = y_pred
+
+        # Add coarse level labels corresponding to fine level
+        # predictions. Obtain by taking the maximum from the
+        # fine level labels
+        output[:, layout['coarse_segment_cols']] = np.maximum(
+            np.maximum.reduceat(y_pred, layout['coarse_segment_starts'], axis=1), 0)
+    else:
+        # Fine level is left with placeholder values
+        output[:, layout['coarse_output_cols']] = y_pred
+
+    return output
+
+
+def generate_output_file(y_pred, test_file_idxs, results_dir, file_list,
+                         aggregation_type, label_mode, taxonomy, layout=None,
+                         sidecar_format=None):
+    """
+    Write the output file containing model predictions
+
+    Parameters
+    ----------
+    y_pred
+    test_file_idxs
+    results_dir
+    file_list
+    aggregation_type
+    label_mode
+    taxonomy
+    layout
+    sidecar_format
+
+    Returns
+    -------
+
+    """
+    if layout is None:
+        layout = get_output_layout(taxonomy, label_mode)
+
+    output_path = os.path.join(results_dir, "output_{}.csv".format(aggregation_type))
+    test_file_list = [file_list[idx] for idx in test_file_idxs]
+
+    output = get_output_matrix(y_pred, layout)
+
+    # Values are written as float64, as the file was always written, so
+    # that float32 model outputs keep their exact value in the CSV file
+    output_df = pd.DataFrame(output.astype(np.float64),
+                             columns=layout['fields'][1:])
+    output_df.insert(0, layout['fields'][0], test_file_list)
+    output_df.to_csv(output_path, index=False)
+
+    # Optionally also write the predictions in a binary format, which is
+    # much faster to load for large prediction sets
+    if sidecar_format == "npz":
+        np.savez_compressed(
+            os.path.join(results_dir, "output_{}.npz".format(aggregation_type)),
+            audio_filename=np.array(test_file_list),
+            fields=np.array(layout['fields'][1:]),
+            predictions=output)
+    elif sidecar_format == "parquet":
+        output_df = pd.DataFrame(output, columns=layout['fields'][1:])
+        output_df.insert(0, layout['fields'][0], test_file_list)
+        output_df.to_parquet(
+            os.path.join(results_dir, "output_{}.parquet".format(aggregation_type)),
+            index=False)
+    elif sidecar_format is not None:
+        raise ValueError("Invalid sidecar format: {}".format(sidecar_format))
+
+
+if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("annotation_path")
     parser.add_argument("taxonomy_path")
@@ -618,37 +2019,140 @@ if __name__ == '__main__':
 
     parser.add_argument("--hidden_layer_size", type=int, default=128)
     parser.add_argument("--num_hidden_layers", type=int, default=0)
-    parser.add_argument("--learning_rate", type=float, default=1e-3)
+    parser.add_argument("--learning_rate", type=float, default=None,
+                        help="Defaults to 1e-3, or 1e-4 with "
+                             "--warm_start_dir.")
     parser.add_argument("--l2_reg", type=float, default=1e-5)
     parser.add_argument("--batch_size", type=int, default=64)
-    parser.add_argument("--num_epochs", type=int, default=100)
-    parser.add_argument("--patience", type=int, default=20)
+    parser.add_argument("--num_epochs", type=int, default=None,
+                        help="Defaults to 100, or 10 with --warm_start_dir.")
+    parser.add_argument("--patience", type=int, default=None,
+                        help="Defaults to 20, or 3 with --warm_start_dir.")
     parser.add_argument("--no_standardize", action='store_true')
-    parser.add_argument("--label_mode", type=str, choices=["fine", "coarse"],
-                        default='fine')
+    parser.add_argument("--label_mode", type=str,
+                        choices=["fine", "coarse", "both"], default='fine')
+    parser.add_argument("--solver", type=str, choices=["adam", "lbfgs"],
+                        default='adam')
+    parser.add_argument("--output_sidecar", type=str, choices=["npz", "parquet"],
+                        default=None)
+    parser.add_argument("--save_train_predictions", action='store_true')
+    parser.add_argument("--cache_dir", type=str, default=None)
+    parser.add_argument("--warm_start_dir", type=str, default=None,
+                        help="Fine-tune the model of this previous run on "
+                             "new or changed files only.")
+    parser.add_argument("--compare_full_retrain", action='store_true')
+    parser.add_argument("--pooling", type=str, choices=POOLING_TYPES,
+                        default=None,
+                        help="Train on one pooled embedding per file instead "
+                             "of on individual frames.")
+    parser.add_argument("--lr_scaling", type=str, choices=["linear", "sqrt"],
+                        default=None,
+                        help="Scale the learning rate with the ratio of the "
+                             "batch size to {}.".format(REFERENCE_BATCH_SIZE))
+    parser.add_argument("--warmup_epochs", type=int, default=0)
+    parser.add_argument("--data_generator", action='store_true',
+                        help="Gather and prefetch training batches in a "
+                             "background thread.")
+    parser.add_argument("--monitor", type=str, choices=["val_loss", "val_auprc"],
+                        default='val_loss',
+                        help="Validation quantity used for checkpointing and "
+                             "early stopping.")
+    parser.add_argument("--intra_op_threads", type=int, default=0)
+    parser.add_argument("--inter_op_threads", type=int, default=0)
+    parser.add_argument("--compare_pooling", action='store_true',
+                        help="Train framewise and with the given pooling (or "
+                             "every pooling if not given) and compare them.")
+    parser.add_argument("--timestamp", type=str, default=None,
+                        help="Name of the run directory, instead of the "
+                             "current date and time.")
 
     args = parser.parse_args()
 
+    # Check before training that pandas can write parquet files, which
+    # needs an engine that is not among the requirements
+    if args.output_sidecar == "parquet" \
+            and importlib.util.find_spec("pyarrow") is None \
+            and importlib.util.find_spec("fastparquet") is None:
+        parser.error("--output_sidecar parquet requires pyarrow or "
+                     "fastparquet to be installed.")
+
+    timestamp = args.timestamp \
+        or datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+
+    if args.intra_op_threads or args.inter_op_threads:
+        configure_session(args.intra_op_threads, args.inter_op_threads)
+
+    if args.warm_start_dir:
+        # Unset options keep the defaults of `train_incremental`, which only
+        # creates the run directory, with its effective parameters, if
+        # there are files to train on
+        incremental_kwargs = {name: getattr(args, name)
+                              for name in ('num_epochs', 'patience',
+                                           'learning_rate')
+                              if getattr(args, name) is not None}
+        train_incremental(args.annotation_path,
+                          args.taxonomy_path,
+                          args.emb_dir,
+                          args.output_dir,
+                          args.exp_id,
+                          args.warm_start_dir,
+                          batch_size=args.batch_size,
+                          compare_full_retrain=args.compare_full_retrain,
+                          timestamp=timestamp,
+                          **incremental_kwargs)
+        exit()
+
+    # Defaults of training from scratch
+    for name, default in (('num_epochs', 100), ('patience', 20),
+                          ('learning_rate', 1e-3)):
+        if getattr(args, name) is None:
+            setattr(args, name, default)
+
     # save args to disk
-    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
     out_dir = os.path.join(args.output_dir, args.exp_id, timestamp)
     os.makedirs(out_dir, exist_ok=True)
     kwarg_file = os.path.join(out_dir, "hyper_params.json")
     with open(kwarg_file, 'w') as f:
         json.dump(vars(args), f, indent=2)
 
+    train_kwargs = {
+        'label_mode': args.label_mode,
+        'batch_size': args.batch_size,
+        'num_epochs': args.num_epochs,
+        'patience': args.patience,
+        'learning_rate': args.learning_rate,
+        'hidden_layer_size': args.hidden_layer_size,
+        'num_hidden_layers': args.num_hidden_layers,
+        'l2_reg': args.l2_reg,
+        'standardize': (not args.no_standardize),
+        'solver': args.solver,
+        'sidecar_format': args.output_sidecar,
+        'save_train_predictions': args.save_train_predictions,
+        'lr_scaling': args.lr_scaling,
+        'warmup_epochs': args.warmup_epochs,
+        'data_generator': args.data_generator,
+        'monitor': args.monitor,
+        'cache_dir': args.cache_dir,
+    }
+
+    if args.compare_pooling:
+        comparison_df = compare_pooling(args.annotation_path,
+                                        args.taxonomy_path,
+                                        args.emb_dir,
+                                        args.output_dir,
+                                        args.exp_id,
+                                        poolings=([args.pooling] if args.pooling
+                                                  else POOLING_TYPES),
+                                        timestamp=timestamp,
+                                        **train_kwargs)
+        print(comparison_df.to_string(index=False))
+        exit()
+
     train_framewise(args.annotation_path,
                     args.taxonomy_path,
                     args.emb_dir,
                     args.output_dir,
                     args.exp_id,
-                    label_mode=args.label_mode,
-                    batch_size=args.batch_size,
-                    num_epochs=args.num_epochs,
-                    patience=args.patience,
-                    learning_rate=args.learning_rate,
-                    hidden_layer_size=args.hidden_layer_size,
-                    num_hidden_layers=args.num_hidden_layers,
-                    l2_reg=args.l2_reg,
-                    standardize=(not args.no_standardize),
-                    timestamp=timestamp)
+                    pooling=args.pooling,
+                    timestamp=timestamp,
+                    **train_kwargs)
@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from sklearn.preprocessing import StandardScaler
+
+from inference import pack_embeddings
+
+
+# Bump when the layout of the cache changes
+CACHE_VERSION = 2
+
+ARRAY_NAMES = ('X_all', 'offsets', 'target_list', 'train_file_idxs',
+               'test_file_idxs', 'X_train', 'y_train', 'X_valid', 'y_valid')
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """
+    Compute the SHA-1 hash of the contents of a file.
+
+    Parameters
+    ----------
+    path
+    chunk_size
+
+    Returns
+    -------
+    digest
+
+    """
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def hash_embedding_store(emb_dir):
+    """
+    Compute a fingerprint of an embedding directory from the names, sizes
+    and modification times of its files, without reading their contents.
+
+    Parameters
+    ----------
+    emb_dir
+
+    Returns
+    -------
+    digest
+
+    """
+    sha = hashlib.sha1()
+    for entry in sorted(os.scandir(emb_dir), key=lambda e: e.name):
+        if entry.is_file():
+            stat = entry.stat()
+            sha.update("{}:{}:{}\n".format(entry.name, stat.st_size,
+                                           stat.st_mtime_ns).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def get_cache_key(annotation_path, taxonomy_path, emb_dir, label_mode,
+                  standardize, pooling=None):
+    """
+    Compute the key of a prepared dataset.
+
+    Parameters
+    ----------
+    annotation_path
+    taxonomy_path
+    emb_dir
+    label_mode
+    standardize
+    pooling
+
+    Returns
+    -------
+    key
+
+    """
+    components = [
+        str(CACHE_VERSION),
+        hash_file(annotation_path),
+        hash_file(taxonomy_path),
+        hash_embedding_store(emb_dir),
+        label_mode,
+        str(bool(standardize)),
+        str(pooling),
+    ]
+    return hashlib.sha1("|".join(components).encode('utf-8')).hexdigest()
+
+
+def make_scaler(mean, scale):
+    """
+    Rebuild a fitted StandardScaler from its statistics.
+
+    Parameters
+    ----------
+    mean
+    scale
+
+    Returns
+    -------
+    scaler
+
+    """
+    scaler = StandardScaler()
+    scaler.mean_ = np.asarray(mean)
+    scaler.scale_ = np.asarray(scale)
+    scaler.var_ = scaler.scale_ ** 2
+    scaler.n_features_in_ = len(scaler.mean_)
+    return scaler
+
+
+def save_prepared_dataset(cache_path, dataset, X_train, y_train, X_valid,
+                          y_valid, scaler):
+    """
+    Save a prepared dataset to the cache.
+
+    Parameters
+    ----------
+    cache_path
+    dataset
+    X_train
+    y_train
+    X_valid
+    y_valid
+    scaler
+
+    Returns
+    -------
+
+    """
+    X_all, offsets = pack_embeddings(dataset['embeddings'],
+                                     np.arange(len(dataset['file_list'])))
+
+    arrays = {
+        'X_all': X_all,
+        'offsets': offsets,
+        'target_list': dataset['target_list'],
+        'train_file_idxs': dataset['train_file_idxs'],
+        'test_file_idxs': dataset['test_file_idxs'],
+        'X_train': X_train,
+        'y_train': y_train,
+        'X_valid': X_valid,
+        'y_valid': y_valid,
+    }
+    if scaler is not None:
+        arrays['scaler_mean'] = scaler.mean_
+        arrays['scaler_scale'] = scaler.scale_
+
+    metadata = {
+        'file_list': dataset['file_list'],
+        'labels': dataset['labels'],
+        'file_digests': dataset['file_digests'],
+        'standardized': scaler is not None,
+    }
+
+    # Write to a temporary directory first so that concurrent or interrupted
+    # runs never see a partially written cache
+    tmp_path = "{}.tmp{}".format(cache_path, os.getpid())
+    os.makedirs(tmp_path, exist_ok=True)
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp_path, name + '.npy'), np.asarray(arr))
+    with open(os.path.join(tmp_path, 'metadata.json'), 'w') as f:
+        json.dump(metadata, f)
+
+    try:
+        os.rename(tmp_path, cache_path)
+    except OSError:
+        # Another process already wrote the same cache entry
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def load_prepared_dataset(cache_path, taxonomy):
+    """
+    Load a prepared dataset from the cache. Arrays are memory-mapped.
+
+    Parameters
+    ----------
+    cache_path
+    taxonomy
+
+    Returns
+    -------
+    dataset
+    X_train
+    y_train
+    X_valid
+    y_valid
+    scaler
+
+    """
+    with open(os.path.join(cache_path, 'metadata.json'), 'r') as f:
+        metadata = json.load(f)
+
+    arrays = {name: np.load(os.path.join(cache_path, name + '.npy'),
+                            mmap_mode='r')
+              for name in ARRAY_NAMES}
+
+    if metadata['standardized']:
+        scaler = make_scaler(np.load(os.path.join(cache_path, 'scaler_mean.npy')),
+                             np.load(os.path.join(cache_path, 'scaler_scale.npy')))
+    else:
+        scaler = None
+
+    dataset = {
+        'taxonomy': taxonomy,
+        'file_list': metadata['file_list'],
+        'labels': metadata['labels'],
+        'target_list': arrays['target_list'],
+        'train_file_idxs': np.array(arrays['train_file_idxs']),
+        'test_file_idxs': np.array(arrays['test_file_idxs']),
+        # Embeddings are views into the packed frames of all files
+        'embeddings': np.split(arrays['X_all'], arrays['offsets'][1:-1]),
+        'file_digests': metadata['file_digests'],
+    }
+
+    return dataset, arrays['X_train'], arrays['y_train'], \
+        arrays['X_valid'], arrays['y_valid'], scaler
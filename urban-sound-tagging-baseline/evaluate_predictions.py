@@ -1,5 +1,198 @@
 import argparse
-from metrics import evaluate, micro_averaged_auprc, macro_averaged_auprc
+import glob
+import json
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+from metrics import evaluate_df, micro_averaged_auprc, \
+                    macro_averaged_auprc, binned_auprc_bounds, load_taxonomy, \
+                    parse_ground_truth, parse_fine_prediction, \
+                    parse_coarse_prediction
+from bootstrap import bootstrap_auprc, confidence_intervals, paired_comparison
+
+
+# Process-local state of each evaluation worker, set up by `init_worker`
+_worker_state = {}
+
+
+## BATCH EVALUATION
+
+def parse_prediction(pred_path, yaml_dict, mode, audio_filenames=None):
+    """
+    Parse the predictions of a file at the given level.
+
+    Parameters
+    ----------
+    pred_path
+    yaml_dict
+    mode
+    audio_filenames
+
+    Returns
+    -------
+    pred_df
+
+    """
+    if mode == "fine":
+        return parse_fine_prediction(pred_path, yaml_dict, audio_filenames)
+    else:
+        return parse_coarse_prediction(pred_path, yaml_dict, audio_filenames)
+
+
+def expand_prediction_paths(patterns):
+    """
+    Expand glob patterns into a sorted list of prediction files. Paths
+    without wildcards are kept as is.
+
+    Parameters
+    ----------
+    patterns
+
+    Returns
+    -------
+    pred_paths
+
+    """
+    pred_paths = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                raise ValueError("No prediction file matches {}".format(pattern))
+            pred_paths.extend(matches)
+        else:
+            pred_paths.append(pattern)
+    return pred_paths
+
+
+def init_worker(gt_df, yaml_dict, n_bins=None):
+    """
+    Set up an evaluation worker process with the parsed ground truth and
+    taxonomy.
+
+    Parameters
+    ----------
+    gt_df
+    yaml_dict
+    n_bins
+
+    Returns
+    -------
+
+    """
+    _worker_state.update(gt_df=gt_df, yaml_dict=yaml_dict, n_bins=n_bins)
+
+
+def evaluate_file(pred_path):
+    """
+    Compute the summary metrics of a prediction file at both levels.
+
+    Parameters
+    ----------
+    pred_path
+
+    Returns
+    -------
+    summary
+        Dictionary with the micro-averaged AUPRC, micro-averaged F1-score at
+        a threshold of 0.5, macro-averaged AUPRC, and AUPRC of each coarse
+        category, for each level. Binned metrics also come with the bounds
+        of their deviation from the exact micro-averaged and macro-averaged
+        AUPRC.
+
+    """
+    gt_df = _worker_state['gt_df']
+    yaml_dict = _worker_state['yaml_dict']
+    n_bins = _worker_state.get('n_bins')
+
+    summary = {'prediction_path': pred_path}
+    for mode in ("fine", "coarse"):
+        pred_df = parse_prediction(pred_path, yaml_dict, mode,
+                                   gt_df['audio_filename'].values)
+        if n_bins:
+            df_dict = evaluate_df(pred_df, gt_df, yaml_dict, mode,
+                                  method="binned", n_bins=n_bins)
+        else:
+            df_dict = evaluate_df(pred_df, gt_df, yaml_dict, mode)
+        micro_auprc, eval_df = micro_averaged_auprc(df_dict, return_df=True)
+        macro_auprc, class_auprc = macro_averaged_auprc(df_dict,
+                                                        return_classwise=True)
+
+        # First threshold that is at least 0.5
+        thresh_0pt5_idx = np.argmax(eval_df['threshold'].values >= 0.5)
+
+        summary[mode + '_micro_auprc'] = micro_auprc
+        summary[mode + '_micro_f1'] = eval_df['F'].values[thresh_0pt5_idx]
+        summary[mode + '_macro_auprc'] = macro_auprc
+        for coarse_id, auprc in class_auprc.items():
+            summary['{}_auprc_{}'.format(mode, coarse_id)] = auprc
+
+        if n_bins:
+            micro_bound, macro_bound, _ = binned_auprc_bounds(df_dict)
+            summary[mode + '_micro_auprc_bound'] = micro_bound
+            summary[mode + '_macro_auprc_bound'] = macro_bound
+
+    return summary
+
+
+def evaluate_batch(pred_paths, annotation_path, yaml_path, n_jobs=1,
+                   n_bins=None):
+    """
+    Evaluate many prediction files, parsing the ground truth and taxonomy
+    only once.
+
+    Parameters
+    ----------
+    pred_paths
+    annotation_path
+    yaml_path
+    n_jobs
+    n_bins
+        If given, approximate the metrics over a grid of this many
+        thresholds, as with `--n_bins`.
+
+    Returns
+    -------
+    summary_df
+        DataFrame with the metrics of each file, in the order of
+        `pred_paths`.
+
+    """
+    yaml_dict = load_taxonomy(yaml_path)
+    gt_df = parse_ground_truth(annotation_path, yaml_dict)
+
+    n_jobs = max(1, min(n_jobs, len(pred_paths)))
+    if n_jobs == 1:
+        init_worker(gt_df, yaml_dict, n_bins)
+        summaries = [evaluate_file(pred_path) for pred_path in pred_paths]
+    else:
+        ctx = mp.get_context('spawn')
+        with ctx.Pool(n_jobs, initializer=init_worker,
+                      initargs=(gt_df, yaml_dict, n_bins)) as pool:
+            summaries = pool.map(evaluate_file, pred_paths)
+
+    return pd.DataFrame(summaries)
+
+
+def print_intervals(interval_df, confidence):
+    """
+    Print bootstrap confidence intervals.
+
+    Parameters
+    ----------
+    interval_df
+    confidence
+
+    Returns
+    -------
+
+    """
+    for name, row in interval_df.iterrows():
+        line = "      - {}: [{:.4f}, {:.4f}] ({:.0f}% CI, std {:.4f})".format(
+            name, row['lower'], row['upper'], 100 * confidence, row['std'])
+        if 'p_value' in row:
+            line += ", p = {:.4f}".format(row['p_value'])
+        print(line)
 
 
 if __name__ == '__main__':
@@ -9,21 +202,89 @@ if __name__ == '__main__':
         See `metrics.py` for more information about the metrics.
         """)
 
-    parser.add_argument('prediction_path', type=str,
-                        help='Path to prediction CSV file.')
+    parser.add_argument('prediction_path', type=str, nargs='+',
+                        help='Path to prediction CSV file. Several paths or '
+                             'glob patterns evaluate all the files and write '
+                             'a comparison table.')
     parser.add_argument('annotation_path', type=str,
                         help='Path to dataset annotation CSV file.')
     parser.add_argument('yaml_path', type=str,
                         help='Path to dataset taxonomy YAML file.')
+    parser.add_argument('--bootstrap', type=int, default=0,
+                        help='Number of bootstrap replicates of the evaluated '
+                             'files used to compute confidence intervals.')
+    parser.add_argument('--confidence', type=float, default=0.95,
+                        help='Confidence level of the bootstrap intervals.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed of the bootstrap replicates.')
+    parser.add_argument('--n_jobs', type=int, default=1,
+                        help='Number of processes computing the bootstrap '
+                             'replicates, or evaluating the files.')
+    parser.add_argument('--compare_path', type=str, default=None,
+                        help='Path to another prediction CSV file to compare '
+                             'against with a paired bootstrap.')
+
+    parser.add_argument('--n_bins', type=int, default=None,
+                        help='Approximate the metrics from histograms of the '
+                             'predictions over a grid of this many '
+                             'thresholds, and report a bound of the '
+                             'deviation from the exact metrics.')
+    parser.add_argument('--output_path', type=str, default=None,
+                        help='Path to the CSV or JSON (by extension) file to '
+                             'write the comparison table of several '
+                             'prediction files to.')
 
     args = parser.parse_args()
 
+    pred_paths = expand_prediction_paths(args.prediction_path)
+
+    if len(pred_paths) > 1 or args.output_path:
+        # Bootstrap intervals and paired comparisons are only computed for
+        # a single prediction file
+        if args.bootstrap > 0 or args.compare_path:
+            parser.error("--bootstrap and --compare_path cannot be used with "
+                         "several prediction files or --output_path.")
+
+        summary_df = evaluate_batch(pred_paths, args.annotation_path,
+                                    args.yaml_path, n_jobs=args.n_jobs,
+                                    n_bins=args.n_bins)
+
+        if args.output_path and args.output_path.endswith('.json'):
+            with open(args.output_path, 'w') as f:
+                json.dump(summary_df.to_dict(orient='records'), f, indent=2)
+        elif args.output_path:
+            summary_df.to_csv(args.output_path, index=False)
+
+        columns = ['prediction_path', 'fine_micro_auprc', 'fine_micro_f1',
+                   'fine_macro_auprc', 'coarse_micro_auprc', 'coarse_micro_f1',
+                   'coarse_macro_auprc']
+        if args.n_bins:
+            columns += ['fine_micro_auprc_bound', 'fine_macro_auprc_bound',
+                        'coarse_micro_auprc_bound', 'coarse_macro_auprc_bound']
+        print(summary_df[columns].to_string(index=False))
+        parser.exit()
+
+    prediction_path = pred_paths[0]
+    yaml_dict = load_taxonomy(args.yaml_path)
+    gt_df = parse_ground_truth(args.annotation_path, yaml_dict)
+
     for mode in ("fine", "coarse"):
 
-        df_dict = evaluate(args.prediction_path,
-                           args.annotation_path,
-                           args.yaml_path,
-                           mode)
+        pred_df = parse_prediction(prediction_path, yaml_dict, mode,
+                                   gt_df['audio_filename'].values)
+
+        if args.n_bins:
+            df_dict = evaluate_df(pred_df,
+                                  gt_df,
+                                  yaml_dict,
+                                  mode,
+                                  method="binned",
+                                  n_bins=args.n_bins)
+        else:
+            df_dict = evaluate_df(pred_df,
+                                  gt_df,
+                                  yaml_dict,
+                                  mode)
 
         micro_auprc, eval_df = micro_averaged_auprc(df_dict, return_df=True)
         macro_auprc, class_auprc = macro_averaged_auprc(df_dict, return_classwise=True)
@@ -41,3 +302,38 @@ if __name__ == '__main__':
         for coarse_id, auprc in class_auprc.items():
             print("      - {}: {}".format(coarse_id, auprc))
 
+        if args.n_bins:
+            micro_bound, macro_bound, class_bounds = binned_auprc_bounds(df_dict)
+            print(" * Binned over {} thresholds, AUPRC deviation at most:".format(
+                args.n_bins))
+            print("      - micro: {}".format(micro_bound))
+            print("      - macro: {}".format(macro_bound))
+            for coarse_id, bound in class_bounds.items():
+                print("      - {}: {}".format(coarse_id, bound))
+
+        if args.bootstrap > 0:
+            pred_dfs = [pred_df]
+            if args.compare_path:
+                pred_dfs.append(parse_prediction(
+                    args.compare_path, yaml_dict, mode,
+                    gt_df['audio_filename'].values))
+
+            replicate_dfs = bootstrap_auprc(pred_dfs, gt_df, yaml_dict, mode,
+                                            n_replicates=args.bootstrap,
+                                            seed=args.seed,
+                                            n_jobs=args.n_jobs)
+
+            print(" * Bootstrap intervals ({} replicates):".format(
+                args.bootstrap))
+            print_intervals(confidence_intervals(replicate_dfs[0],
+                                                 args.confidence),
+                            args.confidence)
+
+            if args.compare_path:
+                print(" * Paired comparison with {}:".format(args.compare_path))
+                print("   (difference of scores, and fraction of replicates "
+                      "in which it is not positive)")
+                print_intervals(paired_comparison(replicate_dfs[0],
+                                                  replicate_dfs[1],
+                                                  args.confidence),
+                                args.confidence)
@@ -0,0 +1,313 @@
+import argparse
+import gzip
+import os
+import numpy as np
+
+
+# Ways of pooling the frames of a file into a single embedding
+POOLING_TYPES = ('mean', 'max', 'meanstd')
+
+
+## POOLING
+
+def pack_embeddings(embeddings, file_idxs):
+    """
+    Concatenate the frames of the given files into a single matrix.
+
+    Parameters
+    ----------
+    embeddings
+    file_idxs
+
+    Returns
+    -------
+    X
+    offsets
+
+    """
+    lengths = np.array([len(embeddings[idx]) for idx in file_idxs], dtype=int)
+    if np.any(lengths == 0):
+        raise ValueError("Cannot pack files without any embedding frames.")
+
+    # offsets[i]:offsets[i+1] are the rows of X belonging to the i-th file
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(int)
+
+    if len(lengths) > 0:
+        X = np.concatenate([embeddings[idx] for idx in file_idxs], axis=0)
+    else:
+        X = np.zeros((0, 0), dtype=np.float32)
+
+    return X, offsets
+
+
+def pool_embeddings(embeddings, file_idxs, pooling):
+    """
+    Pool the frames of each of the given files into a single embedding,
+    using their mean, max, or mean and standard deviation concatenated.
+
+    Parameters
+    ----------
+    embeddings
+    file_idxs
+    pooling
+
+    Returns
+    -------
+    X
+
+    """
+    if pooling not in POOLING_TYPES:
+        raise ValueError("Invalid pooling type: {}".format(pooling))
+
+    X, offsets = pack_embeddings(embeddings, file_idxs)
+    starts = offsets[:-1]
+    counts = np.diff(offsets)[:, np.newaxis]
+
+    if len(starts) == 0:
+        emb_size = X.shape[1] * (2 if pooling == "meanstd" else 1)
+        return np.zeros((0, emb_size), dtype=X.dtype)
+
+    if pooling == "max":
+        return np.maximum.reduceat(X, starts, axis=0)
+
+    X_mean = np.add.reduceat(X, starts, axis=0, dtype=np.float64) / counts
+    if pooling == "mean":
+        return X_mean.astype(X.dtype)
+
+    deviations = X - np.repeat(X_mean, counts.ravel(), axis=0)
+    X_std = np.sqrt(np.add.reduceat(deviations ** 2, starts, axis=0) / counts)
+    return np.concatenate([X_mean, X_std], axis=1).astype(X.dtype)
+
+
+def aggregate_frame_predictions(pred_frames, offsets):
+    """
+    Pool framewise predictions into file-level predictions using segment
+    reductions over the file offsets.
+
+    Parameters
+    ----------
+    pred_frames
+    offsets
+
+    Returns
+    -------
+    results
+
+    """
+    starts = offsets[:-1]
+    counts = np.diff(offsets)[:, np.newaxis]
+
+    if len(starts) == 0:
+        empty = np.zeros((0,) + pred_frames.shape[1:], dtype=pred_frames.dtype)
+        return {'max': empty, 'mean': empty.copy(), 'softmax': empty.copy()}
+
+    y_pred_max = np.maximum.reduceat(pred_frames, starts, axis=0)
+    y_pred_mean = (np.add.reduceat(pred_frames, starts, axis=0) / counts) \
+        .astype(pred_frames.dtype, copy=False)
+
+    # Softmax over the frames of each file, subtracting the per-file max
+    # for numerical stability, then use it to weight the frame predictions
+    exp_frames = np.exp(pred_frames - np.repeat(y_pred_max, counts.ravel(), axis=0))
+    y_pred_softmax = np.add.reduceat(exp_frames * pred_frames, starts, axis=0) \
+        / np.add.reduceat(exp_frames, starts, axis=0)
+
+    results = {
+        'max': y_pred_max,
+        'mean': y_pred_mean,
+        'softmax': y_pred_softmax
+    }
+
+    return results
+
+
+## MODEL
+
+def fold_scaler(weights, bias, mean, scale):
+    """
+    Fold input standardization into the weights of a dense layer, such that
+    `((X - mean) / scale).dot(weights) + bias == X.dot(weights_) + bias_`.
+
+    Parameters
+    ----------
+    weights
+    bias
+    mean
+    scale
+
+    Returns
+    -------
+    weights_
+    bias_
+
+    """
+    weights_ = weights / scale[:, np.newaxis]
+    bias_ = bias - (mean / scale).dot(weights)
+    return weights_, bias_
+
+
+class MLPPredictor(object):
+    """
+    NumPy implementation of the forward pass of the framewise MLP, with ReLU
+    hidden layers and a sigmoid output layer.
+
+    Models trained on pooled file embeddings record the type of pooling,
+    which is then applied to the frames of each file before prediction.
+
+    Exposes the parts of the Keras model interface used for prediction, so
+    it can be used wherever a trained Keras model is expected.
+    """
+    def __init__(self, weights, biases, labels=None, label_mode=None,
+                 scaler_mean=None, scaler_scale=None, pooling=None):
+        self.weights = [np.asarray(w, dtype=np.float32) for w in weights]
+        self.biases = [np.asarray(b, dtype=np.float32) for b in biases]
+        self.labels = list(labels) if labels is not None else None
+        self.label_mode = label_mode
+        # Statistics of the standardization folded into the first layer,
+        # kept for reference and for fine-tuning the model later
+        self.scaler_mean = scaler_mean
+        self.scaler_scale = scaler_scale
+        self.pooling = pooling
+
+    @property
+    def output_shape(self):
+        return (None, self.weights[-1].shape[1])
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a model saved with `MLPPredictor.save`.
+
+        Parameters
+        ----------
+        path
+
+        Returns
+        -------
+        model
+
+        """
+        with np.load(path) as data:
+            num_layers = int(data['num_layers'])
+            weights = [data['weights_{}'.format(idx)] for idx in range(num_layers)]
+            biases = [data['bias_{}'.format(idx)] for idx in range(num_layers)]
+            labels = data['labels'].tolist() if 'labels' in data else None
+            label_mode = str(data['label_mode']) if 'label_mode' in data else None
+            scaler_mean = data['scaler_mean'] if 'scaler_mean' in data else None
+            scaler_scale = data['scaler_scale'] if 'scaler_scale' in data else None
+            pooling = str(data['pooling']) if 'pooling' in data else None
+
+        return cls(weights, biases, labels=labels, label_mode=label_mode,
+                   scaler_mean=scaler_mean, scaler_scale=scaler_scale,
+                   pooling=pooling)
+
+    def save(self, path):
+        """
+        Save the model to a compressed .npz file.
+
+        Parameters
+        ----------
+        path
+
+        Returns
+        -------
+
+        """
+        arrays = {'num_layers': len(self.weights)}
+        for idx, (weights, bias) in enumerate(zip(self.weights, self.biases)):
+            arrays['weights_{}'.format(idx)] = weights
+            arrays['bias_{}'.format(idx)] = bias
+        if self.labels is not None:
+            arrays['labels'] = np.array(self.labels)
+        if self.label_mode is not None:
+            arrays['label_mode'] = self.label_mode
+        if self.scaler_mean is not None:
+            arrays['scaler_mean'] = self.scaler_mean
+            arrays['scaler_scale'] = self.scaler_scale
+        if self.pooling is not None:
+            arrays['pooling'] = self.pooling
+
+        np.savez_compressed(path, **arrays)
+
+    def predict(self, X, batch_size=4096):
+        """
+        Compute framewise predictions.
+
+        Parameters
+        ----------
+        X
+        batch_size
+
+        Returns
+        -------
+        y_pred
+
+        """
+        batch_size = max(batch_size or len(X), 1)
+
+        y_pred = []
+        for start_idx in range(0, len(X), batch_size):
+            y = np.asarray(X[start_idx:start_idx+batch_size], dtype=np.float32)
+            for weights, bias in zip(self.weights[:-1], self.biases[:-1]):
+                y = np.maximum(y.dot(weights) + bias, 0)
+            z = y.dot(self.weights[-1]) + self.biases[-1]
+            # Sigmoid, written to avoid overflow for large negative logits
+            y_pred.append(np.exp(-np.logaddexp(0, -z)))
+
+        if not y_pred:
+            return np.zeros((0, self.output_shape[1]), dtype=np.float32)
+
+        return np.concatenate(y_pred, axis=0)
+
+    def predict_files(self, embeddings, file_idxs=None, batch_size=4096):
+        """
+        Compute file-level predictions with max, mean and softmax pooling
+        over the frames of each file. For models trained on pooled file
+        embeddings, all three are the prediction for the pooled embedding.
+
+        Parameters
+        ----------
+        embeddings
+        file_idxs
+        batch_size
+
+        Returns
+        -------
+        results
+
+        """
+        if file_idxs is None:
+            file_idxs = np.arange(len(embeddings))
+
+        if self.pooling is not None:
+            X = pool_embeddings(embeddings, file_idxs, self.pooling)
+            offsets = np.arange(len(X) + 1)
+        else:
+            X, offsets = pack_embeddings(embeddings, file_idxs)
+        pred_frames = self.predict(X, batch_size=batch_size)
+
+        return aggregate_frame_predictions(pred_frames, offsets)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="""
+        Score embedding files with a classifier exported by `classify.py`.
+        """)
+    parser.add_argument("model_path", type=str)
+    parser.add_argument("emb_paths", type=str, nargs='+')
+    parser.add_argument("--aggregation_type", type=str,
+                        choices=["max", "mean", "softmax"], default='mean')
+
+    args = parser.parse_args()
+
+    model = MLPPredictor.load(args.model_path)
+
+    embeddings = []
+    for emb_path in args.emb_paths:
+        with gzip.open(emb_path, 'rb') as f:
+            embeddings.append(np.load(f))
+
+    y_pred = model.predict_files(embeddings)[args.aggregation_type]
+
+    print(",".join(["filename"] + model.labels))
+    for emb_path, y in zip(args.emb_paths, y_pred):
+        print(",".join([os.path.basename(emb_path)] + ["{:.6f}".format(v) for v in y]))
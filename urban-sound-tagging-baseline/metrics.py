@@ -1,9 +1,10 @@
 import numpy as np
-import oyaml as yaml
 import pandas as pd
 from sklearn.metrics import auc, confusion_matrix
 import warnings
 
+from taxonomy import compile_taxonomy
+
 
 def confusion_matrix_fine(
         Y_true, Y_pred, is_true_incomplete, is_pred_incomplete):
@@ -228,22 +229,853 @@ def confusion_matrix_coarse(y_true, y_pred):
     return TP, FP, FN
 
 
-def evaluate(prediction_path, annotation_path, yaml_path, mode):
-    # Set minimum threshold.
-    min_threshold = 0.01
+def count_above(scores, thresholds, weights=None):
+    """
+    Counts the number of scores greater than or equal to each threshold,
+    by sorting the scores once.
+
+
+    Parameters
+    ----------
+    scores: array of float
+        Scores, of any shape.
+
+    thresholds: array of float, shape = [n_thresholds,]
+        Thresholds, in any order.
+
+    weights: array, same shape as `scores`, optional
+        Weight of each score, e.g. the number of times its sample is drawn
+        in a bootstrap replicate. Defaults to 1.
+
+
+    Returns
+    -------
+    counts: array, shape = [n_thresholds,]
+        Number (or total weight) of scores greater than or equal to each
+        threshold.
+    """
+    scores = np.ravel(scores)
+    if weights is None:
+        scores = np.sort(scores)
+        return len(scores) - np.searchsorted(scores, thresholds, side='left')
+
+    order = np.argsort(scores, kind='mergesort')
+    cum_weights = np.concatenate([[0], np.cumsum(np.ravel(weights)[order])])
+    positions = np.searchsorted(scores[order], thresholds, side='left')
+    return cum_weights[-1] - cum_weights[positions]
+
+
+def count_between(lower, upper, thresholds, weights=None):
+    """
+    Counts the number of intervals (lower, upper] containing each threshold.
+
+
+    Parameters
+    ----------
+    lower: array of float, shape = [n_samples,]
+        Exclusive lower bounds of the intervals.
+
+    upper: array of float, shape = [n_samples,]
+        Inclusive upper bounds of the intervals.
+
+    thresholds: array of float, shape = [n_thresholds,]
+        Thresholds, in any order.
+
+    weights: array, shape = [n_samples,], optional
+        Weight of each interval. Defaults to 1.
+
+
+    Returns
+    -------
+    counts: array, shape = [n_thresholds,]
+        Number (or total weight) of intervals containing each threshold.
+    """
+    # An interval with lower >= upper is empty, and contributes as much to
+    # both counts.
+    return count_above(upper, thresholds, weights) \
+        - count_above(np.minimum(lower, upper), thresholds, weights)
+
+
+def threshold_counts_fine(
+        Y_true, Y_score, is_true_incomplete, y_score_incomplete, thresholds,
+        sample_weight=None):
+    """
+    Counts overall numbers of true positives (TP), false positives (FP),
+    and false negatives (FN) at each threshold, for a number K of fine-level
+    classes within a given coarse category, with the same rules as
+    `confusion_matrix_fine`.
+
+    Rather than thresholding the scores at each threshold, each count of
+    `confusion_matrix_fine` is expressed in terms of the scores of a sample:
+    e.g. the sample with incomplete ground truth is a true positive if the
+    threshold is above the highest score of its true complete tags and at
+    most its coarsened score, i.e. the highest score of all of its tags.
+    The counts at all thresholds are then obtained by sorting these scores.
+
+
+    Parameters
+    ----------
+    Y_true: array of bool, shape = [n_samples, n_classes]
+        One-hot encoding of true presence for complete fine tags.
+
+    Y_score: array of float, shape = [n_samples, n_classes]
+        Predicted scores for complete fine tags.
+
+    is_true_incomplete: array of bool, shape = [n_samples]
+        One-hot encoding of true presence for the incomplete fine tag.
+
+    y_score_incomplete: array of float, shape = [n_samples]
+        Predicted scores for the incomplete fine tag.
+
+    thresholds: array of float, shape = [n_thresholds,]
+        Thresholds at which a score is predicted as present if it is
+        greater than or equal to the threshold.
+
+    sample_weight: array, shape = [n_samples], optional
+        Weight of each sample. Defaults to 1.
+
+
+    Returns
+    -------
+    TPs: array of int, shape = [n_thresholds,]
+        Number of true positives at each threshold.
+
+    FPs: array of int, shape = [n_thresholds,]
+        Number of false positives at each threshold.
+
+    FNs: array of int, shape = [n_thresholds,]
+        Number of false negatives at each threshold.
+    """
+    Y_true = np.asarray(Y_true).astype(bool)
+    Y_score = np.asarray(Y_score, dtype=np.float64)
+    is_true_incomplete = np.asarray(is_true_incomplete).astype(bool)
+    y_score_incomplete = np.asarray(y_score_incomplete, dtype=np.float64)
+    n_classes = Y_score.shape[1]
+
+    if sample_weight is None:
+        sample_weight = np.ones(len(Y_score), dtype=int)
+        weigh = lambda mask: None
+    else:
+        sample_weight = np.asarray(sample_weight)
+        weigh = lambda mask: np.broadcast_to(
+            sample_weight.reshape((-1,) + (1,) * (mask.ndim - 1)),
+            mask.shape)[mask]
+
+    ## PART I. COMPLETE TAGS
+    # Tags of samples with complete ground truth are false positives if
+    # predicted without being true, and true tags are true positives if
+    # predicted and false negatives otherwise.
+    TP_complete = count_above(Y_score[Y_true], thresholds, weigh(Y_true))
+    is_false_complete = ~Y_true & ~is_true_incomplete[:, np.newaxis]
+    FP_complete = count_above(Y_score[is_false_complete], thresholds,
+                              weigh(is_false_complete))
+    FN_complete = np.sum(sample_weight[:, np.newaxis] * Y_true) - TP_complete
+
+    ## PART II. INCOMPLETE TAGS
+    # The coarsened prediction of a sample is positive if the threshold is
+    # at most the highest score of all of its tags.
+    if n_classes > 0:
+        y_score_coarsened = np.maximum(np.max(Y_score, axis=1),
+                                       y_score_incomplete)
+    else:
+        y_score_coarsened = y_score_incomplete
+    has_true_complete = np.any(Y_true, axis=1)
+
+    # Samples with incomplete ground truth are true positives if the
+    # coarsened prediction is positive and none of their true complete tags
+    # is predicted, i.e. if the threshold is above the highest score of
+    # their true complete tags.
+    y_score_true_max = np.max(
+        np.where(Y_true, Y_score, -np.inf), axis=1, initial=-np.inf)
+    TP_incomplete = count_between(y_score_true_max[is_true_incomplete],
+                                  y_score_coarsened[is_true_incomplete],
+                                  thresholds, weigh(is_true_incomplete))
+
+    # Samples without any true tag are false positives if the incomplete tag
+    # is predicted and not all complete tags are, i.e. if the threshold is
+    # above the lowest score of their complete tags.
+    if n_classes > 0:
+        is_false = ~is_true_incomplete & ~has_true_complete
+        FP_incomplete = count_between(np.min(Y_score[is_false], axis=1),
+                                      y_score_incomplete[is_false], thresholds,
+                                      weigh(is_false))
+    else:
+        FP_incomplete = np.zeros(len(thresholds), dtype=int)
+
+    # Samples with only the incomplete tag are false negatives if the
+    # coarsened prediction is negative.
+    is_only_incomplete = is_true_incomplete & ~has_true_complete
+    FN_incomplete = np.sum(sample_weight[is_only_incomplete]) \
+        - count_above(y_score_coarsened[is_only_incomplete], thresholds,
+                      weigh(is_only_incomplete))
+
+    ## PART III. AGGREGATE EVALUATION OF ALL SAMPLES
+    TPs = TP_complete + TP_incomplete
+    FPs = FP_complete + FP_incomplete
+    FNs = FN_complete + FN_incomplete
+    return TPs, FPs, FNs
+
+
+def threshold_counts_coarse(y_true, y_score, thresholds, sample_weight=None):
+    """
+    Counts overall numbers of true positives (TP), false positives (FP),
+    and false negatives (FN) at each threshold, for a single Boolean
+    attribute, with the same rules as `confusion_matrix_coarse`.
+
+
+    Parameters
+    ----------
+    y_true: array of bool, shape = [n_samples,]
+        One-hot encoding of true presence for a given coarse tag.
+
+    y_score: array of float, shape = [n_samples,]
+        Predicted scores for a given coarse tag.
+
+    thresholds: array of float, shape = [n_thresholds,]
+        Thresholds at which a score is predicted as present if it is
+        greater than or equal to the threshold.
+
+    sample_weight: array, shape = [n_samples], optional
+        Weight of each sample. Defaults to 1.
+
+
+    Returns
+    -------
+    TPs: array of int, shape = [n_thresholds,]
+        Number of true positives at each threshold.
+
+    FPs: array of int, shape = [n_thresholds,]
+        Number of false positives at each threshold.
+
+    FNs: array of int, shape = [n_thresholds,]
+        Number of false negatives at each threshold.
+    """
+    y_true = np.ravel(y_true).astype(bool)
+    y_score = np.ravel(y_score).astype(np.float64)
+
+    if sample_weight is None:
+        TPs = count_above(y_score[y_true], thresholds)
+        FPs = count_above(y_score[~y_true], thresholds)
+        FNs = np.sum(y_true) - TPs
+    else:
+        sample_weight = np.ravel(sample_weight)
+        TPs = count_above(y_score[y_true], thresholds, sample_weight[y_true])
+        FPs = count_above(y_score[~y_true], thresholds, sample_weight[~y_true])
+        FNs = np.sum(sample_weight[y_true]) - TPs
+    return TPs, FPs, FNs
+
+
+def _threshold_counts_fine_loop(
+        Y_true, Y_score, is_true_incomplete, y_score_incomplete, thresholds):
+    """
+    Reference implementation of `threshold_counts_fine`, which calls
+    `confusion_matrix_fine` at each threshold.
+    """
+    n_thresholds = len(thresholds)
+    TPs = np.zeros((n_thresholds,)).astype('int')
+    FPs = np.zeros((n_thresholds,)).astype('int')
+    FNs = np.zeros((n_thresholds,)).astype('int')
+
+    # Loop over thresholds in a decreasing order.
+    for i, threshold in enumerate(thresholds):
+        # Threshold prediction for complete tag.
+        Y_pred = Y_score >= threshold
+
+        # Threshold prediction for incomplete tag.
+        is_pred_incomplete = y_score_incomplete >= threshold
+
+        # Evaluate.
+        TPs[i], FPs[i], FNs[i] = confusion_matrix_fine(
+            Y_true, Y_pred, is_true_incomplete, is_pred_incomplete)
+
+    return TPs, FPs, FNs
+
+
+def _threshold_counts_coarse_loop(y_true, y_score, thresholds):
+    """
+    Reference implementation of `threshold_counts_coarse`, which calls
+    `confusion_matrix_coarse` at each threshold.
+    """
+    n_thresholds = len(thresholds)
+    TPs = np.zeros((n_thresholds,)).astype('int')
+    FPs = np.zeros((n_thresholds,)).astype('int')
+    FNs = np.zeros((n_thresholds,)).astype('int')
+
+    # Loop over thresholds in a decreasing order.
+    for i, threshold in enumerate(thresholds):
+        # Threshold prediction.
+        y_pred = y_score >= threshold
+
+        # Evaluate.
+        TPs[i], FPs[i], FNs[i] = confusion_matrix_coarse(y_true, y_pred)
+
+    return TPs, FPs, FNs
+
+
+def get_bin_edges(n_bins, min_threshold=0.01):
+    """
+    List the thresholds of a fixed grid for binned evaluation.
+
+
+    Parameters
+    ----------
+    n_bins: int
+        Number of bins of the regular grid over [0, 1].
+
+    min_threshold: float
+        Lowest threshold.
+
+
+    Returns
+    -------
+    edges: array of float, shape = [n_edges,]
+        Thresholds of the regular grid above `min_threshold`, and
+        `min_threshold` itself, in increasing order. The last one is 1.
+    """
+    edges = np.linspace(0, 1, n_bins + 1)
+    return np.unique(np.append(edges[edges >= min_threshold], min_threshold))
+
+
+def bin_scores(scores, edges, weights=None):
+    """
+    Counts the scores falling between each pair of consecutive thresholds.
+
+
+    Parameters
+    ----------
+    scores: array of float
+        Scores, of any shape.
+
+    edges: array of float, shape = [n_edges,]
+        Thresholds, in increasing order.
+
+    weights: array, same shape as `scores`, optional
+        Weight of each score. Defaults to 1.
+
+
+    Returns
+    -------
+    hist: array of float, shape = [n_edges + 1,]
+        Number of scores below the first threshold, then in each interval
+        [edges[i-1], edges[i]), then at or above the last threshold.
+    """
+    bins = np.searchsorted(edges, np.ravel(scores), side='right')
+    if weights is not None:
+        weights = np.ravel(weights)
+    return np.bincount(bins, weights=weights, minlength=len(edges) + 1) \
+        .astype(np.float64)
+
+
+def binned_counts_fine(
+        Y_true, Y_score, is_true_incomplete, y_score_incomplete, edges):
+    """
+    Accumulate the histograms from which `threshold_counts_fine` can be
+    recovered at each threshold of a fixed grid, with `counts_from_bins`.
+
+    Each count of `threshold_counts_fine` is a number of scores above the
+    threshold, a number of intervals of scores containing the threshold,
+    or a number of scores below the threshold. Histograms of these scores
+    over the grid are additive, so that they can be accumulated over
+    batches of samples in constant memory.
+
+
+    Parameters
+    ----------
+    Y_true: array of bool, shape = [n_samples, n_classes]
+        One-hot encoding of true presence for complete fine tags.
+
+    Y_score: array of float, shape = [n_samples, n_classes]
+        Predicted scores for complete fine tags.
+
+    is_true_incomplete: array of bool, shape = [n_samples]
+        One-hot encoding of true presence for the incomplete fine tag.
+
+    y_score_incomplete: array of float, shape = [n_samples]
+        Predicted scores for the incomplete fine tag.
+
+    edges: array of float, shape = [n_edges,]
+        Thresholds of the grid, as returned by `get_bin_edges`.
+
+
+    Returns
+    -------
+    bins: array of float, shape = [5, n_edges + 1]
+        Histograms, as returned by `bin_scores`, of the upper and lower
+        bounds of the intervals counted as true positives, of those
+        counted as false positives, and of the scores counted as false
+        negatives below the threshold.
+    """
+    Y_true = np.asarray(Y_true).astype(bool)
+    Y_score = np.asarray(Y_score, dtype=np.float64)
+    is_true_incomplete = np.asarray(is_true_incomplete).astype(bool)
+    y_score_incomplete = np.asarray(y_score_incomplete, dtype=np.float64)
+    n_classes = Y_score.shape[1]
+
+    # Same decomposition as in `threshold_counts_fine`, where the scores of
+    # complete tags are intervals without a lower bound.
+    if n_classes > 0:
+        y_score_coarsened = np.maximum(np.max(Y_score, axis=1),
+                                       y_score_incomplete)
+    else:
+        y_score_coarsened = y_score_incomplete
+    has_true_complete = np.any(Y_true, axis=1)
+    y_score_true_max = np.max(
+        np.where(Y_true, Y_score, -np.inf), axis=1, initial=-np.inf)
+    is_false_complete = ~Y_true & ~is_true_incomplete[:, np.newaxis]
+    is_only_incomplete = is_true_incomplete & ~has_true_complete
+
+    TP_upper = bin_scores(Y_score[Y_true], edges) \
+        + bin_scores(y_score_coarsened[is_true_incomplete], edges)
+    TP_lower = bin_scores(np.minimum(y_score_true_max[is_true_incomplete],
+                                     y_score_coarsened[is_true_incomplete]),
+                          edges)
+
+    FP_upper = bin_scores(Y_score[is_false_complete], edges)
+    FP_lower = np.zeros(len(edges) + 1)
+    if n_classes > 0:
+        is_false = ~is_true_incomplete & ~has_true_complete
+        FP_upper += bin_scores(y_score_incomplete[is_false], edges)
+        FP_lower += bin_scores(np.minimum(np.min(Y_score[is_false], axis=1),
+                                          y_score_incomplete[is_false]),
+                               edges)
+
+    FN_scores = bin_scores(Y_score[Y_true], edges) \
+        + bin_scores(y_score_coarsened[is_only_incomplete], edges)
+
+    return np.stack([TP_upper, TP_lower, FP_upper, FP_lower, FN_scores])
+
+
+def binned_counts_coarse(y_true, y_score, edges):
+    """
+    Accumulate the histograms from which `threshold_counts_coarse` can be
+    recovered at each threshold of a fixed grid, with `counts_from_bins`.
+
+
+    Parameters
+    ----------
+    y_true: array of bool, shape = [n_samples,]
+        One-hot encoding of true presence for a given coarse tag.
+
+    y_score: array of float, shape = [n_samples,]
+        Predicted scores for a given coarse tag.
+
+    edges: array of float, shape = [n_edges,]
+        Thresholds of the grid, as returned by `get_bin_edges`.
+
+
+    Returns
+    -------
+    bins: array of float, shape = [5, n_edges + 1]
+        Histograms, as in `binned_counts_fine`.
+    """
+    y_true = np.ravel(y_true).astype(bool)
+    y_score = np.ravel(y_score).astype(np.float64)
 
+    empty = np.zeros(len(edges) + 1)
+    TP_upper = bin_scores(y_score[y_true], edges)
+    FP_upper = bin_scores(y_score[~y_true], edges)
+    return np.stack([TP_upper, empty, FP_upper, empty.copy(), TP_upper.copy()])
+
+
+def counts_from_bins(bins, edges):
+    """
+    Counts the numbers of true positives (TP), false positives (FP), and
+    false negatives (FN) at each threshold of a grid from the histograms of
+    `binned_counts_fine` or `binned_counts_coarse`.
+
+    The counts at the thresholds of the grid are exact. The counts at any
+    threshold between two consecutive thresholds of the grid are bounded
+    from the same histograms.
+
+
+    Parameters
+    ----------
+    bins: array of float, shape = [5, n_edges + 1]
+        Histograms, as returned by `binned_counts_fine` or
+        `binned_counts_coarse`, or sums of them.
+
+    edges: array of float, shape = [n_edges,]
+        Thresholds of the grid.
+
+
+    Returns
+    -------
+    thresholds: array of float, shape = [n_edges,]
+        Thresholds of the grid, in decreasing order.
+
+    counts: dict of array
+        Number of true positives ("TP"), false positives ("FP"), and false
+        negatives ("FN") at each threshold, and their lowest ("TP_min",
+        "FP_min", "FN_min") and highest ("TP_max", "FP_max", "FN_max")
+        values at the thresholds above it and below the next one.
+    """
+    bins = np.asarray(bins, dtype=np.float64)
+
+    # Number of scores at or above each threshold, and below it.
+    above = np.cumsum(bins[:, ::-1], axis=1)[:, ::-1][:, 1:]
+    below = np.cumsum(bins, axis=1)[:, :-1]
+
+    TPs = above[0] - above[1]
+    FPs = above[2] - above[3]
+    FNs = below[4]
+
+    # Between two consecutive thresholds, the upper bounds of the intervals
+    # containing the threshold are at or above the lower threshold, and
+    # their lower bounds are below the higher one.
+    next_above = np.append(above[:, 1:], above[:, -1:], axis=1)
+    next_below = np.append(below[:, 1:], below[:, -1:], axis=1)
+    counts = {
+        "TP": TPs,
+        "FP": FPs,
+        "FN": FNs,
+        "TP_min": np.minimum(next_above[0] - above[1], TPs),
+        "TP_max": np.maximum(above[0] - next_above[1], TPs),
+        "FP_min": np.minimum(next_above[2] - above[3], FPs),
+        "FP_max": np.maximum(above[2] - next_above[3], FPs),
+        "FN_min": FNs,
+        "FN_max": next_below[4],
+    }
+
+    # List thresholds in decreasing order, as in `evaluate_df`.
+    return edges[::-1], {name: values[::-1] for name, values in counts.items()}
+
+
+def auprc_deviation_bound(eval_df):
+    """
+    Bound the deviation of the AUPRC computed from a binned precision-recall
+    curve from the AUPRC computed from all the thresholds.
+
+    Between two consecutive thresholds of the grid, precision and recall
+    are bounded from the bounds of TP, FP, and FN returned by
+    `counts_from_bins`, so the area under the exact curve differs from that
+    under the binned curve by at most the area of the box they define. The
+    bound is rigorous when recall decreases with the threshold, as is the
+    case at the coarse level. At the fine level, the recall of samples with
+    incomplete ground truth may increase with the threshold, and the bound
+    is approximate.
+
+
+    Parameters
+    ----------
+    eval_df: DataFrame
+        Binned evaluation, as returned by `evaluate_df` with
+        `method="binned"`, with thresholds in decreasing order.
+
+
+    Returns
+    -------
+    bound: float
+        Bound of the absolute deviation of the AUPRC.
+    """
+    mu = 0.5
+    TP_min, TP_max = eval_df["TP_min"].values, eval_df["TP_max"].values
+    FP_min, FP_max = eval_df["FP_min"].values, eval_df["FP_max"].values
+    FN_min, FN_max = eval_df["FN_min"].values, eval_df["FN_max"].values
+
+    P_min = TP_min / np.maximum(TP_min + FP_max, mu)
+    P_max = TP_max / np.maximum(TP_max + FP_min, mu)
+    R_min = TP_min / np.maximum(TP_min + FN_max, mu)
+    R_max = TP_max / np.maximum(TP_max + FN_min, mu)
+
+    # The exact curve joins the last point of a bin to the first point of
+    # the next one, so widen the precision range of each bin to its
+    # neighbors.
+    P_min = np.pad(P_min, 1, mode='edge')
+    P_min = np.minimum(np.minimum(P_min[:-2], P_min[1:-1]), P_min[2:])
+    P_max = np.pad(P_max, 1, mode='edge')
+    P_max = np.maximum(np.maximum(P_max[:-2], P_max[1:-1]), P_max[2:])
+
+    return np.sum((R_max - R_min) * (P_max - P_min))
+
+
+def binned_auprc_bounds(df_dict):
+    """
+    Bound the deviation of micro-averaged, macro-averaged, and class-wise
+    AUPRC computed from binned evaluations from their exact values. See
+    `auprc_deviation_bound`.
+
+
+    Parameters
+    ----------
+    df_dict: dict of DataFrame
+        Binned class-wise evaluations, as returned by `evaluate_df` with
+        `method="binned"`.
+
+
+    Returns
+    -------
+    micro_bound: float
+        Bound of the deviation of the micro-averaged AUPRC.
+
+    macro_bound: float
+        Bound of the deviation of the macro-averaged AUPRC.
+
+    class_bounds: dict of float
+        Bound of the deviation of the AUPRC of each coarse category.
+    """
+    class_bounds = {coarse_id: auprc_deviation_bound(eval_df)
+                    for coarse_id, eval_df in df_dict.items()}
+
+    # All categories share the thresholds of the grid, so their counts and
+    # the bounds of their counts add up.
+    eval_dfs = list(df_dict.values())
+    for eval_df in eval_dfs[1:]:
+        if not np.array_equal(eval_df["threshold"].values,
+                              eval_dfs[0]["threshold"].values):
+            raise ValueError("Binned evaluations with different thresholds.")
+    columns = ["TP_min", "TP_max", "FP_min", "FP_max", "FN_min", "FN_max"]
+    micro_df = sum(eval_df[columns] for eval_df in eval_dfs)
+
+    micro_bound = auprc_deviation_bound(micro_df)
+    macro_bound = np.mean(list(class_bounds.values()))
+    return micro_bound, macro_bound, class_bounds
+
+
+def evaluate(prediction_path, annotation_path, yaml_path, mode, **kwargs):
+    """
+    Evaluate a prediction file against the ground truth annotations, for
+    each coarse category. See `evaluate_df`, to which the keyword arguments
+    are passed.
+    """
     # Create dictionary to parse tags
-    with open(yaml_path, 'r') as stream:
-        yaml_dict = yaml.load(stream, Loader=yaml.Loader)
+    yaml_dict = load_taxonomy(yaml_path)
 
     # Parse ground truth.
-    gt_df = parse_ground_truth(annotation_path, yaml_path)
+    gt_df = parse_ground_truth(annotation_path, yaml_dict)
+    audio_filenames = gt_df["audio_filename"].values
 
-    # Parse predictions.
+    # Parse predictions, in the order of the ground truth.
     if mode == "fine":
-        pred_df = parse_fine_prediction(prediction_path, yaml_path)
+        pred_df = parse_fine_prediction(prediction_path, yaml_dict,
+                                        audio_filenames)
     elif mode == "coarse":
-        pred_df = parse_coarse_prediction(prediction_path, yaml_path)
+        pred_df = parse_coarse_prediction(prediction_path, yaml_dict,
+                                          audio_filenames)
+    else:
+        raise ValueError("Invalid mode: {}".format(mode))
+
+    return evaluate_df(pred_df, gt_df, yaml_dict, mode, **kwargs)
+
+
+def evaluate_arrays(y_pred, audio_filenames, labels, gt_df, yaml_dict, mode):
+    """
+    Evaluate predictions held in memory against the ground truth, for each
+    coarse category, without writing them to a file. See `evaluate_df`.
+
+
+    Parameters
+    ----------
+    y_pred: array, shape = [n_samples, n_labels]
+        Predicted probabilities.
+
+    audio_filenames: list of string, length = n_samples
+        Audio filename of each sample.
+
+    labels: list of string, length = n_labels
+        Tag of each column of `y_pred`, as in the columns of a prediction
+        file, e.g. "1-1_small-sounding-engine" or "1_engine". Tags of the
+        taxonomy missing from `labels` are predicted as zero.
+
+    gt_df: DataFrame
+        Ground truth, as returned by `parse_ground_truth`.
+
+    yaml_dict: dict
+        Taxonomy, as returned by `load_taxonomy`.
+
+    mode: string
+        "fine" or "coarse".
+
+
+    Returns
+    -------
+    df_dict: dict of DataFrame
+        See `evaluate_df`.
+    """
+    pred_df = pd.DataFrame(np.asarray(y_pred), columns=list(labels))
+
+    # Add the missing tags, as in a complete prediction file.
+    taxonomy = compile_taxonomy(yaml_dict)
+    for tag in taxonomy.coarse_labels + taxonomy.full_fine_labels:
+        if tag not in pred_df:
+            pred_df[tag] = 0.0
+
+    pred_df["audio_filename"] = list(audio_filenames)
+
+    # Parse predictions, in the order of the ground truth.
+    if mode == "fine":
+        pred_df = parse_fine_prediction(pred_df, yaml_dict,
+                                        gt_df["audio_filename"].values)
+    elif mode == "coarse":
+        pred_df = parse_coarse_prediction(pred_df, yaml_dict,
+                                          gt_df["audio_filename"].values)
+    else:
+        raise ValueError("Invalid mode: {}".format(mode))
+
+    return evaluate_df(pred_df, gt_df, yaml_dict, mode)
+
+
+def get_thresholds(scores, min_threshold=0.01):
+    """
+    List the thresholds of a precision-recall curve from predicted values.
+
+
+    Parameters
+    ----------
+    scores: array of float
+        Predicted values, of any shape.
+
+    min_threshold: float
+        Lowest threshold.
+
+
+    Returns
+    -------
+    thresholds: array of float, shape = [n_thresholds,]
+        Unique predicted values above or equal to `min_threshold`, and 1,
+        in decreasing order.
+    """
+    # Aggregate all prediction values into a "raveled" vector.
+    # We make an explicit numpy, so that the original DataFrame
+    # is left unchanged.
+    thresholds = np.ravel(np.copy(scores))
+
+    # Sort in place.
+    thresholds.sort()
+
+    # Skip very low values.
+    # This is to speed up the computation of the precision-recall curve
+    # in the low-precision regime.
+    thresholds = thresholds[np.searchsorted(thresholds, min_threshold):]
+
+    # Append a 1 to the list of thresholds.
+    # This will cause TP and FP to fall down to zero, but FN will be nonzero.
+    # This is useful for estimating the low-recall regime, and it
+    # facilitates micro-averaged AUPRC because if provides an upper bound
+    # on valid thresholds across coarse categories.
+    thresholds = np.append(thresholds, 1.0)
+
+    # List thresholds by restricting observed confidences to unique elements.
+    return np.unique(thresholds)[::-1]
+
+
+def build_eval_df(thresholds, counts):
+    """
+    Build the DataFrame of a precision-recall curve from the counts at each
+    threshold.
+
+
+    Parameters
+    ----------
+    thresholds: array of float, shape = [n_thresholds,]
+        Thresholds, in decreasing order.
+
+    counts: dict of array
+        Number of true positives ("TP"), false positives ("FP"), and false
+        negatives ("FN") at each threshold, and for binned counts, their
+        bounds (see `counts_from_bins`).
+
+
+    Returns
+    -------
+    eval_df: DataFrame
+        Number of true positives (TP), false positives (FP), and false
+        negatives (FN), precision (P), recall (R), and F1-score (F) at each
+        threshold.
+    """
+    TPs, FPs, FNs = counts["TP"], counts["FP"], counts["FN"]
+
+    # Build DataFrame from columns.
+    eval_df = pd.DataFrame({
+        "threshold": thresholds, "TP": TPs, "FP": FPs, "FN": FNs})
+
+    # Add columns for precision, recall, and F1-score.
+    # NB: we take the maximum between TPs+FPs and mu=0.5 in the
+    # denominator in order to avoid division by zero.
+    # This only ever happens if TP+FP < 1, which
+    # implies TP = 0 (because TP and FP are nonnegative integers),
+    # and therefore a numerator of exactly zero. Therefore, any additive
+    # offset mu would do as long as 0 < mu < 1. Choosing mu = 0.5 is
+    # purely arbitrary and has no effect on the outcome (i.e. zero).
+    mu = 0.5
+    eval_df["P"] = TPs / np.maximum(TPs + FPs, mu)
+
+    # Likewise for recalls, although this numerical safeguard is probably
+    # less necessary given that TP+FN=0 implies that there are zero
+    # positives in the ground truth, which is unlikely but no unheard of.
+    eval_df["R"] = TPs / np.maximum(TPs + FNs, mu)
+
+    # Compute F1-scores.
+    # NB: we use the harmonic mean formula (2/F = 1/P + 1/R) rather than
+    # the more common F = (2*P*R)/(P+R) in order circumvent the edge case
+    # where both P and R are equal to 0 (i.e. TP = 0).
+    eval_df["F"] = 2 / (1/eval_df["P"] + 1/eval_df["R"])
+
+    # Keep the bounds of binned counts.
+    for name in ("TP_min", "TP_max", "FP_min", "FP_max", "FN_min",
+                 "FN_max"):
+        if name in counts:
+            eval_df[name] = counts[name]
+
+    return eval_df
+
+
+def evaluate_df(pred_df, gt_df, yaml_dict, mode, method="sort", n_bins=1000):
+    """
+    Evaluate predictions against the ground truth for each coarse category,
+    with thresholds spanning the range of predicted values.
+
+
+    Parameters
+    ----------
+    pred_df: DataFrame
+        Predictions, as returned by `parse_fine_prediction` or
+        `parse_coarse_prediction`.
+
+    gt_df: DataFrame
+        Ground truth, as returned by `parse_ground_truth`.
+
+    yaml_dict: dict
+        Taxonomy.
+
+    mode: string
+        "fine" or "coarse".
+
+    method: string
+        "sort" to count TP, FP, and FN at all thresholds at once by sorting
+        the predictions, or "loop" to threshold the predictions at each
+        threshold in turn. Both give identical results; "loop" is the
+        slower reference implementation. "binned" to count them only at
+        the thresholds of a regular grid, from histograms of the
+        predictions, which takes linear time and memory independent of
+        the number of unique predicted values. The AUPRC computed from the
+        binned counts is approximate; see `binned_auprc_bounds`.
+
+    n_bins: int
+        Number of bins of the grid of thresholds, if `method` is "binned".
+
+
+    Returns
+    -------
+    df_dict: dict of DataFrame
+        For each coarse ID, a DataFrame with the number of true positives
+        (TP), false positives (FP), and false negatives (FN), the precision
+        (P), recall (R), and F1-score (F) at each threshold, in decreasing
+        order of threshold. Binned evaluations also bound TP, FP, and FN
+        between each threshold and the next higher one (see
+        `counts_from_bins`).
+    """
+    if method == "binned":
+        count_fine, count_coarse = binned_counts_fine, binned_counts_coarse
+    elif method == "sort":
+        count_fine, count_coarse = threshold_counts_fine, threshold_counts_coarse
+    elif method == "loop":
+        count_fine, count_coarse = \
+            _threshold_counts_fine_loop, _threshold_counts_coarse_loop
+    else:
+        raise ValueError("Invalid method: {}".format(method))
+
+    # Set minimum threshold.
+    min_threshold = 0.01
 
     # Check consistency between ground truth and predictions.
     # Make sure the files evaluated in both tables match.
@@ -268,18 +1100,10 @@ def evaluate(prediction_path, annotation_path, yaml_path, mode):
     df_dict = {}
 
     # Loop over coarse categories.
-    for coarse_id in yaml_dict["coarse"]:
+    taxonomy = compile_taxonomy(yaml_dict)
+    for coarse_id in taxonomy.coarse_ids:
         # List columns corresponding to that category
-        if mode == "coarse":
-            columns = [str(coarse_id)]
-        else:
-            columns = [column for column in pred_df.columns
-                if (str(column).startswith(str(coarse_id))) and
-                   ("-" in str(column)) and
-                   (not str(column).endswith("X"))]
-
-        # Sort columns in alphanumeric order.
-        columns.sort()
+        columns = taxonomy.get_category_columns(coarse_id, mode)
 
         # Restrict prediction to columns of interest.
         restricted_pred_df = pred_df[columns]
@@ -287,94 +1111,36 @@ def evaluate(prediction_path, annotation_path, yaml_path, mode):
         # Restrict ground truth to columns of interest.
         restricted_gt_df = gt_df[columns]
 
-        # Aggregate all prediction values into a "raveled" vector.
-        # We make an explicit numpy, so that the original DataFrame
-        # is left unchanged.
-        thresholds = np.ravel(np.copy(restricted_pred_df.values))
-
-        # Sort in place.
-        thresholds.sort()
-
-        # Skip very low values.
-        # This is to speed up the computation of the precision-recall curve
-        # in the low-precision regime.
-        thresholds = thresholds[np.searchsorted(thresholds, min_threshold):]
-
-        # Append a 1 to the list of thresholds.
-        # This will cause TP and FP to fall down to zero, but FN will be nonzero.
-        # This is useful for estimating the low-recall regime, and it
-        # facilitates micro-averaged AUPRC because if provides an upper bound
-        # on valid thresholds across coarse categories.
-        thresholds = np.append(thresholds, 1.0)
-
-        # List thresholds by restricting observed confidences to unique elements.
-        thresholds = np.unique(thresholds)[::-1]
-
-        # Count number of thresholds.
-        n_thresholds = len(thresholds)
-        TPs = np.zeros((n_thresholds,)).astype('int')
-        FPs = np.zeros((n_thresholds,)).astype('int')
-        FNs = np.zeros((n_thresholds,)).astype('int')
+        # List thresholds from the predicted values, or from a fixed grid.
+        if method == "binned":
+            thresholds = get_bin_edges(n_bins, min_threshold)
+        else:
+            thresholds = get_thresholds(restricted_pred_df.values,
+                                        min_threshold)
 
         # FINE MODE.
         if mode == "fine":
             incomplete_tag = str(coarse_id) + "-X"
 
-            # Load ground truth as numpy array.
-            Y_true = restricted_gt_df.values
-            is_true_incomplete = gt_df[incomplete_tag].values
-
-            # Loop over thresholds in a decreasing order.
-            for i, threshold in enumerate(thresholds):
-                # Threshold prediction for complete tag.
-                Y_pred = restricted_pred_df.values >= threshold
-
-                # Threshold prediction for incomplete tag.
-                is_pred_incomplete =\
-                    pred_df[incomplete_tag].values >= threshold
-
-                # Evaluate.
-                TPs[i], FPs[i], FNs[i] = confusion_matrix_fine(
-                    Y_true, Y_pred, is_true_incomplete, is_pred_incomplete)
+            # Count TP, FP, and FN at every threshold.
+            counts = count_fine(
+                restricted_gt_df.values, restricted_pred_df.values,
+                gt_df[incomplete_tag].values, pred_df[incomplete_tag].values,
+                thresholds)
 
         # COARSE MODE.
         elif mode == "coarse":
-            # Load ground truth as numpy array.
-            Y_true = restricted_gt_df.values
-
-            # Loop over thresholds in a decreasing order.
-            for i, threshold in enumerate(thresholds):
-                # Threshold prediction.
-                Y_pred = restricted_pred_df.values >= threshold
-
-                # Evaluate.
-                TPs[i], FPs[i], FNs[i] = confusion_matrix_coarse(Y_true, Y_pred)
-
-        # Build DataFrame from columns.
-        eval_df = pd.DataFrame({
-            "threshold": thresholds, "TP": TPs, "FP": FPs, "FN": FNs})
-
-        # Add columns for precision, recall, and F1-score.
-        # NB: we take the maximum between TPs+FPs and mu=0.5 in the
-        # denominator in order to avoid division by zero.
-        # This only ever happens if TP+FP < 1, which
-        # implies TP = 0 (because TP and FP are nonnegative integers),
-        # and therefore a numerator of exactly zero. Therefore, any additive
-        # offset mu would do as long as 0 < mu < 1. Choosing mu = 0.5 is
-        # purely arbitrary and has no effect on the outcome (i.e. zero).
-        mu = 0.5
-        eval_df["P"] = TPs / np.maximum(TPs + FPs, mu)
-
-        # Likewise for recalls, although this numerical safeguard is probably
-        # less necessary given that TP+FN=0 implies that there are zero
-        # positives in the ground truth, which is unlikely but no unheard of.
-        eval_df["R"] = TPs / np.maximum(TPs + FNs, mu)
-
-        # Compute F1-scores.
-        # NB: we use the harmonic mean formula (2/F = 1/P + 1/R) rather than
-        # the more common F = (2*P*R)/(P+R) in order circumvent the edge case
-        # where both P and R are equal to 0 (i.e. TP = 0).
-        eval_df["F"] = 2 / (1/eval_df["P"] + 1/eval_df["R"])
+            # Count TP, FP, and FN at every threshold.
+            counts = count_coarse(
+                restricted_gt_df.values, restricted_pred_df.values, thresholds)
+
+        # Recover the counts at the thresholds of the grid from the
+        # histograms, with their bounds between thresholds.
+        if method == "binned":
+            thresholds, counts = counts_from_bins(counts, thresholds)
+        else:
+            counts = dict(zip(("TP", "FP", "FN"), counts))
+        eval_df = build_eval_df(thresholds, counts)
 
         # Store DataFrame in the dictionary.
         df_dict[coarse_id] = eval_df
@@ -383,10 +1149,68 @@ def evaluate(prediction_path, annotation_path, yaml_path, mode):
     return df_dict
 
 
-def micro_averaged_auprc(df_dict, return_df=False):
+def micro_averaged_counts(df_dict):
     """
-    Compute micro-averaged area under the precision-recall curve (AUPRC)
-    from a dictionary of class-wise DataFrames obtained via `evaluate`.
+    Sum the numbers of true positives (TP), false positives (FP), and false
+    negatives (FN) across coarse categories, at every threshold of any
+    category. The counts of a category at a given threshold are those of
+    its lowest threshold above or equal to it.
+
+
+    Parameters
+    ----------
+    df_dict: dict of DataFrame
+        Class-wise DataFrames obtained via `evaluate`, with unique
+        thresholds in decreasing order.
+
+
+    Returns
+    -------
+    thresholds: array of float, shape = [n_thresholds,]
+        Unique thresholds across coarse categories, in increasing order.
+
+    TPs: array of int, shape = [n_thresholds,]
+        Number of true positives at each threshold.
+
+    FPs: array of int, shape = [n_thresholds,]
+        Number of false positives at each threshold.
+
+    FNs: array of int, shape = [n_thresholds,]
+        Number of false negatives at each threshold.
+    """
+    # List all unique values of thresholds across coarse categories.
+    thresholds = np.unique(
+        np.hstack([x["threshold"] for x in df_dict.values()]))
+
+    # Initialize arrays for TP, FP, and FN
+    TPs = np.zeros((len(thresholds),)).astype('int')
+    FPs = np.zeros((len(thresholds),)).astype('int')
+    FNs = np.zeros((len(thresholds),)).astype('int')
+
+    # Loop over coarse categories.
+    for coarse_df in df_dict.values():
+        # Locate the lowest threshold of the category above or equal to each
+        # threshold. The thresholds of a category are unique and listed in
+        # decreasing order, so search them in reverse.
+        coarse_thresholds = coarse_df["threshold"].values[::-1]
+        positions = np.searchsorted(coarse_thresholds, thresholds, side='left')
+        if np.any(positions == len(coarse_thresholds)):
+            raise ValueError("Thresholds above all the thresholds of a "
+                             "coarse category.")
+        rows = len(coarse_thresholds) - 1 - positions
+
+        # Increment TP, FP, and FN.
+        TPs += coarse_df["TP"].values[rows].astype('int')
+        FPs += coarse_df["FP"].values[rows].astype('int')
+        FNs += coarse_df["FN"].values[rows].astype('int')
+
+    return thresholds, TPs, FPs, FNs
+
+
+def _micro_averaged_counts_loop(df_dict):
+    """
+    Reference implementation of `micro_averaged_counts`, which looks up
+    the operating point of each category at each threshold in turn.
     """
     # List all unique values of thresholds across coarse categories.
     thresholds = np.unique(
@@ -424,6 +1248,24 @@ def micro_averaged_auprc(df_dict, return_df=False):
         FPs[i] = global_FP
         FNs[i] = global_FN
 
+    return thresholds, TPs, FPs, FNs
+
+
+def micro_averaged_auprc(df_dict, return_df=False, method="sort"):
+    """
+    Compute micro-averaged area under the precision-recall curve (AUPRC)
+    from a dictionary of class-wise DataFrames obtained via `evaluate`.
+
+    The counts are summed across categories with `micro_averaged_counts`,
+    or with its slower reference implementation if `method` is "loop".
+    """
+    if method == "sort":
+        thresholds, TPs, FPs, FNs = micro_averaged_counts(df_dict)
+    elif method == "loop":
+        thresholds, TPs, FPs, FNs = _micro_averaged_counts_loop(df_dict)
+    else:
+        raise ValueError("Invalid method: {}".format(method))
+
     # Build DataFrame from columns.
     eval_df = pd.DataFrame({
         "threshold": thresholds, "TP": TPs, "FP": FPs, "FN": FNs})
@@ -466,6 +1308,107 @@ def micro_averaged_auprc(df_dict, return_df=False):
 
 
 
+def fast_micro_averaged_auprc(Y_true, Y_pred, coarse_idxs=None,
+                              is_true_incomplete=None, min_threshold=0.01):
+    """
+    Compute micro-averaged area under the precision-recall curve (AUPRC)
+    directly from arrays of file-level ground truth and predictions.
+
+    Instead of thresholding the predictions at every threshold, the counts
+    of TP, FP, and FN at all thresholds are obtained by sorting the
+    predictions once. For predictions whose incomplete fine tags are all
+    zero, as is the case for the baseline model, the result is the same as
+    that of `micro_averaged_auprc(evaluate(...))` on the same predictions
+    written to a CSV file, up to the rounding of the written values.
+
+
+    Parameters
+    ----------
+    Y_true: array of bool, shape = [n_samples, n_classes]
+        Presence of each complete fine tag (fine level) or of each coarse
+        tag (coarse level).
+
+    Y_pred: array of float, shape = [n_samples, n_classes]
+        Predicted probability of each tag.
+
+    coarse_idxs: array of int, shape = [n_classes], optional
+        Index of the coarse category of each fine tag. If None, tags are
+        evaluated at the coarse level.
+
+    is_true_incomplete: array of bool, shape = [n_samples, n_coarse], optional
+        Presence of the incomplete fine tag of each coarse category.
+
+    min_threshold: float
+        Lowest threshold of the precision-recall curve.
+
+
+    Returns
+    -------
+    auprc: float
+        Micro-averaged AUPRC.
+    """
+    Y_true = np.asarray(Y_true).astype(bool)
+    Y_pred = np.asarray(Y_pred, dtype=np.float64)
+
+    # Thresholds of the precision-recall curve, in ascending order.
+    thresholds = np.ravel(Y_pred)
+    thresholds = np.unique(np.append(thresholds[thresholds >= min_threshold], 1.0))
+
+    if coarse_idxs is None:
+        TPs, FPs, FNs = threshold_counts_coarse(Y_true, Y_pred, thresholds)
+    else:
+        # Sum the counts of each coarse category, whose incomplete tag is
+        # predicted as absent.
+        coarse_idxs = np.asarray(coarse_idxs)
+        is_true_incomplete = np.asarray(is_true_incomplete).astype(bool)
+        TPs, FPs, FNs = 0, 0, 0
+        for coarse_idx in range(is_true_incomplete.shape[1]):
+            columns = coarse_idxs == coarse_idx
+            if not np.any(columns):
+                continue
+            counts = threshold_counts_fine(
+                Y_true[:, columns], Y_pred[:, columns],
+                is_true_incomplete[:, coarse_idx], np.zeros(len(Y_pred)),
+                thresholds)
+            TPs, FPs, FNs = TPs + counts[0], FPs + counts[1], FNs + counts[2]
+
+    return auprc_from_counts(TPs, FPs, FNs)
+
+
+def auprc_from_counts(TPs, FPs, FNs):
+    """
+    Compute the area under the precision-recall curve (AUPRC) from the
+    counts at each threshold, as in `micro_averaged_auprc` and
+    `macro_averaged_auprc`.
+
+
+    Parameters
+    ----------
+    TPs: array, shape = [n_thresholds,]
+        Number of true positives at each threshold.
+
+    FPs: array, shape = [n_thresholds,]
+        Number of false positives at each threshold.
+
+    FNs: array, shape = [n_thresholds,]
+        Number of false negatives at each threshold.
+
+
+    Returns
+    -------
+    auprc: float
+        AUPRC.
+    """
+    mu = 0.5
+    precisions = TPs / np.maximum(TPs + FPs, mu)
+    recalls = TPs / np.maximum(TPs + FNs, mu)
+
+    sorting_indices = np.argsort(recalls)
+    recalls = np.concatenate([[0.0], recalls[sorting_indices], [1.0]])
+    precisions = np.concatenate([[1.0], precisions[sorting_indices], [0.0]])
+    return auc(recalls, precisions)
+
+
 def macro_averaged_auprc(df_dict, return_classwise=False):
     """
     Compute macro-averaged area under the precision-recall curve (AUPRC)
@@ -499,7 +1442,136 @@ def macro_averaged_auprc(df_dict, return_classwise=False):
         return mean_auprc
 
 
-def parse_coarse_prediction(pred_csv_path, yaml_path):
+def load_taxonomy(yaml_path):
+    """
+    Load the taxonomy from a YAML file. An already loaded taxonomy is
+    returned as is.
+
+
+    Parameters
+    ----------
+    yaml_path: string, dict, or Taxonomy
+        Path to the YAML file containing the taxonomy, the taxonomy, or the
+        taxonomy compiled by `taxonomy.compile_taxonomy`.
+
+
+    Returns
+    -------
+    yaml_dict: dict
+        Taxonomy.
+    """
+    if isinstance(yaml_path, dict):
+        return yaml_path
+
+    return compile_taxonomy(yaml_path).yaml_dict
+
+
+def read_prediction_table(pred_path, tags):
+    """
+    Read the predictions of the given tags from a prediction file or table.
+    Only the needed columns are read, with explicit types.
+
+    Predictions are read from CSV files as float64, like the thresholds of
+    `evaluate_df`: reading them as float32 would round the values written
+    by other systems, and change the metrics. The predictions of .npz and
+    .parquet files are used with the precision they were stored with.
+
+
+    Parameters
+    ----------
+    pred_path: string or DataFrame
+        Path to a CSV file (with the layout of the output files of
+        `classify.py`), to a .npz file (with `audio_filename`, `fields`, and
+        `predictions` arrays, as written by `classify.py` with
+        `--output_sidecar npz`) or to a .parquet file containing
+        predictions, or its contents.
+
+    tags: list of string
+        Tags to read.
+
+
+    Returns
+    -------
+    audio_filenames: array of string, shape = [n_samples,]
+        Audio filename of each sample.
+
+    Y_pred: array of float, shape = [n_samples, n_tags]
+        Predicted probability of each tag, or zero if the tag is missing.
+
+    is_found: array of bool, shape = [n_tags,]
+        Whether each tag was found.
+    """
+    if isinstance(pred_path, pd.DataFrame):
+        columns = pred_path.columns
+    elif str(pred_path).endswith(".npz"):
+        with np.load(pred_path) as data:
+            audio_filenames = data["audio_filename"]
+            field_idxs = {field: idx
+                          for idx, field in enumerate(data["fields"].tolist())}
+            is_found = np.array([tag in field_idxs for tag in tags], dtype=bool)
+            predictions = data["predictions"]
+            Y_pred = np.zeros((len(audio_filenames), len(tags)),
+                              dtype=predictions.dtype)
+            Y_pred[:, is_found] = predictions[
+                :, [field_idxs[tag] for tag in tags if tag in field_idxs]]
+        return audio_filenames, Y_pred, is_found
+    elif str(pred_path).endswith(".parquet"):
+        pred_path = pd.read_parquet(pred_path)
+        columns = pred_path.columns
+    else:
+        columns = pd.read_csv(pred_path, nrows=0).columns
+
+    is_found = np.array([tag in columns for tag in tags], dtype=bool)
+    found_tags = [tag for tag in tags if tag in columns]
+
+    if isinstance(pred_path, pd.DataFrame):
+        pred_df = pred_path
+    else:
+        pred_df = pd.read_csv(
+            pred_path, usecols=["audio_filename"] + found_tags,
+            dtype=dict({tag: np.float64 for tag in found_tags},
+                       audio_filename=str))
+
+    Y_pred = np.zeros((len(pred_df), len(tags)),
+                      dtype=np.result_type(np.float32,
+                                           *pred_df[found_tags].dtypes))
+    Y_pred[:, is_found] = pred_df[found_tags].values
+    return pred_df["audio_filename"].values, Y_pred, is_found
+
+
+def get_row_order(audio_filenames, target_filenames=None):
+    """
+    Find the order of the rows of a table that aligns it with another one.
+
+
+    Parameters
+    ----------
+    audio_filenames: array of string, shape = [n_samples,]
+        Audio filename of each row.
+
+    target_filenames: array of string, shape = [n_samples,], optional
+        Audio filenames of the rows of the other table, e.g. of the ground
+        truth as returned by `parse_ground_truth`.
+
+
+    Returns
+    -------
+    row_idxs: array of int, shape = [n_samples,]
+        Rows in the order of `target_filenames`, if both tables contain the
+        same unique files, or otherwise in increasing order of filename.
+    """
+    if target_filenames is not None \
+            and len(target_filenames) == len(audio_filenames):
+        index = pd.Index(audio_filenames)
+        if index.is_unique:
+            row_idxs = index.get_indexer(target_filenames)
+            if np.all(row_idxs >= 0):
+                return row_idxs
+
+    return np.argsort(np.asarray(audio_filenames, dtype=str), kind="mergesort")
+
+
+def parse_coarse_prediction(pred_csv_path, yaml_path, audio_filenames=None):
     """
     Parse coarse-level predictions from a CSV file containing both fine-level
     and coarse-level predictions (and possibly additional metadata).
@@ -509,11 +1581,17 @@ def parse_coarse_prediction(pred_csv_path, yaml_path):
 
     Parameters
     ----------
-    pred_csv_path: string
-        Path to the CSV file containing predictions.
+    pred_csv_path: string or DataFrame
+        Path to the CSV, .npz, or .parquet file containing predictions, or
+        its contents. See `read_prediction_table`.
+
+    yaml_path: string, dict, or Taxonomy
+        Path to the YAML file containing coarse taxonomy, the taxonomy, or
+        the compiled taxonomy.
 
-    yaml_path: string
-        Path to the YAML file containing coarse taxonomy.
+    audio_filenames: array of string, optional
+        Order of the files, e.g. that of the ground truth. Defaults to the
+        alphanumeric order.
 
 
     Returns
@@ -522,39 +1600,29 @@ def parse_coarse_prediction(pred_csv_path, yaml_path):
         Coarse-level complete predictions.
     """
 
-    # Create dictionary to parse tags
-    with open(yaml_path, 'r') as stream:
-        yaml_dict = yaml.load(stream, Loader=yaml.Loader)
-
-    # Collect tag names as strings and map them to coarse ID pairs.
-    rev_coarse_dict = {"_".join([str(k), yaml_dict["coarse"][k]]): k
-        for k in yaml_dict["coarse"]}
-
-    # Read comma-separated values with the Pandas library
-    pred_df = pd.read_csv(pred_csv_path)
-
-    # Assign a predicted column to each coarse key, by using the tag as an
-    # intermediate hashing step.
-    pred_coarse_dict = {}
-    for c in rev_coarse_dict:
-        if c in pred_df:
-            pred_coarse_dict[str(rev_coarse_dict[c])] = pred_df[c]
-        else:
-            pred_coarse_dict[str(rev_coarse_dict[c])] = np.zeros((len(pred_df),))
-            warnings.warn("Column not found: " + c)
+    # Compile the taxonomy to parse tags
+    taxonomy = compile_taxonomy(yaml_path)
 
-    # Copy over the audio filename strings corresponding to each sample.
-    pred_coarse_dict["audio_filename"] = pred_df["audio_filename"]
+    # Read the predicted columns of each coarse tag.
+    pred_filenames, Y_pred, is_found = read_prediction_table(
+        pred_csv_path, taxonomy.coarse_labels)
+    for tag, found in zip(taxonomy.coarse_labels, is_found):
+        if not found:
+            warnings.warn("Column not found: " + tag)
 
-    # Build a new Pandas DataFrame with coarse keys as column names.
-    pred_coarse_df = pd.DataFrame.from_dict(pred_coarse_dict)
+    # Build a new Pandas DataFrame with coarse keys as column names, with
+    # the files in the requested order.
+    row_idxs = get_row_order(pred_filenames, audio_filenames)
+    pred_coarse_df = pd.DataFrame(Y_pred[row_idxs],
+                                  columns=taxonomy.coarse_keys)
+    pred_coarse_df["audio_filename"] = pred_filenames[row_idxs]
 
     # Return output in DataFrame format.
     # The column names are of the form 1, 2, 3, etc.
-    return pred_coarse_df.sort_values('audio_filename')
+    return pred_coarse_df
 
 
-def parse_fine_prediction(pred_csv_path, yaml_path):
+def parse_fine_prediction(pred_csv_path, yaml_path, audio_filenames=None):
     """
     Parse fine-level predictions from a CSV file containing both fine-level
     and coarse-level predictions (and possibly additional metadata).
@@ -564,11 +1632,17 @@ def parse_fine_prediction(pred_csv_path, yaml_path):
 
     Parameters
     ----------
-    pred_csv_path: string
-        Path to the CSV file containing predictions.
+    pred_csv_path: string or DataFrame
+        Path to the CSV, .npz, or .parquet file containing predictions, or
+        its contents. See `read_prediction_table`.
 
-    yaml_path: string
-        Path to the YAML file containing fine taxonomy.
+    yaml_path: string, dict, or Taxonomy
+        Path to the YAML file containing fine taxonomy, the taxonomy, or
+        the compiled taxonomy.
+
+    audio_filenames: array of string, optional
+        Order of the files, e.g. that of the ground truth. Defaults to the
+        alphanumeric order.
 
 
     Returns
@@ -577,62 +1651,39 @@ def parse_fine_prediction(pred_csv_path, yaml_path):
         Fine-level complete predictions.
     """
 
-    # Create dictionary to parse tags
-    with open(yaml_path, 'r') as stream:
-        yaml_dict = yaml.load(stream, Loader=yaml.Loader)
-
-    # Collect tag names as strings and map them to mixed (coarse-fine) ID pairs.
-    # The "mixed key" is a hyphenation of the coarse ID and fine ID.
-    fine_dict = {}
-    for coarse_id in yaml_dict["fine"]:
-        for fine_id in yaml_dict["fine"][coarse_id]:
-            mixed_key = "-".join([str(coarse_id), str(fine_id)])
-            fine_dict[mixed_key] = "_".join([
-                mixed_key, yaml_dict["fine"][coarse_id][fine_id]])
-
-    # Invert the key-value relationship between mixed key and tag.
-    # Now, tags are the keys, and mixed keys (coarse-fine IDs) are the values.
-    # This is possible because tags are unique.
-    rev_fine_dict = {fine_dict[k]: k for k in fine_dict}
-
-    # Read comma-separated values with the Pandas library
-    pred_df = pd.read_csv(pred_csv_path)
-
-    # Assign a predicted column to each mixed key, by using the tag as an
-    # intermediate hashing step.
-    pred_fine_dict = {}
-    for f in sorted(rev_fine_dict.keys()):
-        if f in pred_df:
-            pred_fine_dict[rev_fine_dict[f]] = pred_df[f]
-        else:
-            pred_fine_dict[rev_fine_dict[f]] = np.zeros((len(pred_df),))
-            warnings.warn("Column not found: " + f)
-
-    # Loop over coarse tags.
-    n_samples = len(pred_df)
-    coarse_dict = yaml_dict["coarse"]
-    for coarse_id in yaml_dict["coarse"]:
-        # Construct incomplete fine tag by appending -X to the coarse tag.
-        incomplete_tag = str(coarse_id) + "-X"
-
-        # If the incomplete tag is not in the prediction, append a column of zeros.
-        # This is the case e.g. for coarse ID 7 ("dogs") which has a single
-        # fine-level tag ("7-1_dog-barking-whining") and thus no incomplete
-        # tag 7-X.
-        if incomplete_tag not in fine_dict.keys():
-            pred_fine_dict[incomplete_tag] =\
-                np.zeros((n_samples,)).astype('int')
-
-
-    # Copy over the audio filename strings corresponding to each sample.
-    pred_fine_dict["audio_filename"] = pred_df["audio_filename"]
-
-    # Build a new Pandas DataFrame with mixed keys as column names.
-    pred_fine_df = pd.DataFrame.from_dict(pred_fine_dict)
+    # Compile the taxonomy to parse tags, in alphanumeric order of tag
+    taxonomy = compile_taxonomy(yaml_path)
+    fine_tags = [taxonomy.full_fine_labels[idx]
+                 for idx in taxonomy.fine_tag_order]
+    mixed_keys = [taxonomy.full_fine_keys[idx]
+                  for idx in taxonomy.fine_tag_order]
+
+    # Read the predicted columns of each fine tag.
+    pred_filenames, Y_pred, is_found = read_prediction_table(
+        pred_csv_path, fine_tags)
+    for tag, found in zip(fine_tags, is_found):
+        if not found:
+            warnings.warn("Column not found: " + tag)
+
+    # Predict the incomplete tag as absent for categories without one.
+    # This is the case e.g. for coarse ID 7 ("dogs") which has a single
+    # fine-level tag ("7-1_dog-barking-whining") and thus no incomplete
+    # tag 7-X.
+    missing_keys = taxonomy.missing_incomplete_keys
+
+    # Build a new Pandas DataFrame with mixed keys as column names, with the
+    # files in the requested order.
+    row_idxs = get_row_order(pred_filenames, audio_filenames)
+    Y_pred = np.concatenate(
+        [Y_pred[row_idxs],
+         np.zeros((len(row_idxs), len(missing_keys)), dtype=Y_pred.dtype)],
+        axis=1)
+    pred_fine_df = pd.DataFrame(Y_pred, columns=mixed_keys + missing_keys)
+    pred_fine_df["audio_filename"] = pred_filenames[row_idxs]
 
     # Return output in DataFrame format.
     # Column names are 1-1, 1-2, 1-3 ... 1-X, 2-1, 2-2, 2-3 ... 2-X, 3-1, etc.
-    return pred_fine_df.sort_values('audio_filename')
+    return pred_fine_df
 
 
 def parse_ground_truth(annotation_path, yaml_path):
@@ -645,62 +1696,71 @@ def parse_ground_truth(annotation_path, yaml_path):
 
     Parameters
     ----------
-    annotation_path: string
-        Path to the CSV file containing predictions.
+    annotation_path: string or DataFrame
+        Path to the CSV file containing annotations, or its contents.
 
-    yaml_path: string
-        Path to the YAML file containing coarse taxonomy.
+    yaml_path: string, dict, or Taxonomy
+        Path to the YAML file containing coarse taxonomy, the taxonomy, or
+        the compiled taxonomy.
 
 
     Returns
     -------
     gt_df: DataFrame
-        Ground truth.
+        Ground truth, with the presence of each coarse and fine tag as int8,
+        in alphanumeric order of filename.
     """
-    # Create dictionary to parse tags
-    with open(yaml_path, 'r') as stream:
-        yaml_dict = yaml.load(stream, Loader=yaml.Loader)
-
-    # Load CSV file into a Pandas DataFrame.
-    ann_df = pd.read_csv(annotation_path)
+    # Compile the taxonomy to parse tags
+    taxonomy = compile_taxonomy(yaml_path)
+
+    # Map the presence column of each tag to its coarse or mixed
+    # (coarse-fine) ID, with fine tags in alphanumeric order.
+    presence_columns = dict(zip(taxonomy.coarse_presence_columns,
+                                taxonomy.coarse_keys))
+    for idx in taxonomy.fine_tag_order:
+        presence_columns[taxonomy.full_fine_presence_columns[idx]] = \
+            taxonomy.full_fine_keys[idx]
+
+    # Load the needed columns of the CSV file into a Pandas DataFrame.
+    if isinstance(annotation_path, pd.DataFrame):
+        ann_df = annotation_path
+        found_columns = [column for column in presence_columns
+                         if column in ann_df.columns]
+    else:
+        header = pd.read_csv(annotation_path, nrows=0).columns
+        found_columns = [column for column in presence_columns
+                         if column in header]
+        ann_df = pd.read_csv(
+            annotation_path,
+            usecols=["audio_filename", "annotator_id", "split"] + found_columns,
+            dtype=dict({column: np.int8 for column in found_columns},
+                       audio_filename=str, split=str))
 
     # Restrict to ground truth ("annotator zero").
-    gt_df = ann_df[
-        (ann_df["annotator_id"]==0) & (ann_df["split"]=="validate")]
-
-    # Rename coarse columns.
-    coarse_dict = yaml_dict["coarse"]
-    coarse_renaming = {
-        "_".join([str(c), coarse_dict[c], "presence"]): str(c)
-        for c in coarse_dict}
-    gt_df = gt_df.rename(columns=coarse_renaming)
-
-    # Collect tag names as strings and map them to mixed (coarse-fine) ID pairs.
-    # The "mixed key" is a hyphenation of the coarse ID and fine ID.
-    fine_dict = {}
-    for coarse_id in yaml_dict["fine"]:
-        for fine_id in yaml_dict["fine"][coarse_id]:
-            mixed_key = "-".join([str(coarse_id), str(fine_id)])
-            fine_dict[mixed_key] = yaml_dict["fine"][coarse_id][fine_id]
-
-    # Rename fine columns.
-    fine_renaming = {"_".join([k, fine_dict[k], "presence"]): k
-        for k in fine_dict}
-    gt_df = gt_df.rename(columns=fine_renaming)
+    is_gt = (ann_df["annotator_id"].values == 0) \
+        & (ann_df["split"].values == "validate")
+    gt_filenames = ann_df["audio_filename"].values[is_gt]
+    row_idxs = np.flatnonzero(is_gt)[get_row_order(gt_filenames)]
+
+    # Build a new Pandas DataFrame with coarse and mixed keys as column
+    # names, in alphanumeric order of filename.
+    gt_df = pd.DataFrame(
+        ann_df[found_columns].values[row_idxs].astype(np.int8),
+        columns=[presence_columns[column] for column in found_columns])
+    gt_df.insert(0, "audio_filename", ann_df["audio_filename"].values[row_idxs])
 
     # Loop over coarse tags.
     n_samples = len(gt_df)
-    coarse_dict = yaml_dict["coarse"]
-    for coarse_id in yaml_dict["coarse"]:
+    for coarse_key in taxonomy.coarse_keys:
         # Construct incomplete fine tag by appending -X to the coarse tag.
-        incomplete_tag = str(coarse_id) + "-X"
+        incomplete_tag = coarse_key + "-X"
 
         # If the incomplete tag is not in the prediction, append a column of zeros.
         # This is the case e.g. for coarse ID 7 ("dogs") which has a single
         # fine-level tag ("7-1_dog-barking-whining") and thus no incomplete
         # tag 7-X.
         if incomplete_tag not in gt_df.columns:
-            gt_df[incomplete_tag] = np.zeros((n_samples,)).astype('int')
+            gt_df[incomplete_tag] = np.zeros((n_samples,), dtype=np.int8)
 
     # Return output in DataFrame format.
-    return gt_df.sort_values('audio_filename')
+    return gt_df
@@ -0,0 +1,276 @@
+import warnings
+import numpy as np
+import oyaml as yaml
+
+from metrics import get_bin_edges, binned_counts_fine, binned_counts_coarse, \
+                    counts_from_bins, build_eval_df, micro_averaged_auprc, \
+                    macro_averaged_auprc, binned_auprc_bounds, load_taxonomy, \
+                    read_prediction_table, get_row_order
+from taxonomy import compile_taxonomy
+
+
+class OnlineEvaluator(object):
+    """
+    Incremental evaluation of predictions as their ground truth becomes
+    available.
+
+    Each batch of files updates histograms of the predictions over a fixed
+    grid of thresholds for each coarse category (see
+    `metrics.binned_counts_fine`), from which the counts of true positives,
+    false positives, and false negatives at each threshold, and the
+    micro-averaged and macro-averaged AUPRC, are available at any time. The
+    state does not grow with the number of predictions, apart from the
+    names of the evaluated files, and can be saved and loaded to resume
+    the evaluation in another process.
+
+    The metrics are the same as those of `metrics.evaluate` with
+    `method="binned"` on all the files seen so far.
+    """
+    def __init__(self, yaml_path, mode, n_bins=1000, min_threshold=0.01):
+        if mode not in ("fine", "coarse"):
+            raise ValueError("Invalid mode: {}".format(mode))
+
+        self.yaml_dict = load_taxonomy(yaml_path)
+        self.taxonomy = compile_taxonomy(self.yaml_dict)
+        self.mode = mode
+        self.n_bins = n_bins
+        self.min_threshold = min_threshold
+        self.edges = get_bin_edges(n_bins, min_threshold)
+        self.coarse_ids = self.taxonomy.coarse_ids
+        self.bins = np.zeros((len(self.coarse_ids), 5, len(self.edges) + 1))
+        self.filenames = set()
+
+    @property
+    def num_files(self):
+        return len(self.filenames)
+
+    @property
+    def labels(self):
+        """
+        Tags of the columns of the ground truth and predictions of a batch:
+        all the fine tags, including the incomplete ones, at the fine level,
+        or the coarse tags at the coarse level.
+        """
+        if self.mode == "fine":
+            return self.taxonomy.full_fine_labels
+        return self.taxonomy.coarse_labels
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load an evaluator saved with `OnlineEvaluator.save`.
+
+        Parameters
+        ----------
+        path
+
+        Returns
+        -------
+        evaluator
+
+        """
+        with np.load(path) as data:
+            yaml_dict = yaml.load(str(data['taxonomy']), Loader=yaml.Loader)
+            evaluator = cls(yaml_dict, str(data['mode']),
+                            n_bins=int(data['n_bins']),
+                            min_threshold=float(data['min_threshold']))
+            evaluator.bins = data['bins']
+            evaluator.filenames = set(data['filenames'].tolist())
+
+        return evaluator
+
+    def save(self, path):
+        """
+        Save the state of the evaluator to a compressed .npz file.
+
+        Parameters
+        ----------
+        path
+
+        Returns
+        -------
+
+        """
+        np.savez_compressed(path,
+                            taxonomy=yaml.dump(self.yaml_dict),
+                            mode=self.mode,
+                            n_bins=self.n_bins,
+                            min_threshold=self.min_threshold,
+                            bins=self.bins,
+                            filenames=np.array(sorted(self.filenames)))
+
+    def update(self, audio_filenames, y_true, y_pred):
+        """
+        Add a batch of files to the evaluation.
+
+        Parameters
+        ----------
+        audio_filenames
+            Filename of each file of the batch.
+        y_true
+            Presence of each tag of `labels` in each file, as an array of
+            shape [n_files, n_labels].
+        y_pred
+            Predicted probability of each tag of `labels` for each file, in
+            the same layout.
+
+        Returns
+        -------
+
+        """
+        filenames = [str(filename) for filename in audio_filenames]
+        y_true = np.asarray(y_true)
+        y_pred = np.asarray(y_pred)
+        shape = (len(filenames), len(self.labels))
+        if y_true.shape != shape or y_pred.shape != shape:
+            raise ValueError("Ground truth and predictions must have shape "
+                             "{}, got {} and {}.".format(shape, y_true.shape,
+                                                         y_pred.shape))
+        if len(set(filenames)) != len(filenames) \
+                or not self.filenames.isdisjoint(filenames):
+            raise ValueError("Files cannot be evaluated more than once.")
+
+        taxonomy = self.taxonomy
+        for idx in range(len(self.coarse_ids)):
+            if self.mode == "fine":
+                bounds = taxonomy.complete_segment_bounds
+                complete_idxs = taxonomy.complete_idxs[bounds[idx]:bounds[idx + 1]]
+                incomplete_idx = taxonomy.coarse_incomplete_idxs[idx]
+                if incomplete_idx >= 0:
+                    is_true_incomplete = y_true[:, incomplete_idx]
+                    y_pred_incomplete = y_pred[:, incomplete_idx]
+                else:
+                    # No incomplete tag, e.g. for coarse ID 7 ("dogs")
+                    is_true_incomplete = np.zeros(len(filenames), dtype=bool)
+                    y_pred_incomplete = np.zeros(len(filenames))
+                self.bins[idx] += binned_counts_fine(
+                    y_true[:, complete_idxs], y_pred[:, complete_idxs],
+                    is_true_incomplete, y_pred_incomplete, self.edges)
+            else:
+                self.bins[idx] += binned_counts_coarse(
+                    y_true[:, [idx]], y_pred[:, [idx]], self.edges)
+
+        self.filenames.update(filenames)
+
+    def update_tables(self, pred_df, gt_df):
+        """
+        Add a batch of files to the evaluation from tables of predictions
+        and ground truth, matched by filename.
+
+        Parameters
+        ----------
+        pred_df
+            Predictions of the files, with the layout of the output files
+            of `classify.py`.
+        gt_df
+            Ground truth of the same files, with an `audio_filename` column
+            and the `<tag>_presence` column of each tag of `labels`, as in
+            the annotation file of the dataset. Every row is used.
+
+        Returns
+        -------
+
+        """
+        presence_columns = [label + "_presence" for label in self.labels]
+        missing_columns = [column for column in presence_columns
+                           if column not in gt_df.columns]
+        if missing_columns:
+            raise ValueError("Missing ground truth columns: {}".format(
+                ", ".join(missing_columns)))
+
+        gt_filenames = gt_df["audio_filename"].values
+        pred_filenames, y_pred, is_found = read_prediction_table(pred_df,
+                                                                 self.labels)
+        for tag, found in zip(self.labels, is_found):
+            if not found:
+                warnings.warn("Column not found: " + tag)
+
+        row_idxs = get_row_order(pred_filenames, gt_filenames)
+        if pred_filenames[row_idxs].tolist() != gt_filenames.tolist():
+            raise ValueError("File mismatch between ground truth and "
+                             "prediction table.")
+
+        self.update(gt_filenames, gt_df[presence_columns].values,
+                    y_pred[row_idxs])
+
+    def update_annotations(self, pred_df, annotation_df):
+        """
+        Add a batch of files to the evaluation from rows of the annotation
+        file of the dataset. Only the ground truth (annotator 0 of the
+        validate split) is used.
+
+        Parameters
+        ----------
+        pred_df
+            Predictions of the files, with the layout of the output files
+            of `classify.py`.
+        annotation_df
+            Annotations of the files, with the layout of the annotation
+            file of the dataset.
+
+        Returns
+        -------
+
+        """
+        is_gt = (annotation_df["annotator_id"].values == 0) \
+            & (annotation_df["split"].values == "validate")
+        self.update_tables(pred_df, annotation_df[is_gt])
+
+    def evaluate(self):
+        """
+        Compute the precision-recall curve of each coarse category on the
+        files seen so far.
+
+        Returns
+        -------
+        df_dict
+            As returned by `metrics.evaluate_df`.
+
+        """
+        df_dict = {}
+        for coarse_id, bins in zip(self.coarse_ids, self.bins):
+            thresholds, counts = counts_from_bins(bins, self.edges)
+            df_dict[coarse_id] = build_eval_df(thresholds, counts)
+        return df_dict
+
+    def micro_auprc(self):
+        """
+        Compute the micro-averaged AUPRC on the files seen so far.
+
+        Returns
+        -------
+        auprc
+
+        """
+        return micro_averaged_auprc(self.evaluate())
+
+    def macro_auprc(self):
+        """
+        Compute the macro-averaged AUPRC on the files seen so far.
+
+        Returns
+        -------
+        auprc
+
+        """
+        return macro_averaged_auprc(self.evaluate())
+
+    def summary(self):
+        """
+        Compute the current metrics and bounds of their deviation from the
+        exact metrics.
+
+        Returns
+        -------
+        summary
+
+        """
+        df_dict = self.evaluate()
+        micro_bound, macro_bound, _ = binned_auprc_bounds(df_dict)
+        return {
+            'num_files': self.num_files,
+            'micro_auprc': float(micro_averaged_auprc(df_dict)),
+            'macro_auprc': float(macro_averaged_auprc(df_dict)),
+            'micro_auprc_bound': float(micro_bound),
+            'macro_auprc_bound': float(macro_bound),
+        }
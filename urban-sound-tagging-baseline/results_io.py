@@ -0,0 +1,168 @@
+import gzip
+import json
+import os
+import numpy as np
+from inference import MLPPredictor
+
+
+RESULTS_FILENAME = "results.npz"
+SUMMARY_FILENAME = "results_summary.json"
+MODEL_FILENAME = "model.npz"
+SPLITS = ('train', 'test')
+
+
+def save_results(results_dir, results, file_list, file_idxs, labels=None):
+    """
+    Save model predictions and training history as a compressed .npz bundle,
+    with a small JSON summary next to it.
+
+    Parameters
+    ----------
+    results_dir
+        Directory to write the results to.
+
+    results
+        Dictionary with file-level predictions for each aggregation type of
+        each split (e.g. `results['test']['mean']`) and the training
+        history in `results['train_history']`. The predictions of a split
+        may be omitted, e.g. to compute them later with `load_results`.
+
+    file_list
+        List of all audio filenames.
+
+    file_idxs
+        Dictionary mapping each split to the indices into `file_list` of
+        its files, in the order of the predictions. They are saved even for
+        the splits without predictions.
+
+    labels
+        Names of the predicted labels.
+
+    Returns
+    -------
+
+    """
+    arrays = {}
+    summary = {'splits': {}}
+
+    for split in SPLITS:
+        if split not in file_idxs:
+            continue
+
+        idxs = np.asarray(file_idxs[split], dtype=int)
+        arrays['{}_file_idxs'.format(split)] = idxs
+        arrays['{}_audio_filename'.format(split)] = \
+            np.array([file_list[idx] for idx in idxs])
+
+        split_results = results.get(split) or {}
+        for aggregation_type, y_pred in split_results.items():
+            arrays['{}_{}'.format(split, aggregation_type)] = np.asarray(y_pred)
+
+        summary['splits'][split] = {
+            'num_files': len(idxs),
+            'aggregation_types': sorted(split_results.keys())
+        }
+
+    history = results.get('train_history') or {}
+    for key, values in history.items():
+        arrays['history_{}'.format(key)] = np.asarray(values, dtype=np.float64)
+
+    summary['history'] = {
+        'num_epochs': max([len(values) for values in history.values()] or [0]),
+        'final': {key: float(values[-1]) for key, values in history.items()
+                  if len(values) > 0}
+    }
+
+    if labels is not None:
+        arrays['labels'] = np.array(labels)
+        summary['labels'] = list(labels)
+
+    os.makedirs(results_dir, exist_ok=True)
+    np.savez_compressed(os.path.join(results_dir, RESULTS_FILENAME), **arrays)
+    with open(os.path.join(results_dir, SUMMARY_FILENAME), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+
+def predict_split(results_dir, audio_filenames, emb_dir):
+    """
+    Compute the file-level predictions of the model exported to the results
+    directory, from the embeddings of the given files.
+
+    Parameters
+    ----------
+    results_dir
+    audio_filenames
+    emb_dir
+
+    Returns
+    -------
+    results
+        Dictionary with the predictions of each aggregation type.
+
+    """
+    model = MLPPredictor.load(os.path.join(results_dir, MODEL_FILENAME))
+
+    embeddings = []
+    for filename in audio_filenames:
+        emb_path = os.path.join(emb_dir, os.path.splitext(filename)[0] + '.npy.gz')
+        with gzip.open(emb_path, 'rb') as f:
+            embeddings.append(np.load(f))
+
+    return model.predict_files(embeddings)
+
+
+def load_results(results_dir, emb_dir=None):
+    """
+    Load results saved with `save_results`, or a legacy `results.json`.
+
+    The predictions of splits that were not saved (by default, the train
+    split) are computed when the embedding directory is given, with the
+    model exported to `model.npz` next to the results.
+
+    Parameters
+    ----------
+    results_dir
+    emb_dir
+
+    Returns
+    -------
+    results
+        Dictionary with the same structure that was passed to
+        `save_results`, with predictions as arrays. The file indices and
+        filenames of each split are available under `'{split}_file_idxs'`
+        and `'{split}_audio_filename'`, and the labels under `'labels'`.
+
+    """
+    npz_path = os.path.join(results_dir, RESULTS_FILENAME)
+    if not os.path.exists(npz_path):
+        with open(os.path.join(results_dir, "results.json"), 'r') as f:
+            results = json.load(f)
+        for split in SPLITS:
+            if split in results:
+                results[split] = {aggregation_type: np.array(y_pred)
+                                  for aggregation_type, y_pred in results[split].items()}
+        return results
+
+    results = {'train_history': {}}
+    with np.load(npz_path) as data:
+        for key in data.files:
+            if key.startswith('history_'):
+                results['train_history'][key[len('history_'):]] = \
+                    data[key].tolist()
+            elif key == 'labels':
+                results['labels'] = data[key].tolist()
+            else:
+                split, name = key.split('_', 1)
+                if name in ('file_idxs', 'audio_filename'):
+                    results[key] = data[key]
+                else:
+                    results.setdefault(split, {})[name] = data[key]
+
+    if emb_dir is not None:
+        for split in SPLITS:
+            filenames_key = '{}_audio_filename'.format(split)
+            if split not in results and filenames_key in results:
+                results[split] = predict_split(results_dir,
+                                               results[filenames_key], emb_dir)
+
+    return results
@@ -0,0 +1,594 @@
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import shutil
+import subprocess
+import sys
+import time
+import pandas as pd
+
+from dataset_cache import hash_file
+
+
+# Directory of the scripts run by the stages
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Name of the run directory of the models trained by the pipeline, so that
+# the paths of their outputs do not change from one run to the next
+PIPELINE_TIMESTAMP = "pipeline"
+
+# Bump when the way stages are fingerprinted changes
+STAMP_VERSION = 1
+
+
+## HASHING
+
+def hash_tree(path, file_hashes):
+    """
+    Compute the SHA-1 hash of the contents of a file, or of all the files
+    in a directory and their relative paths. Files whose size and
+    modification time have not changed since they were last hashed are not
+    read again.
+
+    Parameters
+    ----------
+    path
+    file_hashes
+        Dictionary from absolute file paths to their size, modification
+        time and hash, updated in place.
+
+    Returns
+    -------
+    digest
+        Hash, or None if the path does not exist.
+
+    """
+    def hash_one(file_path):
+        stat = os.stat(file_path)
+        entry = file_hashes.get(file_path)
+        if entry is None or entry[:2] != [stat.st_size, stat.st_mtime_ns]:
+            entry = [stat.st_size, stat.st_mtime_ns, hash_file(file_path)]
+            file_hashes[file_path] = entry
+        return entry[2]
+
+    path = os.path.abspath(path)
+    if os.path.isfile(path):
+        return hash_one(path)
+    if not os.path.isdir(path):
+        return None
+
+    sha = hashlib.sha1()
+    for root, dirs, files in os.walk(path):
+        # Skip hidden directories and bytecode caches
+        dirs[:] = sorted(d for d in dirs
+                         if not d.startswith('.') and d != '__pycache__')
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            sha.update("{}:{}\n".format(os.path.relpath(file_path, path),
+                                        hash_one(file_path)).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def get_input_digest(stage, file_hashes):
+    """
+    Compute the fingerprint of the command and inputs of a stage.
+
+    Parameters
+    ----------
+    stage
+    file_hashes
+
+    Returns
+    -------
+    digest
+
+    """
+    components = [str(STAMP_VERSION), json.dumps(stage['command'])]
+    for path in stage['inputs']:
+        components.append("{}:{}".format(os.path.abspath(path),
+                                         hash_tree(path, file_hashes)))
+    return hashlib.sha1("|".join(components).encode('utf-8')).hexdigest()
+
+
+def get_output_digests(stage, file_hashes):
+    """
+    Hash the outputs of a stage.
+
+    Parameters
+    ----------
+    stage
+    file_hashes
+
+    Returns
+    -------
+    digests
+
+    """
+    return {path: hash_tree(path, file_hashes) for path in stage['outputs']}
+
+
+## STAGES
+
+def make_stage(name, script, args, inputs, outputs, deps=(), threads=1,
+               modules=()):
+    """
+    Describe a stage of the pipeline that runs one of the scripts.
+
+    Parameters
+    ----------
+    name
+    script
+        Script of this directory run by the stage.
+    args
+        Command-line arguments of the script.
+    inputs
+        Files and directories read by the stage.
+    outputs
+        Files and directories written by the stage. They are removed before
+        the stage runs.
+    deps
+        Names of the stages producing the inputs.
+    threads
+        Number of CPU threads used by the stage.
+    modules
+        Modules of this directory imported by the script, which are also
+        inputs of the stage.
+
+    Returns
+    -------
+    stage
+
+    """
+    code_paths = [os.path.join(SCRIPT_DIR, script)] \
+        + [os.path.join(SCRIPT_DIR, module) for module in modules]
+    return {
+        'name': name,
+        'command': [script] + [str(arg) for arg in args],
+        'inputs': list(inputs) + code_paths,
+        'outputs': list(outputs),
+        'deps': list(deps),
+        'threads': threads,
+    }
+
+
+def make_baseline_stages(annotation_path, taxonomy_path, dataset_dir,
+                         vggish_resource_dir, features_dir, output_dir,
+                         n_cpus):
+    """
+    Describe the stages that replicate the baseline: extracting the
+    embeddings, then training and evaluating a fine-level and a
+    coarse-level model.
+
+    Parameters
+    ----------
+    annotation_path
+    taxonomy_path
+    dataset_dir
+    vggish_resource_dir
+    features_dir
+    output_dir
+    n_cpus
+
+    Returns
+    -------
+    stages
+
+    """
+    # Stages run from this directory
+    annotation_path, taxonomy_path, dataset_dir, vggish_resource_dir, \
+        features_dir, output_dir = [
+            os.path.abspath(path) for path in (
+                annotation_path, taxonomy_path, dataset_dir,
+                vggish_resource_dir, features_dir, output_dir)]
+
+    emb_dir = os.path.join(features_dir, 'vggish')
+    train_modules = ('metrics.py', 'inference.py', 'dataset_cache.py',
+                     'results_io.py', 'taxonomy.py')
+    eval_modules = ('metrics.py', 'bootstrap.py', 'taxonomy.py')
+
+    stages = [
+        make_stage('extract', 'extract_embedding.py',
+                   [annotation_path, dataset_dir, features_dir,
+                    vggish_resource_dir],
+                   inputs=[annotation_path, dataset_dir, vggish_resource_dir],
+                   outputs=[emb_dir],
+                   threads=n_cpus,
+                   modules=('vggish',)),
+    ]
+
+    # The two levels are independent, so they share the CPUs
+    train_threads = max(1, n_cpus // 2)
+    for label_mode in ("fine", "coarse"):
+        exp_id = "baseline_" + label_mode
+        results_dir = os.path.join(output_dir, exp_id, PIPELINE_TIMESTAMP)
+        eval_path = os.path.join(output_dir, exp_id + "_evaluation.json")
+
+        stages.append(make_stage(
+            'train_' + label_mode, 'classify.py',
+            [annotation_path, taxonomy_path, emb_dir, output_dir, exp_id,
+             '--label_mode', label_mode,
+             '--timestamp', PIPELINE_TIMESTAMP,
+             '--intra_op_threads', train_threads,
+             '--inter_op_threads', 1],
+            inputs=[annotation_path, taxonomy_path, emb_dir],
+            outputs=[results_dir],
+            deps=['extract'],
+            threads=train_threads,
+            modules=train_modules))
+
+        stages.append(make_stage(
+            'evaluate_' + label_mode, 'evaluate_predictions.py',
+            [os.path.join(results_dir, 'output_mean.csv'), annotation_path,
+             taxonomy_path, '--output_path', eval_path],
+            inputs=[os.path.join(results_dir, 'output_mean.csv'),
+                    annotation_path, taxonomy_path],
+            outputs=[eval_path],
+            deps=['train_' + label_mode],
+            modules=eval_modules))
+
+    return stages
+
+
+def select_stages(stages, names):
+    """
+    Restrict the pipeline to the given stages and the stages they depend on.
+
+    Parameters
+    ----------
+    stages
+    names
+
+    Returns
+    -------
+    stages
+
+    """
+    stage_dict = {stage['name']: stage for stage in stages}
+    selected = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in stage_dict:
+            raise ValueError("Invalid stage: {}".format(name))
+        if name not in selected:
+            selected.add(name)
+            pending.extend(stage_dict[name]['deps'])
+    return [stage for stage in stages if stage['name'] in selected]
+
+
+def check_stages(stages):
+    """
+    Check that the stages form a DAG whose dependencies are all defined.
+    Raises a ValueError otherwise.
+
+    Parameters
+    ----------
+    stages
+
+    Returns
+    -------
+
+    """
+    names = [stage['name'] for stage in stages]
+    if len(set(names)) != len(names):
+        raise ValueError("Stage names must be unique.")
+
+    deps = {stage['name']: stage['deps'] for stage in stages}
+    for name, stage_deps in deps.items():
+        for dep in stage_deps:
+            if dep not in deps:
+                raise ValueError("Unknown dependency of {}: {}".format(name,
+                                                                       dep))
+
+    # Remove stages without remaining dependencies until none are left
+    remaining = dict(deps)
+    while remaining:
+        ready = [name for name, stage_deps in remaining.items()
+                 if not any(dep in remaining for dep in stage_deps)]
+        if not ready:
+            raise ValueError("Cyclic dependencies between stages: {}".format(
+                ", ".join(sorted(remaining))))
+        for name in ready:
+            del remaining[name]
+
+
+## STAMPS
+
+def get_stamp_path(state_dir, stage):
+    return os.path.join(state_dir, "stamps", stage['name'] + ".json")
+
+
+def is_up_to_date(stage, state_dir, input_digest, file_hashes):
+    """
+    Check whether a stage already ran with the same command and inputs, and
+    its outputs have not changed since.
+
+    Parameters
+    ----------
+    stage
+    state_dir
+    input_digest
+    file_hashes
+
+    Returns
+    -------
+    up_to_date
+
+    """
+    stamp_path = get_stamp_path(state_dir, stage)
+    if not os.path.exists(stamp_path):
+        return False
+
+    with open(stamp_path, 'r') as f:
+        stamp = json.load(f)
+
+    if stamp['input_digest'] != input_digest:
+        return False
+
+    output_digests = get_output_digests(stage, file_hashes)
+    return all(digest is not None for digest in output_digests.values()) \
+        and output_digests == stamp['output_digests']
+
+
+def write_stamp(stage, state_dir, input_digest, file_hashes, run_time):
+    """
+    Record that a stage ran successfully.
+
+    Parameters
+    ----------
+    stage
+    state_dir
+    input_digest
+    file_hashes
+    run_time
+
+    Returns
+    -------
+
+    """
+    stamp_path = get_stamp_path(state_dir, stage)
+    os.makedirs(os.path.dirname(stamp_path), exist_ok=True)
+    stamp = {
+        'command': stage['command'],
+        'input_digest': input_digest,
+        'output_digests': get_output_digests(stage, file_hashes),
+        'run_time': run_time,
+    }
+    with open(stamp_path, 'w') as f:
+        json.dump(stamp, f, indent=2)
+
+
+## RUNNER
+
+def run_stage(stage, state_dir):
+    """
+    Run the command of a stage, with its output written to a log file and
+    its BLAS libraries bounded to its threads.
+
+    Parameters
+    ----------
+    stage
+    state_dir
+
+    Returns
+    -------
+    returncode
+    run_time
+
+    """
+    for path in stage['outputs']:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    env = dict(os.environ)
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        env[var] = str(stage['threads'])
+
+    log_dir = os.path.join(state_dir, "logs")
+    os.makedirs(log_dir, exist_ok=True)
+    log_path = os.path.join(log_dir, stage['name'] + ".log")
+
+    command = [sys.executable] + stage['command']
+    start_time = time.time()
+    with open(log_path, 'w') as log_file:
+        returncode = subprocess.call(command, cwd=SCRIPT_DIR, env=env,
+                                     stdout=log_file, stderr=subprocess.STDOUT)
+    return returncode, time.time() - start_time
+
+
+def load_file_hashes(state_dir):
+    path = os.path.join(state_dir, "file_hashes.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_file_hashes(state_dir, file_hashes):
+    os.makedirs(state_dir, exist_ok=True)
+    path = os.path.join(state_dir, "file_hashes.json")
+    tmp_path = "{}.tmp{}".format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(file_hashes, f)
+    os.replace(tmp_path, path)
+
+
+def run_pipeline(stages, state_dir, n_cpus=None, force=False, dry_run=False):
+    """
+    Run the stages of a pipeline in the order of their dependencies.
+
+    A stage is skipped when it already ran with the same command and inputs,
+    as identified by the hashes of their contents, and its outputs are
+    unchanged. Stages whose dependencies are done run concurrently, as long
+    as their threads fit in the CPU budget. A stage that needs more threads
+    than the budget runs alone.
+
+    Parameters
+    ----------
+    stages
+    state_dir
+        Directory of the stamps, logs and file hashes of the pipeline.
+    n_cpus
+    force
+        Run every stage, even if it is up to date.
+    dry_run
+        Only report which stages are up to date. Stages after a stage that
+        would run are reported as pending.
+
+    Returns
+    -------
+    report_df
+        DataFrame with the status ('skipped', 'ran', 'failed', 'blocked' or
+        'pending') and run time of each stage.
+
+    """
+    check_stages(stages)
+    if n_cpus is None:
+        n_cpus = mp.cpu_count()
+
+    file_hashes = load_file_hashes(state_dir)
+    status = {stage['name']: None for stage in stages}
+    run_times = {stage['name']: 0.0 for stage in stages}
+    running = {}
+    used_threads = 0
+    pipeline_start_time = time.time()
+
+    with concurrent.futures.ThreadPoolExecutor(len(stages)) as executor:
+        while True:
+            # Stages whose dependencies did not all succeed never run
+            for stage in stages:
+                if status[stage['name']] is None and any(
+                        status[dep] in ('failed', 'blocked', 'pending')
+                        for dep in stage['deps']):
+                    status[stage['name']] = \
+                        'pending' if dry_run else 'blocked'
+
+            ready = [stage for stage in stages
+                     if status[stage['name']] is None
+                     and stage['name'] not in running
+                     and all(status[dep] in ('skipped', 'ran')
+                             for dep in stage['deps'])]
+
+            for stage in ready:
+                input_digest = get_input_digest(stage, file_hashes)
+                if not force and is_up_to_date(stage, state_dir, input_digest,
+                                               file_hashes):
+                    status[stage['name']] = 'skipped'
+                    print("* {}: up to date.".format(stage['name']))
+                    continue
+                if dry_run:
+                    status[stage['name']] = 'pending'
+                    print("* {}: would run.".format(stage['name']))
+                    continue
+
+                threads = min(stage['threads'], n_cpus)
+                if running and used_threads + threads > n_cpus:
+                    # Wait for running stages to free enough threads
+                    continue
+
+                print("* {}: running with {} threads.".format(stage['name'],
+                                                              threads))
+                future = executor.submit(run_stage, stage, state_dir)
+                running[stage['name']] = (future, input_digest, threads)
+                used_threads += threads
+
+            save_file_hashes(state_dir, file_hashes)
+
+            if not running:
+                # Skipped stages may have made other stages ready
+                if any(value is None for value in status.values()):
+                    continue
+                break
+
+            done, _ = concurrent.futures.wait(
+                [future for future, _, _ in running.values()],
+                return_when=concurrent.futures.FIRST_COMPLETED)
+
+            for name in [name for name, (future, _, _) in running.items()
+                         if future in done]:
+                future, input_digest, threads = running.pop(name)
+                used_threads -= threads
+                stage = next(stage for stage in stages
+                             if stage['name'] == name)
+                returncode, run_times[name] = future.result()
+
+                if returncode == 0:
+                    write_stamp(stage, state_dir, input_digest, file_hashes,
+                                run_times[name])
+                    status[name] = 'ran'
+                    print("* {}: done in {:.1f}s.".format(name,
+                                                          run_times[name]))
+                else:
+                    status[name] = 'failed'
+                    print("* {}: failed with exit code {}, see {}.".format(
+                        name, returncode,
+                        os.path.join(state_dir, "logs", name + ".log")))
+
+    save_file_hashes(state_dir, file_hashes)
+    print("* Pipeline finished in {:.1f}s.".format(
+        time.time() - pipeline_start_time))
+
+    return pd.DataFrame({
+        'stage': [stage['name'] for stage in stages],
+        'status': [status[stage['name']] for stage in stages],
+        'run_time': [run_times[stage['name']] for stage in stages],
+    })
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="""
+        Replicate the baseline: extract the embeddings, then train and
+        evaluate a fine-level and a coarse-level model. Stages whose inputs
+        have not changed since their last run are skipped, and the two
+        levels run concurrently.
+        """)
+    parser.add_argument("annotation_path")
+    parser.add_argument("taxonomy_path")
+    parser.add_argument("dataset_dir")
+    parser.add_argument("vggish_resource_dir")
+    parser.add_argument("features_dir")
+    parser.add_argument("output_dir")
+
+    parser.add_argument("--n_cpus", type=int, default=None,
+                        help="Number of CPU threads shared by the stages "
+                             "that run concurrently.")
+    parser.add_argument("--stages", type=str, nargs='+', default=None,
+                        help="Only run these stages and the stages they "
+                             "depend on.")
+    parser.add_argument("--state_dir", type=str, default=None,
+                        help="Directory of the stamps and logs of the stages. "
+                             "Defaults to a .pipeline directory in the "
+                             "output directory.")
+    parser.add_argument("--force", action='store_true',
+                        help="Run every stage, even if it is up to date.")
+    parser.add_argument("--dry_run", action='store_true',
+                        help="Only report which stages are up to date.")
+
+    args = parser.parse_args()
+
+    n_cpus = args.n_cpus or mp.cpu_count()
+    stages = make_baseline_stages(args.annotation_path,
+                                  args.taxonomy_path,
+                                  args.dataset_dir,
+                                  args.vggish_resource_dir,
+                                  args.features_dir,
+                                  args.output_dir,
+                                  n_cpus)
+    if args.stages:
+        stages = select_stages(stages, args.stages)
+
+    state_dir = args.state_dir or os.path.join(args.output_dir, ".pipeline")
+    report_df = run_pipeline(stages, state_dir, n_cpus=n_cpus,
+                             force=args.force, dry_run=args.dry_run)
+
+    os.makedirs(state_dir, exist_ok=True)
+    report_df.to_csv(os.path.join(state_dir, "report.csv"), index=False)
+    print(report_df.to_string(index=False))
+
+    if any(report_df['status'].isin(['failed', 'blocked'])):
+        parser.exit(1)
@@ -0,0 +1,329 @@
+import argparse
+import datetime
+import itertools
+import json
+import multiprocessing as mp
+import os
+import time
+import numpy as np
+import pandas as pd
+
+from classify import load_prepared_framewise_data, fit_framewise, \
+                     configure_session, write_manifest
+from inference import pack_embeddings, POOLING_TYPES
+from metrics import evaluate_arrays, micro_averaged_auprc, \
+                    macro_averaged_auprc, parse_ground_truth
+
+
+# Hyperparameters that can be swept over
+SWEEP_PARAMS = ('hidden_layer_size', 'num_hidden_layers', 'l2_reg',
+                'learning_rate', 'batch_size')
+
+# Process-local state of each sweep worker, set up by `init_worker`
+_worker_state = {}
+
+
+## SHARED MEMORY
+
+def to_shared_array(arr):
+    """
+    Copy an array into a shared memory buffer.
+
+    Parameters
+    ----------
+    arr
+
+    Returns
+    -------
+    shared_arr
+
+    """
+    arr = np.ascontiguousarray(arr)
+    buf = mp.RawArray('b', max(arr.nbytes, 1))
+    np.frombuffer(buf, dtype=arr.dtype, count=arr.size)[:] = arr.ravel()
+    return buf, arr.dtype.str, arr.shape
+
+
+def from_shared_array(shared_arr):
+    """
+    Get a NumPy view of an array in shared memory.
+
+    Parameters
+    ----------
+    shared_arr
+
+    Returns
+    -------
+    arr
+
+    """
+    buf, dtype, shape = shared_arr
+    size = int(np.prod(shape))
+    return np.frombuffer(buf, dtype=dtype, count=size).reshape(shape)
+
+
+## WORKERS
+
+def init_worker(shared_arrays, dataset, scaler, eval_config, num_threads):
+    """
+    Set up a sweep worker process with views of the shared data.
+
+    Parameters
+    ----------
+    shared_arrays
+    dataset
+    scaler
+    eval_config
+    num_threads
+
+    Returns
+    -------
+
+    """
+    arrays = {name: from_shared_array(shared_arr)
+              for name, shared_arr in shared_arrays.items()}
+
+    # Embeddings are views into the packed frames of all files
+    dataset = dict(dataset)
+    dataset['embeddings'] = np.split(arrays['X_all'], arrays['offsets'][1:-1])
+
+    _worker_state.update(arrays=arrays, dataset=dataset, scaler=scaler,
+                         eval_config=eval_config, num_threads=num_threads)
+
+
+def run_job(job):
+    """
+    Train and score a single configuration of the sweep.
+
+    Parameters
+    ----------
+    job
+
+    Returns
+    -------
+    summary
+
+    """
+    run_idx, params, results_dir = job
+    arrays = _worker_state['arrays']
+    eval_config = _worker_state['eval_config']
+
+    configure_session(_worker_state['num_threads'], 1)
+
+    dataset = _worker_state['dataset']
+
+    # Record the files and parameters of the run, so that it can be used
+    # as a warm start by `classify.train_incremental`
+    write_manifest(results_dir, dataset['file_list'], dataset['file_digests'])
+    kwarg_file = os.path.join(results_dir, "hyper_params.json")
+    with open(kwarg_file, 'w') as f:
+        json.dump(params, f, indent=2)
+
+    start_time = time.time()
+    results = fit_framewise(dataset,
+                            arrays['X_train'], arrays['y_train'],
+                            arrays['X_valid'], arrays['y_valid'],
+                            _worker_state['scaler'], results_dir, **params)
+    train_time = time.time() - start_time
+
+    # Score the predictions in memory rather than from the output file
+    df_dict = evaluate_arrays(results['test'][eval_config['aggregation_type']],
+                              eval_config['test_filenames'], dataset['labels'],
+                              eval_config['gt_df'], dataset['taxonomy'],
+                              params['label_mode'])
+
+    summary = {'run': run_idx}
+    summary.update({name: params.get(name) for name in SWEEP_PARAMS})
+    summary['micro_auprc'] = micro_averaged_auprc(df_dict)
+    summary['macro_auprc'] = macro_averaged_auprc(df_dict)
+    summary['train_time'] = train_time
+    summary['results_dir'] = results_dir
+
+    print("* Run {} finished: micro AUPRC {:.4f} in {:.1f}s".format(
+        run_idx, summary['micro_auprc'], train_time))
+
+    return summary
+
+
+## SWEEP
+
+def run_sweep(annotation_path, taxonomy_path, emb_dir, output_dir, exp_id,
+              param_grid, label_mode="fine", num_epochs=100, patience=20,
+              standardize=True, solver="adam", pooling=None, lr_scaling=None,
+              warmup_epochs=0, data_generator=False, monitor="val_loss",
+              aggregation_type="mean", n_jobs=None, threads_per_job=1,
+              cache_dir=None, timestamp=None):
+    """
+    Train models for every combination of hyperparameters in the grid,
+    loading and preparing the data only once.
+
+    Parameters
+    ----------
+    annotation_path
+    taxonomy_path
+    emb_dir
+    output_dir
+    exp_id
+    param_grid
+    label_mode
+    num_epochs
+    patience
+    standardize
+    solver
+    pooling
+    lr_scaling
+    warmup_epochs
+    data_generator
+    monitor
+    aggregation_type
+    n_jobs
+    threads_per_job
+    cache_dir
+    timestamp
+
+    Returns
+    -------
+    summary_df
+
+    """
+    if not timestamp:
+        timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+
+    if n_jobs is None:
+        n_jobs = max(1, mp.cpu_count() // threads_per_job)
+
+    dataset, X_train, y_train, X_valid, y_valid, scaler \
+        = load_prepared_framewise_data(annotation_path, taxonomy_path, emb_dir,
+                                       label_mode=label_mode,
+                                       standardize=standardize,
+                                       pooling=pooling, cache_dir=cache_dir)
+
+    X_all, offsets = pack_embeddings(dataset['embeddings'],
+                                     np.arange(len(dataset['file_list'])))
+    dataset['embeddings'] = None
+
+    shared_arrays = {
+        'X_train': to_shared_array(X_train),
+        'y_train': to_shared_array(y_train),
+        'X_valid': to_shared_array(X_valid),
+        'y_valid': to_shared_array(y_valid),
+        'X_all': to_shared_array(X_all),
+        'offsets': to_shared_array(offsets),
+    }
+    del X_train, y_train, X_valid, y_valid, X_all
+
+    eval_config = {
+        'gt_df': parse_ground_truth(annotation_path, dataset['taxonomy']),
+        'test_filenames': [dataset['file_list'][idx]
+                           for idx in dataset['test_file_idxs']],
+        'aggregation_type': aggregation_type,
+    }
+
+    common_params = {
+        'label_mode': label_mode,
+        'num_epochs': num_epochs,
+        'patience': patience,
+        'solver': solver,
+        'pooling': pooling,
+        'lr_scaling': lr_scaling,
+        'warmup_epochs': warmup_epochs,
+        'data_generator': data_generator,
+        'monitor': monitor,
+    }
+
+    param_names = sorted(param_grid)
+    jobs = []
+    for run_idx, values in enumerate(itertools.product(
+            *[param_grid[name] for name in param_names])):
+        params = dict(common_params)
+        params.update(zip(param_names, values))
+        results_dir = os.path.join(output_dir,
+                                   "{}_{:03d}".format(exp_id, run_idx),
+                                   timestamp)
+        jobs.append((run_idx, params, results_dir))
+
+    print("* Running {} configurations with {} workers.".format(len(jobs),
+                                                               n_jobs))
+
+    # Bound the threads of BLAS libraries in the workers
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[var] = str(threads_per_job)
+
+    ctx = mp.get_context('spawn')
+    with ctx.Pool(n_jobs, initializer=init_worker,
+                  initargs=(shared_arrays, dataset, scaler, eval_config,
+                            threads_per_job)) as pool:
+        summaries = list(pool.imap_unordered(run_job, jobs))
+
+    summary_df = pd.DataFrame(summaries).sort_values('micro_auprc',
+                                                     ascending=False)
+
+    summary_dir = os.path.join(output_dir, exp_id, timestamp)
+    os.makedirs(summary_dir, exist_ok=True)
+    summary_df.to_csv(os.path.join(summary_dir, "summary.csv"), index=False)
+    with open(os.path.join(summary_dir, "summary.json"), 'w') as f:
+        json.dump(summary_df.to_dict(orient='records'), f, indent=2)
+
+    return summary_df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("annotation_path")
+    parser.add_argument("taxonomy_path")
+    parser.add_argument("emb_dir", type=str)
+    parser.add_argument("output_dir", type=str)
+    parser.add_argument("exp_id", type=str)
+
+    parser.add_argument("--hidden_layer_size", type=int, nargs='+', default=[128])
+    parser.add_argument("--num_hidden_layers", type=int, nargs='+', default=[0])
+    parser.add_argument("--learning_rate", type=float, nargs='+', default=[1e-3])
+    parser.add_argument("--l2_reg", type=float, nargs='+', default=[1e-5])
+    parser.add_argument("--batch_size", type=int, nargs='+', default=[64])
+    parser.add_argument("--num_epochs", type=int, default=100)
+    parser.add_argument("--patience", type=int, default=20)
+    parser.add_argument("--no_standardize", action='store_true')
+    parser.add_argument("--label_mode", type=str, choices=["fine", "coarse"],
+                        default='fine')
+    parser.add_argument("--solver", type=str, choices=["adam", "lbfgs"],
+                        default='adam')
+    parser.add_argument("--pooling", type=str, choices=POOLING_TYPES,
+                        default=None)
+    parser.add_argument("--lr_scaling", type=str, choices=["linear", "sqrt"],
+                        default=None)
+    parser.add_argument("--warmup_epochs", type=int, default=0)
+    parser.add_argument("--data_generator", action='store_true')
+    parser.add_argument("--monitor", type=str, choices=["val_loss", "val_auprc"],
+                        default='val_loss')
+    parser.add_argument("--aggregation_type", type=str,
+                        choices=["max", "mean", "softmax"], default='mean')
+    parser.add_argument("--n_jobs", type=int, default=None)
+    parser.add_argument("--threads_per_job", type=int, default=1)
+    parser.add_argument("--cache_dir", type=str, default=None)
+
+    args = parser.parse_args()
+
+    param_grid = {name: getattr(args, name) for name in SWEEP_PARAMS}
+
+    summary_df = run_sweep(args.annotation_path,
+                           args.taxonomy_path,
+                           args.emb_dir,
+                           args.output_dir,
+                           args.exp_id,
+                           param_grid,
+                           label_mode=args.label_mode,
+                           num_epochs=args.num_epochs,
+                           patience=args.patience,
+                           standardize=(not args.no_standardize),
+                           solver=args.solver,
+                           pooling=args.pooling,
+                           lr_scaling=args.lr_scaling,
+                           warmup_epochs=args.warmup_epochs,
+                           data_generator=args.data_generator,
+                           monitor=args.monitor,
+                           aggregation_type=args.aggregation_type,
+                           n_jobs=args.n_jobs,
+                           threads_per_job=args.threads_per_job,
+                           cache_dir=args.cache_dir)
+
+    print(summary_df.to_string(index=False))
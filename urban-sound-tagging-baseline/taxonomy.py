@@ -0,0 +1,225 @@
+import hashlib
+import os
+import pickle
+import numpy as np
+import oyaml as yaml
+
+
+# Bump when the attributes of compiled taxonomies change
+TAXONOMY_VERSION = 1
+
+# Taxonomies compiled by this process, by the representation of their YAML
+# dictionary
+_compiled_taxonomies = {}
+
+
+class Taxonomy(object):
+    """
+    Taxonomy of the dataset, parsed once into the tags, column names and
+    index arrays used to build targets, losses, output files and metrics.
+
+    Fine tags are listed in the order of the taxonomy, grouped by coarse
+    category, including the incomplete ("X") tags. Coarse indices are
+    positions in the coarse categories of the taxonomy.
+
+    Attributes
+    ----------
+    yaml_dict
+        Taxonomy, as loaded from the YAML file.
+    coarse_ids
+        Coarse ID of each coarse category, e.g. 1.
+    coarse_keys
+        Coarse ID of each coarse category as a string, e.g. "1".
+    coarse_labels
+        Tag of each coarse category, e.g. "1_engine".
+    full_fine_keys
+        Mixed (coarse-fine) ID of each fine tag, e.g. "1-1" or "1-X".
+    full_fine_labels
+        Each fine tag, e.g. "1-1_small-sounding-engine".
+    fine_labels
+        Complete fine tags, which are the outputs of fine-level models.
+    fine_coarse_idxs
+        Coarse index of each fine tag.
+    is_incomplete
+        Whether each fine tag is incomplete.
+    complete_idxs, incomplete_idxs
+        Positions of the complete and incomplete tags among the fine tags.
+    complete_coarse_idxs, incomplete_coarse_idxs
+        Coarse index of each complete and incomplete tag.
+    fine_segment_bounds
+        Fine tags of coarse index i are
+        `fine_segment_bounds[i]:fine_segment_bounds[i + 1]`.
+    complete_segment_bounds
+        Same for the complete tags.
+    coarse_incomplete_idxs
+        Position of the incomplete tag of each coarse category among the
+        fine tags, or -1 if it has none.
+    output_fields
+        Columns of the output files of `classify.py`.
+    coarse_presence_columns, full_fine_presence_columns
+        Columns of the annotation file with the presence of each tag.
+    fine_tag_order
+        Fine tags in alphanumeric order of tag, as in the columns of
+        `metrics.parse_fine_prediction`.
+    missing_incomplete_keys
+        Incomplete mixed IDs of the coarse categories without an
+        incomplete tag, e.g. "7-X".
+    category_columns
+        Columns of `metrics.parse_fine_prediction` evaluated for each coarse
+        ID at the fine level: the complete fine tags of the category, in
+        alphanumeric order.
+
+    """
+    def __init__(self, yaml_dict):
+        if [str(coarse_id) for coarse_id in yaml_dict['fine']] \
+                != [str(coarse_id) for coarse_id in yaml_dict['coarse']]:
+            raise ValueError("The fine tags of the taxonomy must be grouped by "
+                             "coarse category, in the order of the coarse "
+                             "categories.")
+
+        self.yaml_dict = yaml_dict
+        self.coarse_ids = list(yaml_dict['coarse'])
+        self.coarse_keys = [str(coarse_id) for coarse_id in self.coarse_ids]
+        self.coarse_labels = ["_".join([str(coarse_id), coarse_name])
+                              for coarse_id, coarse_name
+                              in yaml_dict['coarse'].items()]
+
+        self.full_fine_keys = []
+        self.full_fine_labels = []
+        fine_coarse_idxs = []
+        is_incomplete = []
+        for coarse_idx, fine_dict in enumerate(yaml_dict['fine'].values()):
+            coarse_key = self.coarse_keys[coarse_idx]
+            for fine_id, fine_name in fine_dict.items():
+                mixed_key = "-".join([coarse_key, str(fine_id)])
+                self.full_fine_keys.append(mixed_key)
+                self.full_fine_labels.append("_".join([mixed_key, fine_name]))
+                fine_coarse_idxs.append(coarse_idx)
+                is_incomplete.append(str(fine_id) == 'X')
+
+        num_coarse = len(self.coarse_ids)
+        self.fine_coarse_idxs = np.array(fine_coarse_idxs, dtype=int)
+        self.is_incomplete = np.array(is_incomplete, dtype=bool)
+        self.complete_idxs = np.flatnonzero(~self.is_incomplete)
+        self.incomplete_idxs = np.flatnonzero(self.is_incomplete)
+        self.complete_coarse_idxs = self.fine_coarse_idxs[self.complete_idxs]
+        self.incomplete_coarse_idxs = \
+            self.fine_coarse_idxs[self.incomplete_idxs]
+        self.fine_segment_bounds = np.searchsorted(
+            self.fine_coarse_idxs, np.arange(num_coarse + 1))
+        self.complete_segment_bounds = np.searchsorted(
+            self.complete_coarse_idxs, np.arange(num_coarse + 1))
+        self.coarse_incomplete_idxs = np.full(num_coarse, -1, dtype=int)
+        self.coarse_incomplete_idxs[self.incomplete_coarse_idxs] = \
+            self.incomplete_idxs
+
+        self.fine_labels = [self.full_fine_labels[idx]
+                            for idx in self.complete_idxs]
+        self.output_fields = ["audio_filename"] + self.full_fine_labels \
+            + self.coarse_labels
+        self.coarse_presence_columns = [label + "_presence"
+                                        for label in self.coarse_labels]
+        self.full_fine_presence_columns = [label + "_presence"
+                                           for label in self.full_fine_labels]
+        self.fine_tag_order = np.argsort(np.array(self.full_fine_labels),
+                                         kind='mergesort')
+        self.missing_incomplete_keys = [
+            coarse_key + "-X" for coarse_key, fine_idx
+            in zip(self.coarse_keys, self.coarse_incomplete_idxs)
+            if fine_idx < 0]
+        self.category_columns = {
+            coarse_id: sorted(self.full_fine_keys[idx] for idx
+                              in self.complete_idxs[
+                                  self.complete_coarse_idxs == coarse_idx])
+            for coarse_idx, coarse_id in enumerate(self.coarse_ids)}
+
+    def get_category_columns(self, coarse_id, mode):
+        """
+        List the columns of the tags evaluated for a coarse category: the
+        coarse column (coarse mode), or the complete fine columns of the
+        category in alphanumeric order (fine mode).
+
+        Parameters
+        ----------
+        coarse_id
+        mode
+
+        Returns
+        -------
+        category_columns
+
+        """
+        if mode == "coarse":
+            return [str(coarse_id)]
+        return self.category_columns[coarse_id]
+
+
+def get_taxonomy_cache_path(taxonomy_path, cache_dir):
+    """
+    Get the path of the compiled taxonomy of a YAML file in the cache.
+
+    Parameters
+    ----------
+    taxonomy_path
+    cache_dir
+
+    Returns
+    -------
+    cache_path
+
+    """
+    sha = hashlib.sha1(str(TAXONOMY_VERSION).encode('utf-8'))
+    with open(taxonomy_path, 'rb') as f:
+        sha.update(f.read())
+    return os.path.join(cache_dir, "taxonomy_{}.pkl".format(sha.hexdigest()))
+
+
+def compile_taxonomy(taxonomy, cache_dir=None):
+    """
+    Get the compiled taxonomy of a YAML file or dictionary. Taxonomies are
+    only compiled once per process, and if a cache directory is given,
+    compiled taxonomies of YAML files are pickled there.
+
+    Parameters
+    ----------
+    taxonomy
+        Path to the YAML file of the taxonomy, the taxonomy, or a compiled
+        taxonomy.
+    cache_dir
+
+    Returns
+    -------
+    taxonomy
+
+    """
+    if isinstance(taxonomy, Taxonomy):
+        return taxonomy
+
+    if isinstance(taxonomy, dict):
+        key = repr(taxonomy)
+        if key not in _compiled_taxonomies:
+            _compiled_taxonomies[key] = Taxonomy(taxonomy)
+        return _compiled_taxonomies[key]
+
+    cache_path = None
+    if cache_dir:
+        cache_path = get_taxonomy_cache_path(taxonomy, cache_dir)
+        if os.path.exists(cache_path):
+            with open(cache_path, 'rb') as f:
+                compiled = pickle.load(f)
+            _compiled_taxonomies.setdefault(repr(compiled.yaml_dict), compiled)
+            return compiled
+
+    with open(taxonomy, 'r') as f:
+        compiled = compile_taxonomy(yaml.load(f, Loader=yaml.Loader))
+
+    if cache_path:
+        # Write to a temporary file first so that concurrent runs never
+        # read a partially written cache entry
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = "{}.tmp{}".format(cache_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+
+    return compiled
@@ -0,0 +1,93 @@
+import gzip
+import json
+import os
+import numpy as np
+import oyaml as yaml
+import pytest
+
+pytest.importorskip("keras")
+classify = pytest.importorskip("classify")
+from benchmark_metrics import make_annotations
+
+
+TAXONOMY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "dcase-ust-taxonomy.yaml")
+
+
+def write_dataset(data_dir, n_train=12, n_valid=30, emb_size=128, seed=0):
+    """
+    Write the annotations and embeddings of a tiny synthetic dataset.
+
+    Parameters
+    ----------
+    data_dir
+    n_train
+    n_valid
+    emb_size
+    seed
+
+    Returns
+    -------
+    annotation_df
+    emb_dir
+
+    """
+    with open(TAXONOMY_PATH, 'r') as f:
+        yaml_dict = yaml.load(f, Loader=yaml.Loader)
+
+    annotation_df = make_annotations(yaml_dict, n_train + n_valid, seed=seed)
+    annotation_df.loc[:n_train - 1, 'split'] = 'train'
+    annotation_df.loc[:n_train - 1, 'annotator_id'] = 1
+
+    rng = np.random.RandomState(seed)
+    emb_dir = os.path.join(data_dir, "embeddings")
+    os.makedirs(emb_dir)
+    for filename in annotation_df['audio_filename']:
+        emb_path = os.path.join(emb_dir, os.path.splitext(filename)[0] + '.npy.gz')
+        with gzip.open(emb_path, 'wb') as f:
+            np.save(f, rng.randn(rng.randint(1, 4), emb_size).astype(np.float32))
+
+    return annotation_df, emb_dir
+
+
+def test_warm_start_from_trained_run(tmp_path):
+    data_dir = str(tmp_path)
+    output_dir = os.path.join(data_dir, "output")
+    annotation_df, emb_dir = write_dataset(data_dir)
+    annotation_path = os.path.join(data_dir, "annotations.csv")
+    annotation_df.to_csv(annotation_path, index=False)
+
+    classify.train_framewise(annotation_path, TAXONOMY_PATH, emb_dir,
+                             output_dir, "base", label_mode="coarse",
+                             num_epochs=2, patience=2, learning_rate=1e-3,
+                             timestamp="base")
+    base_dir = os.path.join(output_dir, "base", "base")
+    with open(os.path.join(base_dir, 'hyper_params.json'), 'r') as f:
+        assert json.load(f)['label_mode'] == "coarse"
+
+    # Nothing to fine-tune on unchanged annotations
+    assert classify.train_incremental(annotation_path, TAXONOMY_PATH, emb_dir,
+                                      output_dir, "unchanged", base_dir,
+                                      timestamp="unchanged") is None
+    assert not os.path.exists(os.path.join(output_dir, "unchanged"))
+
+    # Change one annotation row of a training file
+    column = "1_engine_presence"
+    annotation_df.loc[0, column] = 1 - annotation_df.loc[0, column]
+    changed_path = os.path.join(data_dir, "annotations_changed.csv")
+    annotation_df.to_csv(changed_path, index=False)
+
+    summary = classify.train_incremental(changed_path, TAXONOMY_PATH, emb_dir,
+                                         output_dir, "incremental", base_dir,
+                                         num_epochs=1, patience=1,
+                                         timestamp="incremental")
+
+    assert summary['num_changed_files'] == 1
+    assert summary['num_changed_train_files'] == 1
+    assert 0 <= summary['incremental']['micro_auprc'] <= 1
+    assert 0 <= summary['incremental']['macro_auprc'] <= 1
+
+    results_dir = os.path.join(output_dir, "incremental", "incremental")
+    for filename in ('model.npz', 'output_mean.csv', 'hyper_params.json',
+                     'manifest.json', 'incremental_summary.json'):
+        assert os.path.exists(os.path.join(results_dir, filename))
@@ -0,0 +1,106 @@
+import os
+import numpy as np
+import oyaml as yaml
+import pytest
+
+K = pytest.importorskip("keras.backend")
+classify = pytest.importorskip("classify")
+
+
+TAXONOMY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "dcase-ust-taxonomy.yaml")
+
+
+def make_loop_masked_loss(taxonomy):
+    """
+    Create the masked fine-level loss as it was written before it was
+    vectorized, looping over the coarse categories in the graph.
+
+    Parameters
+    ----------
+    taxonomy
+
+    Returns
+    -------
+    masked_loss
+
+    """
+    full_coarse_to_fine_terminal_idxs = np.cumsum(
+        [len(fine_dict) for fine_dict in taxonomy['fine'].values()])
+    incomplete_fine_subidxs = [len(fine_dict) - 1 if 'X' in fine_dict else None
+                               for fine_dict in taxonomy['fine'].values()]
+    coarse_to_fine_end_idxs = np.cumsum([len(fine_dict) - 1 if 'X' in fine_dict else len(fine_dict)
+                                         for fine_dict in taxonomy['fine'].values()])
+
+    def masked_loss(y_true, y_pred):
+        loss = None
+        for coarse_idx in range(len(full_coarse_to_fine_terminal_idxs)):
+            true_terminal_idx = full_coarse_to_fine_terminal_idxs[coarse_idx]
+            true_incomplete_subidx = incomplete_fine_subidxs[coarse_idx]
+            pred_end_idx = coarse_to_fine_end_idxs[coarse_idx]
+
+            if coarse_idx != 0:
+                true_start_idx = full_coarse_to_fine_terminal_idxs[coarse_idx-1]
+                pred_start_idx = coarse_to_fine_end_idxs[coarse_idx-1]
+            else:
+                true_start_idx = 0
+                pred_start_idx = 0
+
+            if true_incomplete_subidx is None:
+                true_end_idx = true_terminal_idx
+
+                sub_true = y_true[:, true_start_idx:true_end_idx]
+                sub_pred = y_pred[:, pred_start_idx:pred_end_idx]
+
+            else:
+                # Don't include incomplete label
+                true_end_idx = true_terminal_idx - 1
+                true_incomplete_idx = true_incomplete_subidx + true_start_idx
+
+                # 1 if not incomplete, 0 if incomplete
+                mask = K.expand_dims(1 - y_true[:, true_incomplete_idx])
+
+                sub_true = y_true[:, true_start_idx:true_end_idx] * mask
+                sub_pred = y_pred[:, pred_start_idx:pred_end_idx] * mask
+
+            if loss is not None:
+                loss += K.sum(K.binary_crossentropy(sub_true, sub_pred))
+            else:
+                loss = K.sum(K.binary_crossentropy(sub_true, sub_pred))
+
+        return loss
+
+    return masked_loss
+
+
+def load_taxonomies():
+    with open(TAXONOMY_PATH, 'r') as f:
+        taxonomy = yaml.load(f, Loader=yaml.Loader)
+
+    # Same taxonomy, with a coarse category without an incomplete tag
+    partial = yaml.load(yaml.dump(taxonomy), Loader=yaml.Loader)
+    first_coarse_id = next(iter(partial['fine']))
+    del partial['fine'][first_coarse_id]['X']
+
+    return [taxonomy, partial]
+
+
+@pytest.mark.parametrize("taxonomy", load_taxonomies())
+@pytest.mark.parametrize("batch_size", [1, 7, 64])
+def test_masked_fine_loss_matches_loop(taxonomy, batch_size):
+    num_full_labels = sum(len(fine_dict)
+                          for fine_dict in taxonomy['fine'].values())
+    num_labels = num_full_labels - sum('X' in fine_dict
+                                       for fine_dict in taxonomy['fine'].values())
+
+    rng = np.random.RandomState(batch_size)
+    y_true = (rng.rand(batch_size, num_full_labels) < 0.3).astype(np.float32)
+    y_pred = rng.uniform(0.01, 0.99,
+                         size=(batch_size, num_labels)).astype(np.float32)
+
+    expected = K.eval(make_loop_masked_loss(taxonomy)(
+        K.constant(y_true), K.constant(y_pred)))
+    actual = K.eval(classify.make_masked_fine_loss(taxonomy)(
+        K.constant(y_true), K.constant(y_pred)))
+
+    np.testing.assert_allclose(actual, expected, rtol=1e-5)